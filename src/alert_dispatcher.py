@@ -0,0 +1,239 @@
+from metrics import metrics
+
+from collections import deque, namedtuple
+from datetime import datetime
+
+import logging
+import queue
+import threading
+import time
+
+
+"""Snapshot of one or more unscheduled outages of a device/circuit.
+
+Plugins get these instead of UnscheduledOutage rows when alerts are
+dispatched in the background: they can be used from any thread.
+
+Attributes:
+    provider (str)
+    dev_or_circ_id (int)
+    service_id (str)
+    begin_time (datetime): earliest begin of the outages
+    end_time (datetime): latest end of the outages
+    data (str): data of the first outage
+    outages (int): number of unscheduled outages coalesced
+"""
+CoalescedOutage = namedtuple('CoalescedOutage',
+    'provider dev_or_circ_id service_id begin_time end_time data outages')
+
+
+"""Snapshot an UnscheduledOutage.
+
+Args:
+    outage (UnscheduledOutage)
+
+Returns:
+    CoalescedOutage
+"""
+def snapshot(outage):
+    return CoalescedOutage(outage.provider, outage.dev_or_circ_id,
+        outage.service_id, outage.begin_time, outage.end_time, outage.data, 1)
+
+
+def _coalesce(pending, outage):
+    return pending._replace(
+        begin_time=min(pending.begin_time, outage.begin_time),
+        end_time=max(pending.end_time, outage.end_time),
+        outages=pending.outages + outage.outages)
+
+
+"""Alert that could not be delivered.
+
+Attributes:
+    outage (CoalescedOutage)
+    error (str): last error
+    attempts (int)
+    time (datetime): when it was given up on (UTC)
+"""
+DeadLetter = namedtuple('DeadLetter', 'outage error attempts time')
+
+
+"""Delivers alerts in the background.
+
+`submit()` never blocks: the outage is merged into the pending alert of
+its (provider, dev_or_circ_id), which is handed to the workers `window`
+seconds after its first outage, so a burst of outages on a circuit
+becomes a single alert. The queue to the workers is bounded; while it is
+full, pending alerts keep coalescing instead of piling up.
+
+A failed delivery is retried `max_attempts` times with exponential
+backoff, then added to the dead letters (see drain_dead_letters()).
+"""
+class AlertDispatcher:
+    """Constructor.
+
+    Args:
+        sink (func(CoalescedOutage)): delivers an alert, raises on failure
+        workers (int): delivery threads
+        window (float): seconds to coalesce outages of a device/circuit
+        max_queued (int): alerts handed to the workers but not delivered
+        max_attempts (int): deliveries tried per alert
+        backoff (float): seconds before the first retry, doubled for each
+                         further retry
+        clock (func()): returns the current time in seconds
+    """
+    def __init__(self, sink, workers=4, window=60, max_queued=1000,
+                 max_attempts=5, backoff=1, clock=time.monotonic):
+        self._sink = sink
+        self._window = window
+        self._max_attempts = max_attempts
+        self._backoff = backoff
+        self._clock = clock
+
+        self._lock = threading.Condition()
+        self._pending = {}  # (provider, dev_or_circ_id) -> CoalescedOutage
+        self._due = deque()  # (due time, key), in order of due time
+        self._queue = queue.Queue(max_queued)
+        self._dead_letters = deque()
+        self._closed = False
+        self._unfinished = 0
+
+        self._threads = [threading.Thread(target=self._flush_loop,
+                                          daemon=True)]
+        self._threads += [threading.Thread(target=self._work, daemon=True)
+                          for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    """Queue an alert for an outage.
+
+    Args:
+        outage (CoalescedOutage)
+    """
+    def submit(self, outage):
+        key = (outage.provider, outage.dev_or_circ_id)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('AlertDispatcher is closed')
+            pending = self._pending.get(key)
+            if pending is not None:
+                self._pending[key] = _coalesce(pending, outage)
+                metrics.inc('alerts_coalesced')
+                return
+            self._pending[key] = outage
+            self._due.append((self._clock() + self._window, key))
+            self._unfinished += 1
+            self._lock.notify_all()
+
+    def _flush_loop(self):
+        while True:
+            with self._lock:
+                while True:
+                    if self._due and (self._closed or
+                                      self._due[0][0] <= self._clock()):
+                        break
+                    if self._closed:
+                        self._queue.put(None)
+                        return
+                    timeout = self._due[0][0] - self._clock() \
+                        if self._due else None
+                    self._lock.wait(timeout)
+                (due, key) = self._due[0]
+            # Blocks while the workers are behind, outages submitted in the
+            # meantime are coalesced into the pending alert
+            self._queue.put(key)
+            with self._lock:
+                self._due.popleft()
+            metrics.set('alerts_queued', self._queue.qsize())
+
+    def _work(self):
+        while True:
+            key = self._queue.get()
+            if key is None:
+                self._queue.put(None)  # for the other workers
+                return
+            with self._lock:
+                outage = self._pending.pop(key)
+            self._deliver(outage)
+            with self._lock:
+                self._unfinished -= 1
+                self._lock.notify_all()
+
+    def _deliver(self, outage):
+        for attempt in range(1, self._max_attempts + 1):
+            try:
+                self._sink(outage)
+                metrics.inc('alerts_delivered')
+                return
+            except Exception as e:
+                error = e
+                metrics.inc('alert_failures')
+                logging.getLogger(__name__).warning(
+                    'Alert for %s/%s failed (attempt %d): %r',
+                    outage.provider, outage.service_id, attempt, e)
+            if attempt < self._max_attempts:
+                time.sleep(self._backoff * 2 ** (attempt - 1))
+        self._dead_letters.append(DeadLetter(outage, repr(error),
+            self._max_attempts, datetime.utcnow()))
+        metrics.inc('alerts_dead_lettered')
+
+    """Remove and return the alerts that could not be delivered.
+
+    Returns:
+        list[DeadLetter]
+    """
+    def drain_dead_letters(self):
+        result = []
+        while self._dead_letters:
+            result.append(self._dead_letters.popleft())
+        return result
+
+    """Wait until every alert submitted so far is delivered or dead.
+
+    Pending alerts are sent right away, without waiting for their window.
+
+    Args:
+        timeout (float): seconds, None == no limit
+
+    Returns:
+        bool: False if timed out
+    """
+    def flush(self, timeout=None):
+        with self._lock:
+            self._due = deque((0, key) for (due, key) in self._due)
+            self._lock.notify_all()
+            return self._lock.wait_for(lambda: self._unfinished == 0, timeout)
+
+    """Deliver the pending alerts and stop the threads.
+
+    Args:
+        timeout (float): seconds to wait for each thread, None == no limit
+    """
+    def close(self, timeout=None):
+        with self._lock:
+            self._closed = True
+            self._lock.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+
+"""Stand-in sink for tests: records the alerts it gets.
+
+Attributes:
+    alerts (list[CoalescedOutage]): delivered alerts
+    failures (int): deliveries to fail before succeeding
+"""
+class RecordingSink:
+    def __init__(self, failures=0):
+        self.alerts = []
+        self.failures = failures
+        self.attempts = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, outage):
+        with self._lock:
+            self.attempts += 1
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError('RecordingSink failure')
+            self.alerts.append(outage)
@@ -0,0 +1,30 @@
+import asyncio
+import itertools
+
+
+def _next_chunk(iterator, chunk_size):
+    return list(itertools.islice(iterator, chunk_size))
+
+
+'''Iterate a blocking iterable from asyncio.
+
+The iterable is advanced in the loop's default executor, `chunk_size`
+items at a time, so a slow api does not block the event loop.
+
+Args:
+    iterable (iterable)
+    chunk_size (int): items fetched per executor call
+
+Yields:
+    items of `iterable`
+'''
+async def iterate_in_executor(iterable, chunk_size=100):
+    loop = asyncio.get_event_loop()
+    iterator = iter(iterable)
+    while True:
+        chunk = await loop.run_in_executor(
+            None, _next_chunk, iterator, chunk_size)
+        if not chunk:
+            break
+        for item in chunk:
+            yield item
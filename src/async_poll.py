@@ -0,0 +1,210 @@
+from email_parser import EmailParseError, EmailParser
+from metrics import metrics
+from outage_loader import OutageLoader
+from scheduled_outage_index import ScheduledOutageIndex
+from sla_handler import SLAHandler
+from unscheduled_outage_generator import UnscheduledOutageGenerator
+
+import helpdesk
+import log_loader
+
+import asyncio
+
+
+'''asyncio version of main.poll.
+
+Emails and logs are loaded by two independent tasks, each on its own
+schedule, so a slow helpdesk api does not hold up log processing and vice
+versa. The apis are read (and emails parsed) in worker threads while the
+database is only used from the event loop thread, with the usual
+db_session: helpdesk.load_new_emails and log_loader.load_outages_from_logs
+must not use it, see helpdesk.aload_new_emails and
+log_loader.aload_outages_from_logs.
+
+Scheduled outages are committed before the detected outages that depend
+on them are classified: once a log poll reads its first record, it waits
+for an email poll that started no earlier than that (waking up the email
+task if it is idle) before classifying.
+'''
+class AsyncPoller:
+    """Constructor.
+
+    Args:
+        email_interval (float): seconds between email polls. 0 == No poll
+        log_interval (float): seconds between log polls. 0 == No poll
+        bulk, split_partial, batch_size, horizon, flap_gap, dedup, core:
+            see main.poll
+    """
+    def __init__(self, email_interval, log_interval, bulk=False,
+                 split_partial=False, batch_size=1000, horizon=None,
+                 flap_gap=None, dedup=False, core=False):
+        self._email_interval = email_interval
+        self._log_interval = log_interval
+        self._bulk = bulk
+        self._batch_size = batch_size
+        self._horizon = horizon
+
+        self._scheduled_index = ScheduledOutageIndex()
+        self._loader = OutageLoader(scheduled_index=self._scheduled_index,
+            batch_size=batch_size, flap_gap=flap_gap, dedup=dedup,
+            core=core)
+        self._gen = UnscheduledOutageGenerator(
+            scheduled_index=self._scheduled_index, split_partial=split_partial,
+            horizon=horizon, core=core)
+        self._sla_handler = SLAHandler()
+
+        self._email_polls_started = 0
+        self._email_polls_done = 0
+        self._email_running = False
+
+    """Run until both schedules are done (forever if either interval > 0)."""
+    async def run(self):
+        self._start()
+        await self._poll()
+
+    """Release what the poller holds, see OutageLoader.close."""
+    def close(self):
+        self._loader.close()
+
+    # Set up in the event loop, before the first poll or event
+    def _start(self):
+        self._email_wakeup = asyncio.Event()
+        self._email_done = asyncio.Condition()
+        SLAHandler.load_downtime()
+        self._scheduled_index.load(since=None if self._horizon is None
+            else self._loader.last_processed_log_time - self._horizon)
+
+    async def _poll(self):
+        await asyncio.gather(self._email_task(), self._log_task())
+
+    async def _email_task(self):
+        while True:
+            self._email_wakeup.clear()
+            self._email_polls_started += 1
+            self._email_running = True
+            try:
+                await self.load_new_scheduled_outages()
+            finally:
+                self._email_running = False
+            async with self._email_done:
+                self._email_polls_done = self._email_polls_started
+                self._email_done.notify_all()
+
+            if self._email_interval <= 0:
+                break
+            try:
+                await asyncio.wait_for(self._email_wakeup.wait(),
+                                       self._email_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _log_task(self):
+        while True:
+            await self.load_new_detected_outages()
+            if self._log_interval <= 0:
+                break
+            await asyncio.sleep(self._log_interval)
+
+    """Load new scheduled outages, see OutageLoader.load_new_scheduled_outages.
+
+    Returns:
+        bool: True if new outages loaded, False for no new outages
+    """
+    async def load_new_scheduled_outages(self):
+        loop = asyncio.get_event_loop()
+        loaded = False
+        async for (time, fromaddr, content) in helpdesk.aload_new_emails(
+                self._loader.last_processed_email_time):
+            if self._loader.duplicate_email(fromaddr, content):
+                continue
+            try:
+                with metrics.timer('stage_seconds', stage='parse'):
+                    notification = await loop.run_in_executor(
+                        None, EmailParser.parse, fromaddr, content)
+            except EmailParseError:
+                metrics.inc('parse_failures')
+                raise
+            metrics.inc('records', stage='parse')
+            self._loader.store_notification(time, notification,
+                                            (fromaddr, content))
+            loaded = True
+        return loaded
+
+    """Load, classify and report new detected outages.
+
+    Returns:
+        int: number of detected outages loaded
+    """
+    async def load_new_detected_outages(self):
+        email_poll = None
+        count = 0
+        batch = []
+        async for item in log_loader.aload_outages_from_logs(
+                self._loader.last_processed_log_time):
+            if email_poll is None:
+                email_poll = self._request_email_poll()
+            batch.append(item)
+            if len(batch) >= self._batch_size:
+                count += await self._handle_batch(batch, email_poll)
+                batch = []
+        if batch:
+            count += await self._handle_batch(batch, email_poll)
+        else:
+            self._loader.save_log_position()
+        return count
+
+    """Request an email poll that starts no earlier than now.
+
+    A poll that is already running may have read the helpdesk before the
+    record arrived, so the next one is requested then too.
+
+    Returns:
+        int: the email poll to wait for
+    """
+    def _request_email_poll(self):
+        if self._email_interval <= 0:
+            # Single email poll, see _email_task
+            return 1
+        self._email_wakeup.set()
+        return self._email_polls_started + 1
+
+    async def _handle_batch(self, batch, email_poll):
+        detected_outages = self._loader.store_log_records(batch)
+        await self._wait_for_email_poll(email_poll)
+        self._classify(detected_outages)
+        return len(detected_outages)
+
+    async def _wait_for_email_poll(self, email_poll):
+        async with self._email_done:
+            await self._email_done.wait_for(
+                lambda: self._email_polls_done >= email_poll)
+
+    """Classify stored detected outages and report the unscheduled ones.
+
+    Args:
+        detected_outages (list[DetectedOutage])
+    """
+    def _classify(self, detected_outages):
+        if self._bulk:
+            unscheduled_outages = self._gen.add_if_needed_bulk(detected_outages)
+        else:
+            unscheduled_outages = self._gen.add_if_needed(detected_outages)
+        with metrics.timer('stage_seconds', stage='dispatch'):
+            self._sla_handler.handle_unscheduled_outages(unscheduled_outages)
+        self._loader.record_backlog_lag()
+        SLAHandler.store_dead_letters()
+
+
+"""Run AsyncPoller until done.
+
+Args:
+    email_interval (float): seconds between email polls. 0 == No poll
+    log_interval (float): seconds between log polls. 0 == No poll
+    **kwargs: see AsyncPoller
+"""
+def apoll(email_interval, log_interval, **kwargs):
+    poller = AsyncPoller(email_interval, log_interval, **kwargs)
+    try:
+        asyncio.run(poller.run())
+    finally:
+        poller.close()
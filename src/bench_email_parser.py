@@ -0,0 +1,95 @@
+from email_parser import EmailParseError, EmailParser
+
+import argparse
+import time
+
+
+"""Compares the `regex` and `lines` email parser modes.
+
+Each corpus is generated at increasing sizes. For a parser that runs in
+linear time, the time per parse grows (at most) with the size of the
+email; super-linear growth shows up as a growing `growth` column. Once a parse
+takes longer than `--budget` seconds, larger sizes of that corpus are
+skipped for that mode.
+
+Corpora:
+    well-formed: the sample email with `size` filler lines in the body
+    truncated: the sample email with filler lines, cut before `Phone:`
+    adversarial: `size` copies of the field lines, none of which complete
+                 the email (there is no `Phone:` line)
+"""
+
+_fromaddr = 'noc@fiberprovider.com'
+_filler = 'The same information can also be found in the attached files.\n'
+
+
+def well_formed(sample, size):
+    i = sample.index('Service ID:')
+    return sample[:i] + _filler * size + sample[i:]
+
+
+def truncated(sample, size):
+    content = well_formed(sample, size)
+    return content[:content.index('Phone:')]
+
+
+def adversarial(sample, size):
+    lines = [line for line in sample.splitlines(keepends=True)
+             if ':' in line and not line.startswith('Phone:')]
+    return ''.join(lines) * size
+
+
+corpora = {
+    'well-formed': well_formed,
+    'truncated': truncated,
+    'adversarial': adversarial,
+}
+
+
+def time_parse(content, mode, repeat, budget):
+    start = time.perf_counter()
+    for i in range(repeat):
+        try:
+            EmailParser.parse(_fromaddr, content, mode=mode)
+        except EmailParseError:
+            pass
+        if time.perf_counter() - start > budget:
+            return (time.perf_counter() - start) / (i + 1)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sizes', type=int, nargs='*', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--modes', nargs='*', default=['regex', 'lines'])
+    parser.add_argument('--budget', type=float, default=1.0,
+                        help='Seconds per parse before larger sizes are '
+                             'skipped')
+    args = parser.parse_args()
+
+    with open('../data/provider_email.txt') as f:
+        sample = f.read()
+    for mode in args.modes:
+        time_parse(sample, mode, 1, args.budget)
+
+    print(f'{"corpus":<12} {"mode":<6} {"size":>6} {"bytes":>8} '
+          f'{"ms/parse":>10} {"growth":>7}')
+    for (name, make) in corpora.items():
+        for mode in args.modes:
+            previous = None
+            for size in args.sizes:
+                content = make(sample, size)
+                if previous is not None and previous > args.budget:
+                    print(f'{name:<12} {mode:<6} {size:>6} {len(content):>8} '
+                          f'{"skipped":>10}')
+                    continue
+                t = time_parse(content, mode, args.repeat, args.budget)
+                growth = f'{t / previous:.1f}x' if previous else ''
+                previous = t
+                print(f'{name:<12} {mode:<6} {size:>6} {len(content):>8} '
+                      f'{t * 1e3:>10.3f} {growth:>7}')
+
+
+if __name__ == '__main__':
+    main()
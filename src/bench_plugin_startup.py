@@ -0,0 +1,111 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+
+"""Startup cost of email parser plugins, eager vs. lazy loading.
+
+Generates a package of `--plugins` synthetic parser plugins, each
+compiling a regular expression like noc_fiberprovider_com at import, with
+its manifest.json. Each measurement runs in a fresh interpreter:
+
+    eager: import every plugin module, as email_parsers did before
+           manifests
+    lazy: load the manifest and parse one email, importing one plugin
+
+and reports the wall time and the peak memory of the interpreter.
+"""
+
+_plugin = '''from datetime import datetime
+from email_parser import *
+
+import re
+
+_parser_re = re.compile(r'^Subject: (?P<subj>.*?)$'
+                        r'(.*?)'
+                        r'^PW Reference Number {i}: (?P<id>\\w+)$'
+                        r'(.*?)'
+                        r'^Start Date and Time: (?P<begin>\\d{{4}}-\\w{{3}}-\\d{{2}} \\d{{2}}:\\d{{2}}\\s+\\w+)$'
+                        r'(.*?)'
+                        r'^End Date and Time: (?P<end>\\d{{4}}-\\w{{3}}-\\d{{2}} \\d{{2}}:\\d{{2}}\\s+\\w+)$'
+                        r'(.*?)'
+                        r'^Service ID: (?P<service_id>.*?)$'
+                        , re.MULTILINE|re.IGNORECASE|re.DOTALL)
+
+
+@register_parser('noc@provider{i}.example')
+def parse(fromaddr, content):
+    mo = _parser_re.match(content)
+    if not mo:
+        raise EmailParseError('Failed to parse email')
+    return mo.group('id')
+'''
+
+_measure = '''
+import resource, sys, time
+start = time.perf_counter()
+sys.path[:0] = [{src!r}, {root!r}]
+from plugin_manifest import PluginManifest
+manifest = PluginManifest('synthetic_parsers', {package!r})
+if {eager!r}:
+    manifest.load_all()
+else:
+    from email_parser import EmailParser
+    EmailParser._per_provider_parsers.get('noc@provider0.example') or \\
+        manifest.load('noc@provider0.example')
+    EmailParser._per_provider_parsers['noc@provider0.example']['regex'](
+        'noc@provider0.example', 'Subject: x\\nPW Reference Number 0: PW1\\n'
+        'Start Date and Time: 2019-Apr-09 06:00 UTC\\n'
+        'End Date and Time: 2019-Apr-09 10:00 UTC\\nService ID: IC-1\\n')
+print(time.perf_counter() - start,
+      resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+
+def generate(root, plugins):
+    package = os.path.join(root, 'synthetic_parsers')
+    os.makedirs(package)
+    with open(os.path.join(package, '__init__.py'), 'w') as f:
+        pass
+    for i in range(plugins):
+        with open(os.path.join(package, f'provider{i}.py'), 'w') as f:
+            f.write(_plugin.format(i=i))
+    with open(os.path.join(package, 'manifest.json'), 'w') as f:
+        f.write('{\n' + ',\n'.join(
+            f'    "noc@provider{i}.example": "provider{i}"'
+            for i in range(plugins)) + '\n}\n')
+    return package
+
+
+def measure(root, package, eager):
+    code = _measure.format(src=os.path.abspath('.'), root=root,
+                           package=package, eager=eager)
+    output = subprocess.run([sys.executable, '-c', code], check=True,
+                            capture_output=True, text=True).stdout
+    (seconds, maxrss) = output.split()
+    return (float(seconds), int(maxrss))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--plugins', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        package = generate(root, args.plugins)
+        # The first eager run writes the bytecode caches for both modes
+        measure(root, package, eager=True)
+
+        print(f'{"mode":<6} {"plugins":>8} {"ms":>10} {"max rss KiB":>12}')
+        for (mode, eager) in (('eager', True), ('lazy', False)):
+            runs = [measure(root, package, eager) for i in range(args.repeat)]
+            (seconds, maxrss) = min(runs)
+            print(f'{mode:<6} {args.plugins:>8} {seconds * 1e3:>10.1f} '
+                  f'{maxrss:>12}')
+
+
+if __name__ == '__main__':
+    main()
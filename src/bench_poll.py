@@ -0,0 +1,253 @@
+from db import db_session
+from db.device_or_circuit import DeviceCircuits, DeviceOrCircuit
+from device_or_circuit_cache import DeviceOrCircuitCache
+from email_parser import EmailParser
+from outage_loader import OutageLoader
+from sla_handler import SLAHandler
+from unscheduled_outage_generator import UnscheduledOutageGenerator
+
+import helpdesk
+import log_loader
+import main as poller
+
+from datetime import datetime, timedelta
+
+import argparse
+import functools
+import json
+import random
+import sys
+import time
+
+
+"""Synthetic workload benchmark for main.poll.
+
+Generates `devices` devices and `circuits` circuits (spread evenly over the
+devices in DeviceCircuits), `emails` maintenance emails in the
+fiberprovider format (for circuits, and for devices with
+`--device-email-ratio`) and `outages` detected outages, `overlap` of which
+fall inside a scheduled outage. The helpdesk and log apis are replaced as
+in demo.py and main.poll(0) is run once.
+
+The time spent in each stage is measured exclusively (time spent in a
+nested stage is only counted for the nested stage):
+
+    parse: EmailParser.parse
+    resolve: DeviceOrCircuitCache.get_many
+    insert: OutageLoader.store_notification/store_detected_outages
+    classify: UnscheduledOutageGenerator.add_if_needed/add_if_needed_bulk
+    dispatch: SLAHandler.handle_unscheduled_outages
+
+The results are written as JSON.
+"""
+
+_start = datetime(2019, 4, 1)
+_provider = 'fiberprovider'
+_fromaddr = 'noc@fiberprovider.com'
+
+
+class StageTimer:
+    def __init__(self):
+        self.stages = {}
+        self._stack = []
+
+    """Replace obj.name with a wrapper that times it as `stage`.
+
+    Args:
+        obj: class or module
+        name (str): attribute of obj
+        stage (str)
+        records (func(*args)): number of records handled by a call
+    """
+    def wrap(self, obj, name, stage, records=lambda *args: 1):
+        func = getattr(obj, name)
+        is_static = isinstance(obj.__dict__.get(name), staticmethod)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self._stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                nested = self._stack.pop()
+                if self._stack:
+                    self._stack[-1] += elapsed
+                stats = self.stages.setdefault(stage, {
+                    'calls': 0, 'records': 0, 'latencies': []})
+                stats['calls'] += 1
+                stats['records'] += records(*args)
+                stats['latencies'].append(elapsed - nested)
+
+        setattr(obj, name, staticmethod(wrapper) if is_static else wrapper)
+
+    def report(self):
+        result = {}
+        for (stage, stats) in self.stages.items():
+            latencies = sorted(stats['latencies'])
+            seconds = sum(latencies)
+            result[stage] = {
+                'calls': stats['calls'],
+                'records': stats['records'],
+                'seconds': seconds,
+                'records_per_second':
+                    stats['records'] / seconds if seconds else None,
+                'latency_ms': {
+                    'mean': seconds / len(latencies) * 1e3,
+                    'p50': latencies[len(latencies) // 2] * 1e3,
+                    'p95': latencies[int(len(latencies) * 0.95)] * 1e3,
+                    'max': latencies[-1] * 1e3,
+                },
+            }
+        return result
+
+
+def make_email(template, outage_id, service_id, begin, end):
+    fmt = '%Y-%b-%d %H:%M'
+    return template.replace(
+        ' New try for cancelled PWIC45678.', '').replace(
+        'PWIC12345', outage_id).replace(
+        'IC-99999', service_id).replace(
+        '2019-Apr-09 06:00', begin.strftime(fmt)).replace(
+        '2019-Apr-09 10:00', end.strftime(fmt))
+
+
+def random_time(rng, days):
+    return _start + timedelta(minutes=rng.randrange(days * 24 * 60))
+
+
+def generate(args, template, rng):
+    devices = [f'SW-{i}' for i in range(args.devices)]
+    circuits = [f'IC-{i}' for i in range(args.circuits)]
+
+    db_session.execute(DeviceOrCircuit.__table__.insert(),
+        [{'provider': _provider, 'service_id': service_id, 'type': 'device'}
+         for service_id in devices] +
+        [{'provider': _provider, 'service_id': service_id, 'type': 'circuit'}
+         for service_id in circuits])
+    ids = {service_id: id for (id, service_id) in db_session.query(
+        DeviceOrCircuit.id, DeviceOrCircuit.service_id)}
+    device_circuits = {device: [] for device in devices}
+    for (i, circuit) in enumerate(circuits):
+        if devices:
+            device_circuits[devices[i % len(devices)]].append(circuit)
+    db_session.execute(DeviceCircuits.__table__.insert(),
+        [{'devid': ids[device], 'circid': ids[circuit]}
+         for (device, members) in device_circuits.items()
+         for circuit in members])
+    db_session.commit()
+
+    windows = []
+    emails = []
+    for i in range(args.emails):
+        if devices and rng.random() < args.device_email_ratio:
+            device = rng.choice(devices)
+            (service_id, affected) = (device, device_circuits[device])
+        else:
+            circuit = rng.choice(circuits)
+            (service_id, affected) = (circuit, [circuit])
+        begin = random_time(rng, args.days).replace(second=0)
+        end = begin + timedelta(hours=rng.randint(1, 4))
+        emails.append((begin, _fromaddr,
+            make_email(template, f'PW{i}', service_id, begin, end)))
+        if affected:
+            windows.append((affected, begin, end))
+
+    outages = []
+    for i in range(args.outages):
+        if windows and rng.random() < args.overlap:
+            (affected, window_begin, window_end) = rng.choice(windows)
+            service_id = rng.choice(affected)
+            span = int((window_end - window_begin).total_seconds())
+            offset = rng.randrange(span)
+            begin = window_begin + timedelta(seconds=offset)
+            end = begin + timedelta(
+                seconds=rng.randint(1, max(1, span - offset)))
+        else:
+            service_id = rng.choice(circuits)
+            begin = random_time(rng, args.days)
+            end = begin + timedelta(seconds=rng.randint(5, 3600))
+        outages.append(log_loader.Outage(_provider, service_id, begin, end, {}))
+    outages.sort(key=lambda outage: outage.end)
+
+    return emails, outages
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', type=int, default=100)
+    parser.add_argument('--circuits', type=int, default=5000)
+    parser.add_argument('--emails', type=int, default=1000)
+    parser.add_argument('--outages', type=int, default=20000)
+    parser.add_argument('--overlap', type=float, default=0.5,
+                        help='Fraction of outages inside a scheduled outage')
+    parser.add_argument('--device-email-ratio', type=float, default=0.2,
+                        help='Fraction of emails scheduling a device')
+    parser.add_argument('--days', type=int, default=30,
+                        help='Time span of the generated outages')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--bulk', action='store_true')
+    parser.add_argument('--split-partial', action='store_true')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--core', action='store_true',
+                        help='Core INSERT fast path, implies --bulk')
+    parser.add_argument('-o', '--output', help='Write JSON here, not stdout')
+    args = parser.parse_args()
+
+    with open('../data/provider_email.txt') as f:
+        template = f.read()
+    (emails, outages) = generate(args, template, random.Random(args.seed))
+
+    def load_new_emails(last_processed_time):
+        for email in emails:
+            if email[0] > last_processed_time:
+                yield email
+
+    def load_outages_from_logs(last_processed_time):
+        for outage in outages:
+            if outage.end > last_processed_time:
+                yield (outage.end, outage)
+
+    helpdesk.load_new_emails = load_new_emails
+    log_loader.load_outages_from_logs = load_outages_from_logs
+
+    alerts = []
+    SLAHandler.register_handler(_provider, alerts.append)
+
+    timer = StageTimer()
+    timer.wrap(EmailParser, 'parse', 'parse')
+    timer.wrap(DeviceOrCircuitCache, 'get_many', 'resolve',
+               lambda cache, keys: len(keys))
+    timer.wrap(OutageLoader, 'store_notification', 'insert')
+    timer.wrap(OutageLoader, 'store_detected_outages', 'insert',
+               lambda loader, batch: len(batch))
+    timer.wrap(UnscheduledOutageGenerator, 'add_if_needed', 'classify',
+               lambda gen, outages: len(outages))
+    timer.wrap(UnscheduledOutageGenerator, 'add_if_needed_bulk', 'classify',
+               lambda gen, outages: len(outages))
+    timer.wrap(SLAHandler, 'handle_unscheduled_outages', 'dispatch',
+               lambda outages: len(outages))
+
+    start = time.perf_counter()
+    poller.poll(0, bulk=args.bulk or args.core,
+                split_partial=args.split_partial, batch_size=args.batch_size,
+                core=args.core)
+    total = time.perf_counter() - start
+
+    result = {
+        'config': vars(args),
+        'total_seconds': total,
+        'unscheduled_outages': len(alerts),
+        'stages': timer.report(),
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, default=str)
+    else:
+        json.dump(result, sys.stdout, indent=2, default=str)
+        print()
+
+
+if __name__ == '__main__':
+    main()
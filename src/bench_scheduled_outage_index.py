@@ -0,0 +1,108 @@
+from db import db_session
+from db.outage import ScheduledOutage
+from scheduled_outage_index import ScheduledOutageIndex
+from unscheduled_outage_generator import UnscheduledOutageGenerator
+
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import argparse
+import random
+import time
+
+
+"""Compares the per-outage ScheduledOutage query against ScheduledOutageIndex.
+
+Fills the scheduled_outages table with `size` random maintenance windows
+spread over one year (about 20 windows per circuit), then times
+UnscheduledOutageGenerator.outage_is_scheduled with and without the index,
+and UnscheduledOutageGenerator.unscheduled_intervals (split_partial) with
+the index.
+"""
+
+_start = datetime(2019, 1, 1)
+_provider = 'fiberprovider'
+
+
+def populate(size, rng):
+    db_session.query(ScheduledOutage).delete()
+    circuits = max(1, size // 20)
+    rows = []
+    for i in range(size):
+        begin = _start + timedelta(minutes=rng.randrange(365 * 24 * 60))
+        rows.append({
+            'provider': _provider,
+            'outage_id': f'PW{i}',
+            'dev_or_circ_id': rng.randrange(circuits) + 1,
+            'begin_time': begin,
+            'end_time': begin + timedelta(hours=rng.randint(1, 8)),
+        })
+        if len(rows) == 10000:
+            db_session.execute(ScheduledOutage.__table__.insert(), rows)
+            rows = []
+    if rows:
+        db_session.execute(ScheduledOutage.__table__.insert(), rows)
+    db_session.commit()
+    return circuits
+
+
+def make_probes(count, circuits, rng):
+    probes = []
+    for i in range(count):
+        begin = _start + timedelta(minutes=rng.randrange(365 * 24 * 60))
+        probes.append(SimpleNamespace(provider=_provider,
+            dev_or_circ_id=rng.randrange(circuits) + 1, begin_time=begin,
+            end_time=begin + timedelta(minutes=rng.randint(1, 60))))
+    return probes
+
+
+def run(gen, probes):
+    start = time.perf_counter()
+    scheduled = sum(1 for outage in probes if gen.outage_is_scheduled(outage))
+    return (time.perf_counter() - start) / len(probes), scheduled
+
+
+def run_split(gen, probes):
+    start = time.perf_counter()
+    for outage in probes:
+        gen.unscheduled_intervals(outage)
+    return (time.perf_counter() - start) / len(probes)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sizes', type=int, nargs='*',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--probes', type=int, default=200,
+                        help='Lookups timed per size')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+
+    print(f'{"size":>9} {"query us/op":>12} {"load s":>8} '
+          f'{"index us/op":>12} {"speedup":>9} {"split us/op":>12}')
+    for size in args.sizes:
+        circuits = populate(size, rng)
+        probes = make_probes(args.probes, circuits, rng)
+
+        query_time, query_scheduled = run(UnscheduledOutageGenerator(), probes)
+
+        index = ScheduledOutageIndex()
+        start = time.perf_counter()
+        index.load()
+        load_time = time.perf_counter() - start
+        index_time, index_scheduled = run(
+            UnscheduledOutageGenerator(scheduled_index=index), probes)
+
+        split_time = run_split(UnscheduledOutageGenerator(
+            scheduled_index=index, split_partial=True), probes)
+
+        assert query_scheduled == index_scheduled
+        print(f'{size:>9} {query_time * 1e6:>12.1f} {load_time:>8.2f} '
+              f'{index_time * 1e6:>12.2f} {query_time / index_time:>8.0f}x '
+              f'{split_time * 1e6:>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
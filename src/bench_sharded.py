@@ -0,0 +1,132 @@
+from db import db_session
+from db.device_or_circuit import DeviceOrCircuit
+from db.outage import DetectedOutage, UnscheduledOutage
+from sla_handler import SLAHandler
+
+import helpdesk
+import log_loader
+import sharding
+
+from datetime import datetime, timedelta
+
+import argparse
+import functools
+import json
+import pickle
+import random
+import sys
+import tempfile
+import time
+
+
+"""Throughput benchmark for sharding.sharded_poll.
+
+Generates `outages` detected outages over `circuits` circuits of
+`providers` providers, then polls them once with `workers` processes
+sharded by provider. Run it against an empty, file backed database, and
+once per worker count to compare, e.g.
+
+    SLA_DATABASE_URL=sqlite:////tmp/bench1.db python bench_sharded.py -w 1
+    SLA_DATABASE_URL=sqlite:////tmp/bench4.db python bench_sharded.py -w 4
+
+SQLite serializes the writers, so the workers only scale as far as their
+CPU bound work (log reading, classification, dispatch); PostgreSQL scales
+further.
+
+The results are written as JSON.
+"""
+
+_start = datetime(2019, 4, 1)
+
+
+def generate(args, rng):
+    providers = [f'provider{i}' for i in range(args.providers)]
+    circuits = [(rng.choice(providers), f'IC-{i}')
+                for i in range(args.circuits)]
+    db_session.execute(DeviceOrCircuit.__table__.insert(),
+        [{'provider': provider, 'service_id': service_id, 'type': 'circuit'}
+         for (provider, service_id) in circuits])
+    db_session.commit()
+
+    outages = []
+    for i in range(args.outages):
+        (provider, service_id) = rng.choice(circuits)
+        begin = _start + timedelta(minutes=rng.randrange(args.days * 24 * 60))
+        end = begin + timedelta(seconds=rng.randint(5, 3600))
+        outages.append(log_loader.Outage(provider, service_id, begin, end, {}))
+    outages.sort(key=lambda outage: outage.end)
+    return (providers, outages)
+
+
+# Runs in each worker: install the apis and handlers of the workload
+def install(path):
+    with open(path, 'rb') as f:
+        (providers, outages) = pickle.load(f)
+
+    def load_new_emails(last_processed_time):
+        return iter(())
+
+    def load_outages_from_logs(last_processed_time):
+        for outage in outages:
+            if outage.end > last_processed_time:
+                yield (outage.end, outage)
+
+    helpdesk.load_new_emails = load_new_emails
+    log_loader.load_outages_from_logs = load_outages_from_logs
+    for provider in providers:
+        SLAHandler.register_handler(provider, lambda outage: None)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-w', '--workers', type=int, default=1)
+    parser.add_argument('--shards', type=int,
+                        help='Defaults to --workers')
+    parser.add_argument('--providers', type=int, default=16)
+    parser.add_argument('--circuits', type=int, default=5000)
+    parser.add_argument('--outages', type=int, default=20000)
+    parser.add_argument('--days', type=int, default=30,
+                        help='Time span of the generated outages')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--bulk', action='store_true')
+    parser.add_argument('--core', action='store_true',
+                        help='Core INSERT fast path, implies --bulk')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('-o', '--output', help='Write JSON here, not stdout')
+    args = parser.parse_args()
+
+    if db_session.query(DeviceOrCircuit.id).first() is not None:
+        sys.exit('The database must be empty, see SLA_DATABASE_URL')
+
+    (providers, outages) = generate(args, random.Random(args.seed))
+    with tempfile.NamedTemporaryFile(suffix='.pickle') as f:
+        pickle.dump((providers, outages), f)
+        f.flush()
+
+        start = time.perf_counter()
+        exit_codes = sharding.sharded_poll(args.workers, 0,
+            shards=args.shards, initializer=functools.partial(install, f.name),
+            bulk=args.bulk or args.core, batch_size=args.batch_size,
+            core=args.core)
+        total = time.perf_counter() - start
+
+    db_session.expire_all()
+    detected = db_session.query(DetectedOutage).count()
+    result = {
+        'config': vars(args),
+        'exit_codes': exit_codes,
+        'total_seconds': total,
+        'detected_outages': detected,
+        'unscheduled_outages': db_session.query(UnscheduledOutage).count(),
+        'outages_per_second': detected / total if total else None,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, default=str)
+    else:
+        json.dump(result, sys.stdout, indent=2, default=str)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,25 @@
 from .base import *
+from .dead_letter import *
 from .device_or_circuit import *
+from .engine import load_config, make_engine
+from .idempotency import *
 from .last_processed import *
+from .lease import *
 from .outage import *
+from .partitions import create_all
+from .records import *
+from .replay import *
 
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
-import os
 
+# Configured from the environment, see db.engine.load_config()
+engine = make_engine(**load_config())
 
-engine = create_engine('sqlite:///:memory:', echo=os.getenv('SQLALCHEMY_ECHO') is not None)
-db_session = sessionmaker(bind=engine)()
+# Session factory: each worker/thread opens its own session with Session()
+Session = sessionmaker(bind=engine)
 
-Base.metadata.create_all(engine)
+# Session of the main thread
+db_session = Session()
 
+create_all(engine)
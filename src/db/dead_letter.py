@@ -0,0 +1,20 @@
+from sqlalchemy import Column, DateTime, Integer, String
+
+from .base import Base
+
+
+# Alert that could not be delivered to its SLA handler plugin
+class DeadLetterAlert(Base):
+    __tablename__ = 'dead_letter_alerts'
+
+    id = Column(Integer, primary_key=True)
+    provider = Column(String, nullable=False)
+    dev_or_circ_id = Column(Integer)
+    service_id = Column(String)
+    begin_time = Column(DateTime, nullable=False)
+    end_time = Column(DateTime, nullable=False)
+    data = Column(String)
+    outages = Column(Integer, nullable=False)
+    error = Column(String)
+    attempts = Column(Integer, nullable=False)
+    time = Column(DateTime, nullable=False, index=True)
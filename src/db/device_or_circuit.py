@@ -34,3 +34,6 @@ class DeviceCircuits(Base):
 
     device = relationship('DeviceOrCircuit', foreign_keys='DeviceCircuits.devid')
     circuit = relationship('DeviceOrCircuit', foreign_keys='DeviceCircuits.circid')
+
+
+circid_idx = Index('device_circuits_circid_idx', DeviceCircuits.circid)
@@ -0,0 +1,163 @@
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import StaticPool
+
+import json
+import os
+import threading
+
+
+default_url = 'sqlite:///:memory:'
+
+# Config file key -> (environment variable, type)
+_settings = {
+    'url': ('SLA_DATABASE_URL', str),
+    'echo': ('SQLALCHEMY_ECHO', bool),
+    'pool_size': ('SLA_DATABASE_POOL_SIZE', int),
+    'max_overflow': ('SLA_DATABASE_MAX_OVERFLOW', int),
+    'pool_timeout': ('SLA_DATABASE_POOL_TIMEOUT', float),
+    'pool_recycle': ('SLA_DATABASE_POOL_RECYCLE', int),
+    'pool_pre_ping': ('SLA_DATABASE_POOL_PRE_PING', bool),
+    'sqlite_mmap_size': ('SLA_DATABASE_SQLITE_MMAP_SIZE', int),
+    'sqlite_busy_timeout': ('SLA_DATABASE_SQLITE_BUSY_TIMEOUT', int),
+    'sqlite_begin_immediate': ('SLA_DATABASE_SQLITE_BEGIN_IMMEDIATE', bool),
+    'statement_timeout': ('SLA_DATABASE_STATEMENT_TIMEOUT', int),
+}
+
+_defaults = {
+    'url': default_url,
+    'echo': False,
+    'pool_pre_ping': True,
+    'sqlite_mmap_size': 256 * 1024 * 1024,
+    'sqlite_busy_timeout': 5000,
+}
+
+
+def _parse_bool(value):
+    return value.strip().lower() not in ('', '0', 'false', 'no', 'off')
+
+
+"""Read the database configuration.
+
+Settings come from the JSON object in the file named by the
+SLA_DATABASE_CONFIG environment variable (if set), overridden by the
+environment variables in `_settings`, e.g. SLA_DATABASE_URL. Any
+SQLALCHEMY_ECHO value turns on echo, as before.
+
+Args:
+    environ (dict): defaults to os.environ
+
+Returns:
+    dict: settings, see make_engine(...)
+"""
+def load_config(environ=os.environ):
+    config = dict(_defaults)
+    path = environ.get('SLA_DATABASE_CONFIG')
+    if path:
+        with open(path) as f:
+            config.update(json.load(f))
+    for (key, (name, type_)) in _settings.items():
+        value = environ.get(name)
+        if value is None:
+            continue
+        if name == 'SQLALCHEMY_ECHO':
+            config[key] = True
+        elif type_ is bool:
+            config[key] = _parse_bool(value)
+        else:
+            config[key] = type_(value)
+    unknown = set(config) - set(_settings)
+    if unknown:
+        raise ValueError(f'Unknown database settings: {sorted(unknown)}')
+    return config
+
+
+"""Create an engine.
+
+In memory SQLite databases live in a single connection (StaticPool), so
+they are for a single session in a single thread, e.g. tests and demos:
+the sessions of a thread share one transaction, and using the database
+from another thread than the one that created the engine raises a
+RuntimeError. File backed SQLite databases are switched to WAL
+journaling with synchronous=NORMAL, memory mapped I/O and a busy timeout,
+so readers do not block the writer and commits only fsync on checkpoints.
+With `sqlite_begin_immediate` every transaction takes the write lock when
+it begins, so processes writing the same file wait for each other (up to
+the busy timeout) instead of failing with "database is locked" when a
+read turns into a write.
+Other databases get a QueuePool sized by the pool settings; PostgreSQL
+connections additionally get the statement timeout.
+
+Args:
+    url (str): SQLAlchemy database url
+    echo (bool): log the SQL statements
+    pool_size, max_overflow, pool_timeout, pool_recycle, pool_pre_ping:
+        see sqlalchemy.create_engine, ignored for SQLite
+    sqlite_mmap_size (int): bytes of a SQLite file to memory map
+    sqlite_busy_timeout (int): milliseconds to wait for a SQLite lock
+    sqlite_begin_immediate (bool): begin SQLite transactions with
+                                   BEGIN IMMEDIATE
+    statement_timeout (int): PostgreSQL statement timeout in milliseconds
+
+Returns:
+    Engine
+"""
+def make_engine(url=default_url, echo=False, pool_size=None,
+                max_overflow=None, pool_timeout=None, pool_recycle=None,
+                pool_pre_ping=True, sqlite_mmap_size=256 * 1024 * 1024,
+                sqlite_busy_timeout=5000, sqlite_begin_immediate=False,
+                statement_timeout=None):
+    backend = make_url(url).get_backend_name()
+    database = make_url(url).database
+
+    if backend == 'sqlite':
+        if not database or database == ':memory:':
+            engine = create_engine(url, echo=echo, poolclass=StaticPool,
+                connect_args={'check_same_thread': False})
+            owner = threading.get_ident()
+
+            def check_thread(*args):
+                if threading.get_ident() != owner:
+                    raise RuntimeError('The in memory SQLite database can '
+                                       'only be used by one thread, see '
+                                       'SLA_DATABASE_URL')
+
+            # On checkout, and on each statement for connections checked out
+            # already, e.g. by a session used from another thread
+            event.listen(engine, 'checkout', check_thread)
+            event.listen(engine, 'before_cursor_execute', check_thread)
+            return engine
+
+        engine = create_engine(url, echo=echo,
+            connect_args={'check_same_thread': False})
+
+        @event.listens_for(engine, 'connect')
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            cursor.execute(f'PRAGMA mmap_size={int(sqlite_mmap_size)}')
+            cursor.execute(f'PRAGMA busy_timeout={int(sqlite_busy_timeout)}')
+            cursor.close()
+            if sqlite_begin_immediate:
+                # Let SQLAlchemy emit BEGIN, see begin_immediate
+                dbapi_connection.isolation_level = None
+
+        if sqlite_begin_immediate:
+            @event.listens_for(engine, 'begin')
+            def begin_immediate(connection):
+                connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+        return engine
+
+    options = {'pool_pre_ping': pool_pre_ping}
+    for (key, value) in (('pool_size', pool_size),
+                         ('max_overflow', max_overflow),
+                         ('pool_timeout', pool_timeout),
+                         ('pool_recycle', pool_recycle)):
+        if value is not None:
+            options[key] = value
+    if backend == 'postgresql' and statement_timeout is not None:
+        options['connect_args'] = {
+            'options': f'-c statement_timeout={int(statement_timeout)}'}
+    return create_engine(url, echo=echo, **options)
@@ -0,0 +1,12 @@
+from sqlalchemy import Column, DateTime, String
+
+from .base import Base
+
+
+# Email/log record already handled, see idempotency.py
+class IdempotencyKey(Base):
+    __tablename__ = 'idempotency_keys'
+
+    kind = Column(String, primary_key=True)  # 'email' or 'log'
+    key = Column(String, primary_key=True)   # hex digest
+    time = Column(DateTime, nullable=False, index=True)
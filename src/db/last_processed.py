@@ -1,4 +1,4 @@
-from sqlalchemy import Column, DateTime, String
+from sqlalchemy import BigInteger, Column, DateTime, String
 
 from .base import Base
 
@@ -8,3 +8,13 @@ class LastProcessed(Base):
 
     name = Column(String, primary_key=True)
     time = Column(DateTime, nullable=False)
+
+
+# Position of a file backed log source, see log_file_source.py
+class LogCheckpoint(Base):
+    __tablename__ = 'log_checkpoints'
+
+    name = Column(String, primary_key=True)
+    inode = Column(BigInteger, nullable=False)
+    offset = Column(BigInteger, nullable=False)
+    pending = Column(String, nullable=False) # JSON: open down events
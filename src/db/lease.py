@@ -0,0 +1,13 @@
+from sqlalchemy import Column, DateTime, String
+
+from .base import Base
+
+
+# Which worker processes a shard, see sharding.py
+class WorkerLease(Base):
+    __tablename__ = 'worker_leases'
+
+    shard = Column(String, primary_key=True) # e.g. '3/8'
+    owner = Column(String) # host:pid, None == never claimed
+    expires = Column(DateTime, nullable=False)
+    heartbeat = Column(DateTime)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, DateTime, Integer, String
+from sqlalchemy import Column, Date, DateTime, Integer, String
 from sqlalchemy.orm import relationship
 
 from .base import Base
@@ -22,6 +22,7 @@ class ScheduledOutage(Base):
 
 unique_provider_name = UniqueConstraint(ScheduledOutage.provider, ScheduledOutage.outage_id)
 provider_id_idx = Index('scheduled_outages_provider_id_idx', ScheduledOutage.provider, ScheduledOutage.outage_id)
+scheduled_dev_or_circ_begin_idx = Index('scheduled_outages_dev_or_circ_begin_idx', ScheduledOutage.dev_or_circ_id, ScheduledOutage.begin_time)
 
 
 class DetectedOutage(Base):
@@ -29,15 +30,17 @@ class DetectedOutage(Base):
 
     id = Column(Integer, primary_key=True)
     dev_or_circ_id = Column(Integer, ForeignKey(DeviceOrCircuit.id, ondelete='SET NULL'))
+    provider = Column(String) # copy of device_or_circuit.provider
+    service_id = Column(String) # copy of device_or_circuit.service_id
     begin_time = Column(DateTime, nullable=False, index=True)
     end_time = Column(DateTime, nullable=False)
     data = Column(String) # with a new enough sqlalchemy we can use: Column(JSON)
 
     device_or_circuit = relationship('DeviceOrCircuit', foreign_keys='DetectedOutage.dev_or_circ_id')
 
-    @property
-    def provider(self):
-        return self.device_or_circuit.provider
+
+detected_dev_or_circ_begin_idx = Index('detected_outages_dev_or_circ_begin_idx', DetectedOutage.dev_or_circ_id, DetectedOutage.begin_time)
+detected_provider_begin_idx = Index('detected_outages_provider_begin_idx', DetectedOutage.provider, DetectedOutage.begin_time)
 
 
 class UnscheduledOutage(Base):
@@ -45,12 +48,43 @@ class UnscheduledOutage(Base):
 
     id = Column(Integer, primary_key=True)
     dev_or_circ_id = Column(Integer, ForeignKey(DeviceOrCircuit.id, ondelete='SET NULL'))
+    provider = Column(String) # copy of device_or_circuit.provider
+    service_id = Column(String) # copy of device_or_circuit.service_id
     begin_time = Column(DateTime, nullable=False, index=True)
     end_time = Column(DateTime, nullable=False)
     data = Column(String) # with a new enough sqlalchemy we can use: Column(JSON)
+    # DetectedOutage it was derived from; not a foreign key, as
+    # detected_outages may be partitioned (see partitions.py)
+    detected_id = Column(Integer, index=True)
 
     device_or_circuit = relationship('DeviceOrCircuit', foreign_keys='UnscheduledOutage.dev_or_circ_id')
 
-    @property
-    def provider(self):
-        return self.device_or_circuit.provider
+
+unscheduled_dev_or_circ_begin_idx = Index('unscheduled_outages_dev_or_circ_begin_idx', UnscheduledOutage.dev_or_circ_id, UnscheduledOutage.begin_time)
+unscheduled_provider_begin_idx = Index('unscheduled_outages_provider_begin_idx', UnscheduledOutage.provider, UnscheduledOutage.begin_time)
+
+
+# Detected outages per device/circuit and day, kept after the raw
+# DetectedOutage rows are dropped (see retention.py)
+class DetectedOutageRollup(Base):
+    __tablename__ = 'detected_outage_rollups'
+
+    dev_or_circ_id = Column(Integer, ForeignKey(DeviceOrCircuit.id, ondelete='CASCADE'), primary_key=True)
+    day = Column(Date, primary_key=True)
+    outages = Column(Integer, nullable=False)
+    downtime_seconds = Column(Integer, nullable=False)
+
+    device_or_circuit = relationship('DeviceOrCircuit', foreign_keys='DetectedOutageRollup.dev_or_circ_id')
+
+
+# Detected outages of a flapping device/circuit that are still being
+# coalesced, see flap_coalescer.py
+class FlapState(Base):
+    __tablename__ = 'flap_states'
+
+    provider = Column(String, primary_key=True)
+    service_id = Column(String, primary_key=True)
+    begin_time = Column(DateTime, nullable=False)
+    end_time = Column(DateTime, nullable=False)
+    time = Column(DateTime, nullable=False)
+    data = Column(String, nullable=False) # JSON, includes the intervals
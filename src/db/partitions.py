@@ -0,0 +1,187 @@
+from sqlalchemy import MetaData, PrimaryKeyConstraint, inspect, text
+
+from datetime import datetime
+
+from .base import Base
+
+
+# Tables range partitioned by month of begin_time on PostgreSQL.
+# scheduled_outages is left out: it needs a unique (provider, outage_id)
+# constraint, which a partitioned table can only have if it includes the
+# partition key, and it grows with the emails rather than the logs.
+# SQLite has no partitioning; RetentionJob deletes rows there instead.
+partitioned_tables = ('detected_outages', 'unscheduled_outages')
+
+
+"""First day of the month of `time`."""
+def month_start(time):
+    return datetime(time.year, time.month, 1)
+
+
+"""First day of the month after the month of `time`."""
+def next_month(time):
+    if time.month == 12:
+        return datetime(time.year + 1, 1, 1)
+    return datetime(time.year, time.month + 1, 1)
+
+
+"""Name of the partition of `table_name` holding the month of `time`."""
+def partition_name(table_name, time):
+    return f'{table_name}_y{time.year:04d}m{time.month:02d}'
+
+
+"""Copy of `table_name` for PostgreSQL, range partitioned by begin_time.
+
+The primary key becomes (id, begin_time) since it has to include the
+partition key; the mapped classes keep using id alone, which is still
+unique as it comes from a sequence.
+
+Args:
+    table_name (str)
+
+Returns:
+    Table: in its own MetaData, along with the tables it refers to
+"""
+def partitioned_table(table_name):
+    metadata = MetaData()
+    for table in Base.metadata.sorted_tables:
+        table.to_metadata(metadata)
+    table = metadata.tables[table_name]
+    table.c.begin_time.primary_key = True
+    table.append_constraint(PrimaryKeyConstraint(table.c.id,
+                                                 table.c.begin_time))
+    table.c.id.autoincrement = True
+    table.dialect_options['postgresql']['partition_by'] = 'RANGE (begin_time)'
+    return table
+
+
+"""Statements creating the partition of `table_name` for a month.
+
+With `default`, the partition is created on its own and attached after
+moving the rows of the month out of the default partition: PostgreSQL
+refuses to add a partition for rows that are in the default partition.
+
+Args:
+    table_name (str)
+    month (datetime): first day of the month
+    default (bool): the table has a default partition
+
+Returns:
+    list[str]
+"""
+def partition_ddl(table_name, month, default=False):
+    name = partition_name(table_name, month)
+    begin = month.isoformat(' ')
+    end = next_month(month).isoformat(' ')
+    bounds = f"FOR VALUES FROM ('{begin}') TO ('{end}')"
+    if not default:
+        return [f'CREATE TABLE {name} PARTITION OF {table_name} {bounds}']
+    return [
+        f'CREATE TABLE {name} '
+        f'(LIKE {table_name} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+        f'WITH moved AS (DELETE FROM {table_name}_default '
+        f"WHERE begin_time >= '{begin}' AND begin_time < '{end}' "
+        f'RETURNING *) INSERT INTO {name} SELECT * FROM moved',
+        f'ALTER TABLE {table_name} ATTACH PARTITION {name} {bounds}',
+    ]
+
+
+"""Create the tables.
+
+Same as Base.metadata.create_all(engine), except that on PostgreSQL
+`partitioned_tables` are created as range partitioned tables with a
+default partition, and the partitions of the current month and the
+`months_ahead` next ones are created (see ensure_partitions(...), which
+RetentionJob runs to keep adding them).
+
+Args:
+    engine (Engine)
+    months_ahead (int): partitions to create past the current month
+    clock (func()): returns the current (UTC) time
+"""
+def create_all(engine, months_ahead=2, clock=datetime.utcnow):
+    if engine.dialect.name != 'postgresql':
+        Base.metadata.create_all(engine)
+        return
+
+    with engine.begin() as connection:
+        existing = set(inspect(connection).get_table_names())
+        plain = [table for table in Base.metadata.sorted_tables
+                 if table.name not in partitioned_tables]
+        Base.metadata.create_all(connection, tables=plain)
+        for table_name in partitioned_tables:
+            if table_name in existing:
+                continue
+            partitioned_table(table_name).create(connection)
+            connection.execute(text(
+                f'CREATE TABLE {table_name}_default '
+                f'PARTITION OF {table_name} DEFAULT'))
+
+        now = clock()
+        end = now
+        for i in range(months_ahead):
+            end = next_month(end)
+        ensure_partitions(connection, now, end)
+
+
+"""Create the monthly partitions covering [begin, end] (PostgreSQL only).
+
+Rows of the new partitions' months are moved out of the default
+partition, where they were stored while the partitions did not exist.
+
+Args:
+    connection (Connection)
+    begin (datetime)
+    end (datetime)
+    tables (iterable[str]): defaults to `partitioned_tables`
+
+Returns:
+    list[str]: names of the partitions created
+"""
+def ensure_partitions(connection, begin, end, tables=partitioned_tables):
+    if connection.dialect.name != 'postgresql':
+        return []
+
+    existing = set(inspect(connection).get_table_names())
+    created = []
+    for table_name in tables:
+        month = month_start(begin)
+        while month <= end:
+            name = partition_name(table_name, month)
+            if name not in existing:
+                for statement in partition_ddl(table_name, month,
+                        default=f'{table_name}_default' in existing):
+                    connection.execute(text(statement))
+                created.append(name)
+            month = next_month(month)
+    return created
+
+
+"""Drop the monthly partitions ending at or before `before` (PostgreSQL only).
+
+Args:
+    connection (Connection)
+    before (datetime)
+    tables (iterable[str]): defaults to `partitioned_tables`
+
+Returns:
+    list[str]: names of the partitions dropped
+"""
+def drop_partitions(connection, before, tables=partitioned_tables):
+    if connection.dialect.name != 'postgresql':
+        return []
+
+    dropped = []
+    for name in sorted(inspect(connection).get_table_names()):
+        for table_name in tables:
+            prefix = table_name + '_y'
+            if not name.startswith(prefix):
+                continue
+            try:
+                month = datetime.strptime(name[len(prefix):], '%Ym%m')
+            except ValueError:
+                continue
+            if next_month(month) <= before:
+                connection.execute(text(f'DROP TABLE {name}'))
+                dropped.append(name)
+    return dropped
@@ -0,0 +1,55 @@
+from sqlalchemy import insert
+
+from collections import namedtuple
+
+from .outage import DetectedOutage, UnscheduledOutage
+
+
+"""Detected outage stored without the ORM, see insert_records.
+
+Has the attributes of DetectedOutage that the pipeline reads, so it can
+be classified like one.
+"""
+DetectedRecord = namedtuple('DetectedRecord',
+    'id dev_or_circ_id provider service_id begin_time end_time data')
+
+
+"""Unscheduled outage stored without the ORM, see insert_records.
+
+Has the attributes of UnscheduledOutage that SLAHandler and
+alert_dispatcher.snapshot read.
+"""
+UnscheduledRecord = namedtuple('UnscheduledRecord',
+    'id dev_or_circ_id provider service_id begin_time end_time data')
+
+
+_record_types = {
+    DetectedOutage: DetectedRecord,
+    UnscheduledOutage: UnscheduledRecord,
+}
+
+
+"""Insert outages with a single Core INSERT, bypassing the unit of work.
+
+Nothing is added to the session's identity map. The database must support
+INSERT ... RETURNING for many rows (SQLite >= 3.35, PostgreSQL).
+
+Args:
+    session (Session)
+    cls: DetectedOutage or UnscheduledOutage
+    rows (list[dict]): column values of each outage, without id
+
+Returns:
+    list[DetectedRecord or UnscheduledRecord]: in the order of `rows`
+"""
+def insert_records(session, cls, rows):
+    if not rows:
+        return []
+    record = _record_types[cls]
+    table = cls.__table__
+    ids = session.execute(insert(table).returning(table.c.id,
+        sort_by_parameter_order=True), rows).scalars().all()
+    return [record(id, row['dev_or_circ_id'], row['provider'],
+                   row['service_id'], row['begin_time'], row['end_time'],
+                   row['data'])
+            for (id, row) in zip(ids, rows)]
@@ -0,0 +1,46 @@
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Integer, String
+
+from .base import Base
+
+
+# Re-classification of a time range, see replay.py
+class ReplayRun(Base):
+    __tablename__ = 'replay_runs'
+
+    id = Column(Integer, primary_key=True)
+    begin_time = Column(DateTime, nullable=False)
+    end_time = Column(DateTime, nullable=False)
+    options = Column(String, nullable=False) # JSON: split_partial, ...
+    created = Column(DateTime, nullable=False)
+    swapped = Column(DateTime) # None == not swapped in yet
+
+
+# Part of a replay run: a time slice of one circuit shard
+class ReplayChunk(Base):
+    __tablename__ = 'replay_chunks'
+
+    run_id = Column(Integer, ForeignKey(ReplayRun.id, ondelete='CASCADE'), primary_key=True)
+    begin_time = Column(DateTime, primary_key=True)
+    shard = Column(Integer, primary_key=True) # dev_or_circ_id % shards
+    end_time = Column(DateTime, nullable=False)
+    detected_outages = Column(Integer)
+    unscheduled_outages = Column(Integer)
+    seconds = Column(Float)
+    done = Column(DateTime) # None == still to do
+
+
+# Unscheduled outage computed by a replay run, until swapped in
+class ReplayOutage(Base):
+    __tablename__ = 'replay_outages'
+
+    id = Column(Integer, primary_key=True)
+    run_id = Column(Integer, ForeignKey(ReplayRun.id, ondelete='CASCADE'), nullable=False, index=True)
+    chunk_begin = Column(DateTime, nullable=False)
+    shard = Column(Integer, nullable=False)
+    dev_or_circ_id = Column(Integer)
+    provider = Column(String)
+    service_id = Column(String)
+    begin_time = Column(DateTime, nullable=False)
+    end_time = Column(DateTime, nullable=False)
+    data = Column(String)
+    detected_id = Column(Integer)
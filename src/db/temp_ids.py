@@ -0,0 +1,58 @@
+from sqlalchemy import Column, Integer, MetaData, Table, inspect
+
+
+# Not part of Base.metadata: the table is created on demand, per connection.
+temp_ids = Table('temp_ids', MetaData(),
+    Column('id', Integer, primary_key=True),
+    prefixes=['TEMPORARY'])
+
+
+"""Fill the per-connection temporary table `temp_ids`.
+
+Lets set based queries join against an arbitrary number of ids without
+running into bind parameter limits.
+
+Args:
+    session (Session)
+    ids (iterable[int])
+
+Returns:
+    Table: `temp_ids`, holding exactly the given ids
+"""
+def load_temp_ids(session, ids):
+    connection = session.connection()
+    temp_ids.create(connection, checkfirst=True)
+    connection.execute(temp_ids.delete())
+    rows = [{'id': i} for i in set(ids)]
+    if rows:
+        connection.execute(temp_ids.insert(), rows)
+    return temp_ids
+
+
+"""Load expired instances of a mapped class with a single query.
+
+After a commit every instance is expired, so reading an attribute of each
+one in turn costs a query per instance. Refreshing them together, through
+`temp_ids`, costs a constant number of queries.
+
+Args:
+    session (Session)
+    instances (list): persistent instances of one mapped class with an
+                      `id` primary key
+    *options: loader options, e.g. joinedload(...) for relationships to
+              load along with the instances
+
+Returns:
+    list: `instances`
+"""
+def load_instances(session, instances, *options):
+    if not instances:
+        return instances
+    if not options and not any(inspect(instance).expired_attributes
+                               for instance in instances):
+        return instances
+    cls = type(instances[0])
+    ids = load_temp_ids(session,
+        (inspect(instance).identity[0] for instance in instances))
+    session.query(cls).join(ids, ids.c.id == cls.id).options(*options).all()
+    return instances
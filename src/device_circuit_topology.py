@@ -0,0 +1,118 @@
+from db import db_session
+from db.device_or_circuit import DeviceCircuits
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import time
+
+
+# Writes to DeviceCircuits seen in this process, see _changed. Topologies
+# reload when it moved since they loaded their maps.
+_changes = 0
+
+
+def _changed(*args):
+    global _changes
+    _changes += 1
+
+
+# One set of listeners for every topology: ORM unit of work writes...
+for _name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(DeviceCircuits, _name, _changed)
+
+
+# ... and bulk/Core writes through any session, e.g. query().delete()
+@event.listens_for(Session, 'do_orm_execute')
+def _on_execute(state):
+    if (state.is_insert or state.is_update or state.is_delete) and \
+            getattr(state.statement.table, 'name', None) == \
+            DeviceCircuits.__tablename__:
+        _changed()
+
+
+"""In memory copy of the DeviceCircuits table.
+
+Maps a device to its circuits and a circuit to its devices. The maps are
+loaded on first use and reloaded after DeviceCircuits rows are written
+through a session of this process (unit of work or bulk/Core statements),
+and at least every `max_age` seconds to pick up writes of other processes
+or raw SQL. Call `invalidate()` to reload them right away.
+
+Attributes:
+    version (int): incremented each time the maps are invalidated
+"""
+class DeviceCircuitTopology:
+    """Constructor.
+
+    Args:
+        max_age (float): seconds before the maps are reloaded,
+                         None == only on changes in this process
+        clock (func()): returns the current time in seconds
+    """
+    def __init__(self, max_age=300, clock=time.monotonic):
+        self._max_age = max_age
+        self._clock = clock
+        self._circuits = None  # devid -> frozenset(circid)
+        self._devices = None   # circid -> frozenset(devid)
+        self._loaded_changes = None
+        self._loaded_time = None
+        self._version = 0
+
+    @property
+    def version(self):
+        self._check()
+        return self._version
+
+    """Drop the cached maps, they are reloaded on next use."""
+    def invalidate(self):
+        self._circuits = None
+        self._devices = None
+        self._version += 1
+
+    def _check(self):
+        if self._circuits is None:
+            return
+        if self._loaded_changes != _changes or (self._max_age is not None
+                and self._clock() - self._loaded_time >= self._max_age):
+            self.invalidate()
+
+    def _load(self):
+        self._loaded_changes = _changes
+        self._loaded_time = self._clock()
+        circuits = {}
+        devices = {}
+        for (devid, circid) in db_session.query(DeviceCircuits.devid,
+                DeviceCircuits.circid):
+            circuits.setdefault(devid, set()).add(circid)
+            devices.setdefault(circid, set()).add(devid)
+        self._circuits = {k: frozenset(v) for (k, v) in circuits.items()}
+        self._devices = {k: frozenset(v) for (k, v) in devices.items()}
+
+    """Circuits of a device.
+
+    Args:
+        devid (int)
+
+    Returns:
+        frozenset[int]
+    """
+    def circuits(self, devid):
+        self._check()
+        if self._circuits is None:
+            self._load()
+        return self._circuits.get(devid, frozenset())
+
+    """Devices a circuit depends on.
+
+    Args:
+        circid (int)
+
+    Returns:
+        frozenset[int]
+    """
+    def devices(self, circid):
+        self._check()
+        if self._devices is None:
+            self._load()
+        return self._devices.get(circid, frozenset())
@@ -0,0 +1,96 @@
+from db import db_session
+from db.device_or_circuit import DeviceOrCircuit
+
+from sqlalchemy import tuple_
+
+import time
+
+
+"""Cache of (provider, service_id) -> DeviceOrCircuit.id.
+
+The inventory rarely changes, so the whole table is loaded with `warm()`
+and kept in memory. Keys that are not found are remembered for
+`negative_ttl` seconds so unknown devices/circuits in the logs do not cost
+a query each. Call `refresh()` after changing the devices_or_circuits
+table.
+"""
+class DeviceOrCircuitCache:
+    # Keys per IN (...) query, keeps bind parameters under database limits
+    chunk_size = 450
+
+    """Constructor.
+
+    Args:
+        negative_ttl (float): seconds to remember that a key was not found
+        clock (func()): returns the current time in seconds
+    """
+    def __init__(self, negative_ttl=300, clock=time.monotonic):
+        self._negative_ttl = negative_ttl
+        self._clock = clock
+        self._ids = {}      # (provider, service_id) -> id
+        self._missing = {}  # (provider, service_id) -> expiry time
+
+    def __len__(self):
+        return len(self._ids)
+
+    """Load every device/circuit id."""
+    def warm(self):
+        self._ids = {(provider, service_id): id for (id, provider, service_id)
+            in db_session.query(DeviceOrCircuit.id, DeviceOrCircuit.provider,
+                                DeviceOrCircuit.service_id)}
+
+    """Drop all cached and negative entries and reload."""
+    def refresh(self):
+        self._missing = {}
+        self.warm()
+
+    """Lookup device/circuit id.
+
+    Args:
+        provider (str)
+        service_id (str)
+
+    Returns:
+        int: device/circuit id or None if not found
+    """
+    def get(self, provider, service_id):
+        return self.get_many([(provider, service_id)])[(provider, service_id)]
+
+    """Lookup many device/circuit ids.
+
+    Keys that are not cached are looked up with a single IN (...) query
+    (per `chunk_size` keys).
+
+    Args:
+        keys (iterable[(str, str)]): (provider, service_id)
+
+    Returns:
+        dict[(str, str), int]: id for each key, None if not found
+    """
+    def get_many(self, keys):
+        result = {}
+        unknown = set()
+        now = self._clock()
+        for key in keys:
+            id = self._ids.get(key)
+            if id is None and self._missing.get(key, now) <= now:
+                unknown.add(key)
+            result[key] = id
+
+        unknown = list(unknown)
+        for i in range(0, len(unknown), self.chunk_size):
+            chunk = unknown[i:i + self.chunk_size]
+            for (id, provider, service_id) in db_session.query(
+                    DeviceOrCircuit.id, DeviceOrCircuit.provider,
+                    DeviceOrCircuit.service_id).filter(
+                    tuple_(DeviceOrCircuit.provider,
+                           DeviceOrCircuit.service_id).in_(chunk)):
+                key = (provider, service_id)
+                self._ids[key] = result[key] = id
+                self._missing.pop(key, None)
+
+        expiry = now + self._negative_ttl
+        for key in unknown:
+            if result[key] is None:
+                self._missing[key] = expiry
+        return result
@@ -1,6 +1,9 @@
-from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, fields
 from datetime import datetime
 
+import functools
+
 """Class to represent the scheduled maintenance loaded from email.
 
 Attributes:
@@ -25,6 +28,10 @@ Attributes:
 """
 @dataclass(frozen=True)
 class MaintenanceNotification:
+    __slots__ = ('provider', 'update_id', 'cancel_id', 'service_id', 'begin',
+                 'end', 'subject', 'action_and_reason', 'location', 'impact',
+                 'email', 'phone')
+
     provider: str
     update_id: str
     cancel_id: str
@@ -38,29 +45,69 @@ class MaintenanceNotification:
     email: str
     phone: str
 
+    # Pickled by parse_many; see log_loader.Outage
+    def __reduce__(self):
+        return (type(self), tuple(getattr(self, field.name)
+                                  for field in fields(self)))
+
 """Class to parse the maintenance emails.
 
 Parses maintenance emails using a plugin system where each from email address 
-is a plugin.
+is a plugin. A plugin is imported the first time an email from its address
+is parsed (see email_parsers/manifest.json).
+
+A plugin can register a parser per mode: `regex` parsers match the whole
+email with a regular expression, `lines` parsers make a single pass over
+the lines of the email (see parse_fields) and so run in linear time.
+`default_mode` is used when a plugin has a parser for it, otherwise any
+parser of the plugin is used.
 """
 class EmailParser:
     _per_provider_parsers = {}
+    _providers = {}  # email address -> provider
+    default_mode = 'regex'
 
     """Register a plugin.
 
     Args:
         provider (str): email address of the provider
         parser (func(str, str)): parse function.
+        mode (str): `regex` or `lines`
+        name (str): the provider of the notifications parsed, see
+                    provider_of
+    """
+    @staticmethod
+    def register_parser(provider, parser, mode='regex', name=None):
+        EmailParser._per_provider_parsers.setdefault(provider, {})[mode] = \
+            parser
+        if name is not None:
+            EmailParser._providers[provider] = name
+
+    """Provider of the emails from an address, without parsing them.
+
+    Imports the plugin of the address if needed. Used to shard emails by
+    provider, like the log outages (see sharding.Shard).
+
+    Args:
+        fromaddr (str): provider email address
+
+    Returns:
+        str: the provider registered by the plugin of `fromaddr`, or
+             `fromaddr` if it registered none
     """
     @staticmethod
-    def register_parser(provider, parser):
-        EmailParser._per_provider_parsers[provider] = parser
+    def provider_of(fromaddr):
+        name = EmailParser._providers.get(fromaddr)
+        if name is None and email_parsers.manifest.load(fromaddr):
+            name = EmailParser._providers.get(fromaddr)
+        return name or fromaddr
 
     """Parse a maintenance email.
     
     Args:
         fromaddr (str): provider email address
         content (str): email content
+        mode (str): parser mode, defaults to EmailParser.default_mode
 
     Returns:
         MaintenanceNotification
@@ -69,26 +116,111 @@ class EmailParser:
         EmailParseError: Unable to parse email.
     """
     @staticmethod
-    def parse(fromaddr, content):
-        parser = EmailParser._per_provider_parsers.get(fromaddr)
+    def parse(fromaddr, content, mode=None):
+        parsers = EmailParser._per_provider_parsers.get(fromaddr)
+        if not parsers and email_parsers.manifest.load(fromaddr):
+            parsers = EmailParser._per_provider_parsers.get(fromaddr)
 
-        if not parser:
+        if not parsers:
             raise EmailParseError(f'No parser for {fromaddr}')
 
+        parser = parsers.get(mode or EmailParser.default_mode)
+        if not parser:
+            parser = next(iter(parsers.values()))
+
         return parser(fromaddr, content)
 
+    """Parse many maintenance emails using a pool of processes.
+
+    Args:
+        emails (iterable[(str, str)]): fromaddr, content
+        max_workers (int): number of processes, defaults to the number of
+                           CPUs. Ignored if `executor` is given.
+        chunksize (int): emails sent to a process at a time
+        executor (ProcessPoolExecutor): pool to use instead of creating
+                                        (and shutting down) a new one
+        mode (str): parser mode, see parse
+
+    Returns:
+        list[MaintenanceNotification or EmailParseError]: in the same order
+            as `emails`. Emails that cannot be parsed give an
+            EmailParseError instead of raising it.
+    """
+    @staticmethod
+    def parse_many(emails, max_workers=None, chunksize=64, executor=None,
+                   mode=None):
+        parse = functools.partial(_parse_or_error, mode=mode)
+        if executor is not None:
+            return list(executor.map(parse, emails, chunksize=chunksize))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(parse, emails, chunksize=chunksize))
+
+
+def _parse_or_error(email, mode=None):
+    try:
+        return EmailParser.parse(*email, mode=mode)
+    except EmailParseError as e:
+        return e
+
+
+"""Parse `Name: value` fields with a single pass over the lines of an email.
+
+The fields must appear in the given order, each on its own line. Lines
+before, between and after the fields are ignored, as are lines for which
+the field handler raises ValueError. Field names are matched ignoring
+case.
+
+Args:
+    content (str): email content
+    fields (dict[str, func(str)]): field name (including the colon) to
+        handler, in the order the fields appear in the email. The handler
+        is called with the stripped value and returns the parsed value.
+
+Returns:
+    dict[str, object]: field name to value returned by its handler
+
+Raises:
+    EmailParseError: A field was not found.
+"""
+def parse_fields(content, fields):
+    fields = [(name.lower(), name, handler)
+              for (name, handler) in fields.items()]
+    result = {}
+    i = 0
+    for line in content.splitlines():
+        if i == len(fields):
+            break
+        (lower_name, name, handler) = fields[i]
+        if line[:len(lower_name)].lower() != lower_name:
+            continue
+        try:
+            result[name] = handler(line[len(lower_name):].strip())
+        except ValueError:
+            continue
+        i += 1
+
+    if i < len(fields):
+        raise EmailParseError(f'Failed to parse {fields[i][1]}')
+    return result
+
 
 """Decorator to register a parser with EmailParser.
 
 Args:
     provider (str): provider's email address
+    mode (str): `regex` or `lines`
+    name (str): the provider of the notifications parsed, as in the
+                DeviceCircuits table
 """
 class register_parser:
-    def __init__(self, provider):
+    def __init__(self, provider, mode='regex', name=None):
         self._provider = provider
+        self._mode = mode
+        self._name = name
 
     def __call__(self, func):
-        EmailParser.register_parser(self._provider, func)
+        EmailParser.register_parser(self._provider, func, self._mode,
+                                    self._name)
         return func
 
 
@@ -96,5 +228,5 @@ class EmailParseError(RuntimeError):
     pass
 
 
-# load plugins
+# plugin manifest, the plugins are imported on first use
 import email_parsers
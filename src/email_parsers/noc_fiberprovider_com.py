@@ -25,7 +25,7 @@ _parser_re = re.compile(r'^Subject: (?P<subj>.*?)$'
                        , re.MULTILINE|re.IGNORECASE|re.DOTALL)
 
 
-@register_parser('noc@fiberprovider.com')
+@register_parser('noc@fiberprovider.com', name='fiberprovider')
 def parse(fromaddr, content):
     mo = _parser_re.match(content)
     if not mo:
@@ -50,3 +50,56 @@ def parse(fromaddr, content):
         mo.group('impact'),
         mo.group('email'),
         mo.group('phone'))
+
+
+def _parse_time(value):
+    return datetime.strptime(value, '%Y-%b-%d %H:%M %Z')
+
+
+def _parse_id(value):
+    if not re.fullmatch(r'\w+', value):
+        raise ValueError(value)
+    return value
+
+
+def _cancelled_id(action_reason):
+    prefix = 'new try for cancelled '
+    i = action_reason.lower().rfind(prefix)
+    if i >= 0 and action_reason.endswith('.'):
+        cancelled = action_reason[i + len(prefix):-1]
+        if re.fullmatch(r'\w+', cancelled):
+            return cancelled
+    return None
+
+
+_fields = {
+    'Subject:': str,
+    'PW Reference Number:': _parse_id,
+    'Start Date and Time:': _parse_time,
+    'End Date and Time:': _parse_time,
+    'Action and Reason:': str,
+    'Location of work:': str,
+    'Service ID:': str,
+    'Impact:': str,
+    'E-mail:': str,
+    'Phone:': str,
+}
+
+
+@register_parser('noc@fiberprovider.com', mode='lines', name='fiberprovider')
+def parse_lines(fromaddr, content):
+    fields = parse_fields(content, _fields)
+
+    return MaintenanceNotification(
+        'fiberprovider',
+        fields['PW Reference Number:'],
+        _cancelled_id(fields['Action and Reason:']),
+        fields['Service ID:'],
+        fields['Start Date and Time:'],
+        fields['End Date and Time:'],
+        fields['Subject:'],
+        fields['Action and Reason:'],
+        fields['Location of work:'],
+        fields['Impact:'],
+        fields['E-mail:'],
+        fields['Phone:'])
@@ -0,0 +1,262 @@
+from async_poll import AsyncPoller
+from email_parser import EmailParseError, EmailParser
+from log_loader import Outage
+from metrics import metrics
+from outage_loader import OutageLoaderError
+
+from datetime import datetime, timezone
+
+import asyncio
+import email
+import email.policy
+import email.utils
+import json
+import logging
+import os
+
+
+"""Parse a pushed log record.
+
+A record is a JSON object with `provider`, `service_id`, `begin` and
+`end` (ISO 8601, UTC) and optionally `data` (object) and `time` (the log
+time, defaults to `end`).
+
+Args:
+    line (str or bytes)
+
+Returns:
+    (datetime, Outage)
+
+Raises:
+    ValueError: malformed record
+"""
+def parse_log_record(line):
+    try:
+        record = json.loads(line)
+        begin = datetime.fromisoformat(record['begin'])
+        end = datetime.fromisoformat(record['end'])
+        time = datetime.fromisoformat(record['time']) if 'time' in record \
+            else end
+        outage = Outage(record['provider'], record['service_id'], begin, end,
+                        record.get('data') or {})
+    except (KeyError, TypeError, json.JSONDecodeError) as e:
+        raise ValueError(f'Malformed log record: {e!r}') from e
+    return (time, outage)
+
+
+"""Read a message from a maildir.
+
+The content is rebuilt in the helpdesk format (see
+data/provider_email.txt): a Subject line followed by the body.
+
+Args:
+    path (str)
+
+Returns:
+    (datetime, str, str): time, fromaddr, content
+"""
+def read_maildir_message(path):
+    with open(path, 'rb') as f:
+        message = email.message_from_binary_file(f, policy=email.policy.default)
+    fromaddr = email.utils.parseaddr(message.get('From', ''))[1]
+    body = message.get_body(preferencelist=('plain',))
+    content = (f'Subject: {message.get("Subject", "")}\n\n'
+               f'Body:\n{body.get_content() if body is not None else ""}')
+    try:
+        time = email.utils.parsedate_to_datetime(message['Date'])
+        if time.tzinfo is not None:
+            time = time.astimezone(timezone.utc).replace(tzinfo=None)
+    except (TypeError, ValueError):
+        time = datetime.utcfromtimestamp(os.path.getmtime(path))
+    return (time, fromaddr, content)
+
+
+'''Event driven version of AsyncPoller.
+
+New records are handled as soon as they arrive instead of on the next
+poll:
+
+    * Log records pushed as JSON lines (see parse_log_record) to the
+      UNIX socket `socket_path`, or written to `*.jsonl` files in
+      `spool_dir`, are stored, classified and reported right away.
+      Spool files must be written under another name (e.g. a `.tmp`
+      suffix or a leading dot) and renamed when complete; they are
+      deleted once handled, or renamed to `*.failed` if they cannot be.
+    * Emails delivered to the maildir `maildir` are parsed and stored
+      right away, then moved to its `cur` directory (flagged if they
+      cannot be handled).
+
+Each event only runs its part of the pipeline: an email updates the
+scheduled outages, a log record is classified against them (once an
+email poll that started after it arrived is done, as for polled log
+records). The directories are checked every `watch_interval` seconds (a
+directory listing, no database access while idle). The helpdesk and log apis are
+still polled every `sweep_interval` seconds (see AsyncPoller) to pick up
+anything that was not pushed. Records and emails read both ways are
+only stored once: `dedup` is always set.
+'''
+class EventPoller(AsyncPoller):
+    """Constructor.
+
+    Args:
+        sweep_interval (float): seconds between polls of the apis.
+                                0 == Poll once at start
+        socket_path (str): UNIX socket to listen on for log records
+        spool_dir (str): directory to watch for log record files
+        maildir (str): maildir to watch for emails
+        watch_interval (float): seconds between checks of the directories
+        **kwargs: see AsyncPoller, except `dedup`
+    """
+    def __init__(self, sweep_interval, socket_path=None, spool_dir=None,
+                 maildir=None, watch_interval=0.2, **kwargs):
+        super().__init__(sweep_interval, sweep_interval,
+                         **dict(kwargs, dedup=True))
+        self._socket_path = socket_path
+        self._spool_dir = spool_dir
+        self._maildir = maildir
+        self._watch_interval = watch_interval
+
+    """Run forever."""
+    async def run(self):
+        self._start()
+        tasks = [self._poll()]
+        if self._socket_path:
+            if os.path.exists(self._socket_path):
+                os.remove(self._socket_path)
+            server = await asyncio.start_unix_server(self._handle_connection,
+                                                     self._socket_path)
+            tasks.append(server.serve_forever())
+        if self._spool_dir or self._maildir:
+            tasks.append(self._watch())
+        await asyncio.gather(*tasks)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    record = parse_log_record(line)
+                except ValueError as e:
+                    metrics.inc('rejected_log_records')
+                    writer.write(f'error {e}\n'.encode())
+                    continue
+                try:
+                    await self.handle_log_records([record])
+                except OutageLoaderError as e:
+                    writer.write(f'error {e}\n'.encode())
+                    continue
+                writer.write(b'ok\n')
+        finally:
+            writer.close()
+
+    async def _watch(self):
+        while True:
+            if self._spool_dir:
+                await self.scan_spool()
+            if self._maildir:
+                await self.scan_maildir()
+            await asyncio.sleep(self._watch_interval)
+
+    """Store, classify and report pushed log records.
+
+    The records are stored in a single transaction: either all or none of
+    them are stored.
+
+    Args:
+        records (list[(datetime, Outage)])
+
+    Returns:
+        int: number of detected outages stored
+
+    Raises:
+        OutageLoaderError: Cannot find device/circuit, nothing is stored
+    """
+    async def handle_log_records(self, records):
+        email_poll = self._request_email_poll()
+        detected_outages = self._loader.store_log_records(records,
+                                                          pushed=True)
+        await self._wait_for_email_poll(email_poll)
+        for i in range(0, len(detected_outages), self._batch_size):
+            self._classify(detected_outages[i:i + self._batch_size])
+        metrics.inc('log_events')
+        return len(detected_outages)
+
+    """Handle the complete `*.jsonl` files in the spool directory.
+
+    Returns:
+        int: number of files handled
+    """
+    async def scan_spool(self):
+        names = sorted(name for name in os.listdir(self._spool_dir)
+                       if name.endswith('.jsonl') and not name.startswith('.'))
+        for name in names:
+            path = os.path.join(self._spool_dir, name)
+            records = []
+            with open(path) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        records.append(parse_log_record(line))
+                    except ValueError as e:
+                        metrics.inc('rejected_log_records')
+                        logging.getLogger(__name__).warning('%s: %s', path, e)
+            try:
+                await self.handle_log_records(records)
+            except OutageLoaderError as e:
+                logging.getLogger(__name__).error('%s: %s', path, e)
+                os.rename(path, path + '.failed')
+                continue
+            os.remove(path)
+        return len(names)
+
+    """Handle the emails in the `new` directory of the maildir.
+
+    Returns:
+        int: number of emails handled
+    """
+    async def scan_maildir(self):
+        new = os.path.join(self._maildir, 'new')
+        cur = os.path.join(self._maildir, 'cur')
+        names = sorted(name for name in os.listdir(new)
+                       if not name.startswith('.'))
+        loop = asyncio.get_event_loop()
+        for name in names:
+            path = os.path.join(new, name)
+            (time, fromaddr, content) = read_maildir_message(path)
+            if self._loader.duplicate_email(fromaddr, content):
+                os.rename(path, os.path.join(cur, name + ':2,S'))
+                continue
+            try:
+                notification = await loop.run_in_executor(
+                    None, EmailParser.parse, fromaddr, content)
+                metrics.inc('records', stage='parse')
+                self._loader.store_notification(time, notification,
+                                                (fromaddr, content))
+            except (EmailParseError, OutageLoaderError) as e:
+                if isinstance(e, EmailParseError):
+                    metrics.inc('parse_failures')
+                logging.getLogger(__name__).error('%s: %s', path, e)
+                os.rename(path, os.path.join(cur, name + ':2,F'))
+                continue
+            os.rename(path, os.path.join(cur, name + ':2,S'))
+            metrics.inc('email_events')
+        return len(names)
+
+
+"""Run EventPoller forever.
+
+Args:
+    sweep_interval (float): seconds between polls of the apis
+    **kwargs: see EventPoller
+"""
+def event_poll(sweep_interval, **kwargs):
+    poller = EventPoller(sweep_interval, **kwargs)
+    try:
+        asyncio.run(poller.run())
+    finally:
+        poller.close()
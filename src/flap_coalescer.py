@@ -0,0 +1,160 @@
+from db import db_session
+from db.outage import FlapState
+from log_loader import Outage
+
+from datetime import datetime
+
+import heapq
+import json
+
+
+class _Group:
+    def __init__(self, time, outage):
+        self.time = time
+        self.begin = outage.begin
+        self.end = outage.end
+        self.data = outage.data
+        self.intervals = [(outage.begin, outage.end)]
+
+    def outage(self, key):
+        if len(self.intervals) == 1:
+            data = self.data
+        else:
+            data = dict(self.data, intervals=[
+                [begin.isoformat(), end.isoformat()]
+                for (begin, end) in self.intervals])
+        return Outage(key[0], key[1], self.begin, self.end, data)
+
+
+"""Merges the outages of flapping devices/circuits.
+
+Outages of the same (provider, service_id) that are less than `gap`
+apart are merged into one outage, from the first begin to the last end.
+The original intervals are kept in its `data`, as `intervals`:
+[[begin, end], ...] in ISO 8601. Single outages are passed on unchanged.
+
+An outage is held back until the log (expected in order of end time, as
+from log_loader.load_outages_from_logs) is past its end by more than
+`gap`, or the log is read up to a time that is (see flush). The
+outages held back are stored in the FlapState table by
+`sync()`, so a flap that straddles two polls is merged as well.
+"""
+class FlapCoalescer:
+    """Constructor.
+
+    Args:
+        gap (timedelta): largest gap between merged outages
+        owns (func(str)): if given, only the FlapState rows of providers
+                          for which it returns True are loaded
+    """
+    def __init__(self, gap, owns=None):
+        self._gap = gap
+        self._owns = owns
+        self._groups = {}    # (provider, service_id) -> _Group
+        self._deadlines = [] # heap of (end + gap, key)
+        self._rows = {}      # (provider, service_id) -> FlapState
+        self._dirty = set()
+
+    def __len__(self):
+        return len(self._groups)
+
+    """(Re)load the outages held back from the FlapState table."""
+    def load(self):
+        self._groups = {}
+        self._deadlines = []
+        self._dirty = set()
+        self._rows = {(row.provider, row.service_id): row
+                      for row in db_session.query(FlapState)
+                      if self._owns is None or self._owns(row.provider)}
+        for (key, row) in self._rows.items():
+            data = json.loads(row.data)
+            intervals = data.pop('intervals')
+            group = _Group(row.time, Outage(key[0], key[1], row.begin_time,
+                                            row.end_time, data))
+            group.intervals = [(datetime.fromisoformat(begin),
+                                datetime.fromisoformat(end))
+                               for (begin, end) in intervals]
+            self._groups[key] = group
+            heapq.heappush(self._deadlines, (group.end + self._gap, key))
+
+    """Add an outage.
+
+    Args:
+        time (datetime): log time of the outage
+        outage (log_loader.Outage)
+
+    Returns:
+        list[(datetime, log_loader.Outage)]: outages no longer held back,
+            each with the log time of `outage`
+    """
+    def add(self, time, outage):
+        result = []
+        key = (outage.provider, outage.service_id)
+        group = self._groups.get(key)
+        if group is not None and outage.begin - group.end <= self._gap \
+                and group.begin - outage.end <= self._gap:
+            group.begin = min(group.begin, outage.begin)
+            group.end = max(group.end, outage.end)
+            group.intervals.append((outage.begin, outage.end))
+            group.time = max(group.time, time)
+        else:
+            if group is not None:
+                result.append((time, group.outage(key)))
+            group = self._groups[key] = _Group(time, outage)
+        heapq.heappush(self._deadlines, (group.end + self._gap, key))
+        self._dirty.add(key)
+
+        # Pass on the outages the log is past by more than `gap`
+        result.extend((time, outage) for (group_time, outage)
+                      in self._release(time))
+        return result
+
+    """Pass on the outages that ended more than `gap` before `now`.
+
+    Call once the log is read up to `now`: no more outages are coming to
+    merge with them. Without it, an outage is only passed on when a later
+    log record moves past it, however late that comes.
+
+    Args:
+        now (datetime)
+
+    Returns:
+        list[(datetime, log_loader.Outage)]: outages no longer held back,
+            each with the log time of its last outage
+    """
+    def flush(self, now):
+        return self._release(now)
+
+    def _release(self, time):
+        result = []
+        while self._deadlines and self._deadlines[0][0] < time:
+            (deadline, expired) = heapq.heappop(self._deadlines)
+            group = self._groups.get(expired)
+            if group is None or group.end + self._gap != deadline:
+                continue  # stale entry
+            del self._groups[expired]
+            self._dirty.add(expired)
+            result.append((group.time, group.outage(expired)))
+        return result
+
+    """Write the outages held back to the FlapState table (no commit)."""
+    def sync(self):
+        for key in self._dirty:
+            group = self._groups.get(key)
+            row = self._rows.get(key)
+            if group is None:
+                if row is not None:
+                    db_session.delete(row)
+                    del self._rows[key]
+                continue
+            if row is None:
+                row = self._rows[key] = FlapState(provider=key[0],
+                                                  service_id=key[1])
+                db_session.add(row)
+            row.begin_time = group.begin
+            row.end_time = group.end
+            row.time = group.time
+            row.data = json.dumps(dict(group.data, intervals=[
+                [begin.isoformat(), end.isoformat()]
+                for (begin, end) in group.intervals]))
+        self._dirty = set()
@@ -1,3 +1,6 @@
+from async_iter import iterate_in_executor
+
+
 '''Load new emails using helpdesk api.
 
 This method must use the helpdesk api to load email notifications and yield
@@ -13,3 +16,42 @@ def load_new_emails(last_processed_time):
     # just force this to be a generator
     if False:
         yield None
+
+
+'''Load the new emails of a shard using helpdesk api.
+
+Used by sharded workers (see sharding.py) instead of load_new_emails.
+Replace it with a helpdesk query filtered on the from address (with
+`shard.owns(EmailParser.provider_of(fromaddr))`) so that each worker only
+reads its own emails.
+The emails of other shards may be left out; the default implementation
+yields all of them and the worker drops them.
+
+Args:
+    last_processed_time (datetime)
+    shard (sharding.Shard)
+
+Yields:
+    (datetime, str, str): time, fromaddr, content
+'''
+def load_shard_new_emails(last_processed_time, shard):
+    return load_new_emails(last_processed_time)
+
+
+'''Load new emails using helpdesk api, for asyncio.
+
+Async variant of load_new_emails. The default implementation runs
+load_new_emails in a worker thread, so it must not use db_session (which
+belongs to the event loop thread); replace it with a native async
+helpdesk client if one is available.
+
+Args:
+    last_processed_time (datetime)
+
+Yields:
+    (datetime, str, str): time, fromaddr, content
+'''
+async def aload_new_emails(last_processed_time):
+    async for email in iterate_in_executor(
+            load_new_emails(last_processed_time)):
+        yield email
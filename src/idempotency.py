@@ -0,0 +1,159 @@
+from db import db_session
+from db.idempotency import IdempotencyKey
+
+from sqlalchemy import event
+
+from collections import OrderedDict
+from datetime import datetime
+
+import hashlib
+import math
+
+
+"""Bloom filter of strings.
+
+Answers "definitely not added" or "maybe added", with a false positive
+rate of about `error_rate` up to `capacity` strings.
+"""
+class BloomFilter:
+    def __init__(self, capacity=1000000, error_rate=0.01):
+        self._bits = max(8, int(-capacity * math.log(error_rate) /
+                                math.log(2) ** 2))
+        self._hashes = max(1, round(self._bits / capacity * math.log(2)))
+        self._array = bytearray((self._bits + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self._bits for i in range(self._hashes))
+
+    def add(self, value):
+        for position in self._positions(value):
+            self._array[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self._array[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(value))
+
+
+"""Key of an email: hash of its from address and content."""
+def email_key(fromaddr, content):
+    return hashlib.blake2b(f'{fromaddr}\0{content}'.encode(),
+                           digest_size=16).hexdigest()
+
+
+"""Key of a log outage: hash of (provider, service_id, begin, end)."""
+def outage_key(outage):
+    return hashlib.blake2b(
+        f'{outage.provider}\0{outage.service_id}\0'
+        f'{outage.begin.isoformat()}\0{outage.end.isoformat()}'.encode(),
+        digest_size=16).hexdigest()
+
+
+"""Remembers which emails/log outages were handled, to drop re-deliveries.
+
+The keys are stored in the IdempotencyKey table, in the same transaction
+as the data they were handled with. In front of the table are an LRU of
+recent keys and a Bloom filter of all keys (loaded by `load()`), so a
+new key normally costs no query: only keys the Bloom filter may have
+seen are looked up.
+
+Keys added but not committed are dropped from the LRU on rollback, so a
+record whose transaction failed is not mistaken for a duplicate.
+"""
+class IdempotencyFilter:
+    """Constructor.
+
+    Args:
+        kind (str): 'email' or 'log'
+        lru_size (int): recent keys kept in memory
+        bloom_capacity (int): keys the Bloom filter is sized for
+        error_rate (float): Bloom filter false positive rate, the rate of
+                            new keys that cost a query
+    """
+    def __init__(self, kind, lru_size=100000, bloom_capacity=1000000,
+                 error_rate=0.01):
+        self._kind = kind
+        self._lru_size = lru_size
+        self._lru = OrderedDict()
+        self._bloom = BloomFilter(bloom_capacity, error_rate)
+        self._uncommitted = []
+
+        event.listen(db_session, 'after_commit', self._on_commit)
+        event.listen(db_session, 'after_rollback', self._on_rollback)
+
+    """Stop following the transactions of db_session.
+
+    Call when the filter is no longer used, or it stays referenced (and
+    called) by db_session.
+    """
+    def close(self):
+        if event.contains(db_session, 'after_commit', self._on_commit):
+            event.remove(db_session, 'after_commit', self._on_commit)
+            event.remove(db_session, 'after_rollback', self._on_rollback)
+
+    def _on_commit(self, session):
+        self._uncommitted = []
+
+    def _on_rollback(self, session):
+        for key in self._uncommitted:
+            self._lru.pop(key, None)
+        self._uncommitted = []
+
+    """Load the stored keys into the Bloom filter."""
+    def load(self):
+        for (key,) in db_session.query(IdempotencyKey.key).filter_by(
+                kind=self._kind).yield_per(10000):
+            self._bloom.add(key)
+
+    def _remember(self, key):
+        self._lru[key] = True
+        self._lru.move_to_end(key)
+        if len(self._lru) > self._lru_size:
+            self._lru.popitem(last=False)
+
+    """Check whether a key was seen.
+
+    Args:
+        key (str)
+
+    Returns:
+        bool
+    """
+    def seen(self, key):
+        if key in self._lru:
+            self._lru.move_to_end(key)
+            return True
+        if key not in self._bloom:
+            return False
+        if db_session.get(IdempotencyKey, (self._kind, key)) is None:
+            return False
+        self._remember(key)
+        return True
+
+    """Record a key, stored with the next commit.
+
+    Args:
+        key (str)
+    """
+    def add(self, key):
+        db_session.add(IdempotencyKey(kind=self._kind, key=key,
+                                      time=datetime.utcnow()))
+        self._bloom.add(key)
+        self._remember(key)
+        self._uncommitted.append(key)
+
+    """Add a key unless it was seen.
+
+    Args:
+        key (str)
+
+    Returns:
+        bool: True if the key is new
+    """
+    def check_and_add(self, key):
+        if self.seen(key):
+            return False
+        self.add(key)
+        return True
@@ -0,0 +1,62 @@
+from bisect import bisect_right
+
+
+"""Merge overlapping or touching intervals.
+
+Args:
+    intervals (iterable[(datetime, datetime)])
+
+Returns:
+    list[(datetime, datetime)]: sorted, disjoint intervals
+"""
+def merge_intervals(intervals):
+    merged = []
+    for (begin, end) in sorted(intervals):
+        if merged and begin <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((begin, end))
+    return merged
+
+
+"""Subtract merged intervals from [begin, end].
+
+Runs in O(log m + k) for m merged intervals, k of which overlap
+[begin, end].
+
+Args:
+    begin (datetime)
+    end (datetime)
+    merged (list[(datetime, datetime)]): output of merge_intervals
+    ends (list[datetime]): end times of `merged`, computed if not given
+
+Returns:
+    list[(datetime, datetime)]: the parts of [begin, end] not covered by
+        `merged`, in order. A zero length interval is returned as is
+        unless it is covered.
+"""
+def subtract_intervals(begin, end, merged, ends=None):
+    if ends is None:
+        ends = [e for (b, e) in merged]
+
+    i = bisect_right(ends, begin)
+    if begin >= end:
+        if i < len(merged) and merged[i][0] <= begin:
+            return []
+        if i > 0 and ends[i - 1] == begin:
+            return []
+        return [(begin, end)]
+
+    result = []
+    cursor = begin
+    while i < len(merged) and merged[i][0] < end:
+        (window_begin, window_end) = merged[i]
+        if window_begin > cursor:
+            result.append((cursor, window_begin))
+        if window_end > cursor:
+            cursor = window_end
+        i += 1
+    if cursor < end:
+        result.append((cursor, end))
+    return result
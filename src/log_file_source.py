@@ -0,0 +1,212 @@
+from db import db_session
+from db.last_processed import LogCheckpoint
+from log_loader import Outage
+
+from datetime import datetime
+
+import json
+import log_loader
+import mmap
+import os
+import re
+
+
+# <time> <provider> <service_id> DOWN|UP, e.g.
+# 2019-04-09T06:05:00 fiberprovider IC-99999 DOWN
+default_pattern = re.compile(
+    rb'^(?P<time>\S+) (?P<provider>\S+) (?P<service_id>\S+) '
+    rb'(?P<state>DOWN|UP)\b', re.MULTILINE)
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value.decode())
+
+
+"""Log source reading up/down events from a (multi-GB) log file.
+
+The file is memory mapped and scanned `chunk_size` bytes (whole lines) at
+a time with a single multi-line regular expression, so lines without
+events cost no Python code. A down event of a (provider, service_id)
+followed by an up event is an Outage from the down to the up time.
+
+The position in the file (inode and byte offset) and the down events not
+yet followed by an up event are kept in the LogCheckpoint table, so a
+poll resumes where the last one stopped without reading the file again.
+save() writes the position right after the last outage yielded to the
+checkpoint; OutageLoader calls it (as log_loader.save_position) in the
+transaction storing the outages read so far, so stored outages and the
+checkpoint cannot get out of step.
+
+A new inode means the file was rotated: the rest of the old file is read
+from `rotated_paths` if it is still there, then the new file from the
+start. A file shorter than the checkpoint offset was truncated and is
+read from the start.
+
+Use as `LogFileSource(path).install()`.
+"""
+class LogFileSource:
+    """Constructor.
+
+    Args:
+        path (str): log file
+        name (str): LogCheckpoint name
+        rotated_paths (list[str]): where rotated files may be found,
+                                   defaults to `path`.1
+        pattern (re.Pattern): bytes, multi-line, with `time`, `provider`,
+                              `service_id` and `state` (DOWN/UP) groups
+        parse_time (func(bytes)): parses the `time` group
+        chunk_size (int): bytes scanned at a time
+    """
+    def __init__(self, path, name=None, rotated_paths=None,
+                 pattern=default_pattern, parse_time=_parse_time,
+                 chunk_size=16 * 1024 * 1024):
+        self._path = path
+        self._name = name or f'file:{os.path.abspath(path)}'
+        self._rotated_paths = rotated_paths if rotated_paths is not None \
+            else [path + '.1']
+        self._pattern = pattern
+        self._parse_time = parse_time
+        self._chunk_size = chunk_size
+
+        self._checkpoint = None
+        self._inode = None
+        self._offset = 0
+        self._pending = {}  # (provider, service_id) -> down time
+
+    """Make this the log source of log_loader.
+
+    Sets log_loader.load_outages_from_logs, aload_outages_from_logs and
+    save_position.
+    """
+    def install(self):
+        log_loader.load_outages_from_logs = self
+        log_loader.aload_outages_from_logs = self.aload
+        log_loader.save_position = self.save
+
+    """Load new outages.
+
+    Args:
+        last_processed_time (datetime): outages ending at or before this
+            time are skipped when there is no checkpoint yet
+
+    Yields:
+        (datetime, Outage): up time, outage
+    """
+    def __call__(self, last_processed_time):
+        checkpoint = db_session.get(LogCheckpoint, self._name)
+        if checkpoint is None:
+            # Added to the session by save()
+            checkpoint = LogCheckpoint(name=self._name, inode=0, offset=0,
+                                       pending='{}')
+            skip_until = last_processed_time
+        else:
+            skip_until = None
+        self._checkpoint = checkpoint
+        self._inode = checkpoint.inode
+        self._offset = checkpoint.offset
+        self._pending = {tuple(key.split('\0', 1)): datetime.fromisoformat(time)
+            for (key, time) in json.loads(checkpoint.pending).items()}
+
+        for (time, outage) in self._read():
+            if skip_until is None or time > skip_until:
+                yield (time, outage)
+
+    """Load new outages, for asyncio.
+
+    Reads on the event loop thread, unlike the default
+    log_loader.aload_outages_from_logs: the checkpoint is in db_session,
+    and save() must see the position of the last outage taken rather than
+    of outages read ahead. The scan holds the GIL either way.
+
+    Args:
+        last_processed_time (datetime): see __call__
+
+    Yields:
+        (datetime, Outage): up time, outage
+    """
+    async def aload(self, last_processed_time):
+        for outage in self(last_processed_time):
+            yield outage
+
+    """Write the position after the last outage yielded to the checkpoint.
+
+    Only in the session; the caller commits it along with the outages
+    yielded so far (or rolls it back if they cannot be stored).
+    """
+    def save(self):
+        if self._checkpoint is None:
+            return
+        self._save(self._checkpoint)
+        db_session.add(self._checkpoint)
+
+    def _save(self, checkpoint):
+        if checkpoint.inode != self._inode:
+            checkpoint.inode = self._inode
+        if checkpoint.offset != self._offset:
+            checkpoint.offset = self._offset
+        pending = json.dumps({f'{provider}\0{service_id}': time.isoformat()
+            for ((provider, service_id), time) in self._pending.items()},
+            sort_keys=True)
+        if checkpoint.pending != pending:
+            checkpoint.pending = pending
+
+    def _read(self):
+        try:
+            stat = os.stat(self._path)
+        except FileNotFoundError:
+            return
+
+        if self._inode and stat.st_ino != self._inode:
+            # Rotated: finish the old file if it can still be found
+            for path in self._rotated_paths:
+                try:
+                    if os.stat(path).st_ino == self._inode:
+                        yield from self._read_file(path)
+                        break
+                except FileNotFoundError:
+                    pass
+            self._offset = 0
+        elif stat.st_size < self._offset:
+            # Truncated
+            self._offset = 0
+        self._inode = stat.st_ino
+        yield from self._read_file(self._path)
+
+    def _read_file(self, path):
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= self._offset:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                while self._offset < size:
+                    end = data.rfind(b'\n', self._offset,
+                                     min(size, self._offset + self._chunk_size))
+                    if end < 0:
+                        if self._offset + self._chunk_size < size:
+                            # A line longer than a chunk, take it whole
+                            end = data.find(b'\n', self._offset)
+                        if end < 0:
+                            return  # incomplete last line
+                    yield from self._scan(data, end + 1)
+                    self._offset = end + 1
+
+    def _scan(self, data, end):
+        pending = self._pending
+        for match in self._pattern.finditer(data, self._offset, end):
+            (time, provider, service_id, state) = match.group(
+                'time', 'provider', 'service_id', 'state')
+            key = (provider.decode(), service_id.decode())
+            if state == b'DOWN':
+                if key not in pending:
+                    pending[key] = self._parse_time(time)
+                continue
+            begin = pending.pop(key, None)
+            if begin is None:
+                continue  # up without a down, e.g. before the first read
+            time = self._parse_time(time)
+            # The checkpoint must not include the rest of the chunk until
+            # the outages before it have been stored
+            offset = self._offset
+            self._offset = match.end()
+            yield (time, Outage(key[0], key[1], begin, time, {}))
+            self._offset = offset
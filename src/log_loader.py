@@ -1,4 +1,6 @@
-from dataclasses import dataclass
+from async_iter import iterate_in_executor
+
+from dataclasses import dataclass, fields
 from datetime import datetime
 
 
@@ -15,12 +17,21 @@ Attributes:
 """
 @dataclass(frozen=True)
 class Outage:
+    # No per instance __dict__: one of these is made per log record
+    __slots__ = ('provider', 'service_id', 'begin', 'end', 'data')
+
     provider: str
     service_id: str
     begin: datetime
     end: datetime
     data: dict
 
+    # The default pickling of a frozen dataclass with slots sets the slots
+    # with setattr, which frozen forbids
+    def __reduce__(self):
+        return (type(self), tuple(getattr(self, field.name)
+                                  for field in fields(self)))
+
 
 '''Load outages from logs.
 
@@ -37,3 +48,55 @@ def load_outages_from_logs(last_processed_time):
     # just force this to be a generator
     if False:
         yield None
+
+
+'''Load the outages of a shard from logs.
+
+Used by sharded workers (see sharding.py) instead of
+load_outages_from_logs. Replace it with a query of the log access api
+filtered on the provider (with `shard.owns(provider)`, or the same hash
+computed by the log store) so that each worker only reads its own part
+of the logs. The outages of other shards may be left out; the default
+implementation yields all of them and the worker drops them.
+
+Args:
+    last_processed_time (datetime)
+    shard (sharding.Shard)
+
+Yields:
+    (datetime, Outage)
+'''
+def load_shard_outages_from_logs(last_processed_time, shard):
+    return load_outages_from_logs(last_processed_time)
+
+
+'''Save the position of the log source.
+
+Called by OutageLoader in the transaction that stores the outages read so
+far, right before it is committed. Log sources that keep their position
+in the database replace it (see log_file_source.LogFileSource.install),
+so that it is committed along with the outages; the default does
+nothing.
+'''
+def save_position():
+    pass
+
+
+'''Load outages from logs, for asyncio.
+
+Async variant of load_outages_from_logs. The default implementation runs
+load_outages_from_logs in a worker thread, so it must not use db_session
+(which belongs to the event loop thread); replace it with a native async
+log client if one is available, or with one that reads on the event loop
+thread if the source uses the database.
+
+Args:
+    last_processed_time (datetime)
+
+Yields:
+    (datetime, Outage)
+'''
+async def aload_outages_from_logs(last_processed_time):
+    async for outage in iterate_in_executor(
+            load_outages_from_logs(last_processed_time)):
+        yield outage
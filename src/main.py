@@ -1,12 +1,47 @@
+from async_poll import apoll
+from event_poll import event_poll
+from db import engine
+from metrics import metrics
 from outage_loader import *
+from scheduled_outage_index import ScheduledOutageIndex
 from sla_handler import *
 from unscheduled_outage_generator import *
 
+from datetime import timedelta
+
 import argparse
+import logging
 import time
 import pprint
 
 
+"""Load, classify and report new outages once.
+
+Args:
+    loader (OutageLoader)
+    gen (UnscheduledOutageGenerator)
+    sla_handler (SLAHandler)
+    scheduled_index (ScheduledOutageIndex): the index of `loader` and `gen`
+    bulk, horizon: see poll
+"""
+def poll_once(loader, gen, sla_handler, scheduled_index, bulk=False,
+              horizon=None):
+    with metrics.timer('stage_seconds', stage='poll'):
+        scheduled_index.load(since=None if horizon is None
+                             else loader.last_processed_log_time - horizon)
+        with metrics.timer('stage_seconds', stage='load_emails'):
+            loader.load_new_scheduled_outages()
+        for detected_outages in loader.iter_new_detected_outages():
+            if bulk:
+                unscheduled_outages = gen.add_if_needed_bulk(detected_outages)
+            else:
+                unscheduled_outages = gen.add_if_needed(detected_outages)
+            with metrics.timer('stage_seconds', stage='dispatch'):
+                sla_handler.handle_unscheduled_outages(unscheduled_outages)
+    loader.record_backlog_lag()
+    SLAHandler.store_dead_letters()
+
+
 """Polls for new outages and checks SLAs.
 
 Uses OutageLoader, UnscheduledOutageGenerator and SLAHandler to load
@@ -14,26 +49,52 @@ scheduled and detected outages, find unscheduled outages, and report
 those to the SLAHandler. The SLAHandler can then determine if an SLA
 has been violated.
 
+Detected outages are streamed through in batches of `batch_size`: each
+batch is stored, classified and reported before the next one is read from
+the logs, so memory use does not depend on the size of the log backlog.
+
 Args:
     poll_interval (int): seconds between polls. 0 == No poll
+    bulk (bool): classify each batch of detected outages in a single set
+                 based pass instead of one outage at a time
+    split_partial (bool): only the parts of a detected outage outside of
+                          scheduled outages are unscheduled
+    batch_size (int): detected outages stored per transaction and handled
+                      at a time
+    parse_workers (int): parse emails with this many processes
+    horizon (timedelta): only consider scheduled outages beginning at most
+                         this long before a detected outage, see
+                         UnscheduledOutageGenerator
+    flap_gap (timedelta): merge detected outages of a device/circuit less
+                          than this apart, see FlapCoalescer
+    dedup (bool): drop re-delivered emails and log outages, see
+                  IdempotencyFilter
+    core (bool): store outages with Core INSERTs and pass them on as
+                 light records, building ORM objects only for plugins
 """
-def poll(poll_interval):
-    loader = OutageLoader()
-    gen = UnscheduledOutageGenerator()
+def poll(poll_interval, bulk=False, split_partial=False, batch_size=1000,
+         parse_workers=None, horizon=None, flap_gap=None, dedup=False,
+         core=False):
+    scheduled_index = ScheduledOutageIndex()
+    loader = OutageLoader(scheduled_index=scheduled_index,
+        batch_size=batch_size, parse_workers=parse_workers, flap_gap=flap_gap,
+        dedup=dedup, core=core)
+    gen = UnscheduledOutageGenerator(scheduled_index=scheduled_index,
+        split_partial=split_partial, horizon=horizon, core=core)
     sla_handler = SLAHandler()
+    SLAHandler.load_downtime()
 
-    while True:
-        loader.load_new_scheduled_outages()
-        detected_outages = loader.load_new_detected_outages()
-        if detected_outages:
-            unscheduled_outages = gen.add_if_needed(detected_outages)
-            for outage in unscheduled_outages:
-                sla_handler.handle_unscheduled_outage(outage)
+    try:
+        while True:
+            poll_once(loader, gen, sla_handler, scheduled_index, bulk=bulk,
+                      horizon=horizon)
 
-        if poll_interval > 0:
-            time.sleep(poll_interval)
-        else:
-            break
+            if poll_interval > 0:
+                time.sleep(poll_interval)
+            else:
+                break
+    finally:
+        loader.close()
 
 
 if __name__ == '__main__':
@@ -41,7 +102,113 @@ if __name__ == '__main__':
 
     parser.add_argument('-p', '--poll-interval', type=int, default=299,
                         help='Poll interval in seconds')
+    parser.add_argument('--bulk', action='store_true',
+                        help='Classify detected outages in one SQL pass')
+    parser.add_argument('--split-partial', action='store_true',
+                        help='Only count the unscheduled parts of partly '
+                             'scheduled outages')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='Detected outages stored per transaction')
+    parser.add_argument('--parse-workers', type=int,
+                        help='Parse emails with this many processes')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='Poll emails and logs concurrently with asyncio')
+    parser.add_argument('--email-interval', type=float,
+                        help='Email poll interval in seconds with --async, '
+                             'defaults to --poll-interval')
+    parser.add_argument('--log-interval', type=float,
+                        help='Log poll interval in seconds with --async, '
+                             'defaults to --poll-interval')
+    parser.add_argument('--socket',
+                        help='Handle log records pushed to this UNIX socket '
+                             'right away, polling only as a fallback')
+    parser.add_argument('--spool-dir',
+                        help='Handle log record files dropped in this '
+                             'directory right away')
+    parser.add_argument('--maildir',
+                        help='Handle emails delivered to this maildir '
+                             'right away')
+    parser.add_argument('--watch-interval', type=float, default=0.2,
+                        help='Seconds between checks of --spool-dir and '
+                             '--maildir')
+    parser.add_argument('--flap-gap', type=float,
+                        help='Merge outages of a circuit less than this many '
+                             'seconds apart')
+    parser.add_argument('--core', action='store_true',
+                        help='Store outages with Core INSERTs instead of '
+                             'ORM objects')
+    parser.add_argument('--dedup', action='store_true',
+                        help='Drop emails and log outages that were already '
+                             'stored')
+    parser.add_argument('--horizon-days', type=float,
+                        help='Ignore scheduled outages beginning more than '
+                             'this many days before a detected outage')
+    parser.add_argument('--alert-workers', type=int,
+                        help='Call the SLA handlers from this many '
+                             'background threads')
+    parser.add_argument('--alert-window', type=float, default=60,
+                        help='Seconds to coalesce the alerts of a circuit '
+                             'with --alert-workers')
+    parser.add_argument('--workers', type=int,
+                        help='Poll in this many processes, sharded by '
+                             'provider (needs a database shared by them)')
+    parser.add_argument('--shards', type=int,
+                        help='Shards of the work with --workers, defaults to '
+                             '--workers')
+    parser.add_argument('--lease-ttl', type=float, default=60,
+                        help='Seconds before the shards of a stalled worker '
+                             'are taken over with --workers')
+    parser.add_argument('--metrics-port', type=int,
+                        help='Serve metrics on http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--metrics-log-interval', type=float,
+                        help='Log the metrics every this many seconds')
 
     args = parser.parse_args()
+    horizon = None if args.horizon_days is None \
+        else timedelta(days=args.horizon_days)
+    flap_gap = None if args.flap_gap is None \
+        else timedelta(seconds=args.flap_gap)
+
+    if args.metrics_port is not None or args.metrics_log_interval:
+        metrics.enable(engine)
+        if args.metrics_port is not None:
+            metrics.serve(args.metrics_port)
+        if args.metrics_log_interval:
+            logging.basicConfig(level=logging.INFO)
+            metrics.log_periodically(args.metrics_log_interval)
 
-    poll(args.poll_interval)
+    if args.alert_workers:
+        SLAHandler.start_dispatcher(workers=args.alert_workers,
+                                    window=args.alert_window)
+
+    try:
+        if args.socket or args.spool_dir or args.maildir:
+            event_poll(args.poll_interval, socket_path=args.socket,
+                       spool_dir=args.spool_dir, maildir=args.maildir,
+                       watch_interval=args.watch_interval, bulk=args.bulk,
+                       split_partial=args.split_partial,
+                       batch_size=args.batch_size, horizon=horizon,
+                       flap_gap=flap_gap, dedup=args.dedup, core=args.core)
+        elif args.workers:
+            # Imported here, sharding imports poll_once from this module
+            from sharding import sharded_poll
+            sharded_poll(args.workers, args.poll_interval, shards=args.shards,
+                         lease_ttl=args.lease_ttl, bulk=args.bulk,
+                         split_partial=args.split_partial,
+                         batch_size=args.batch_size, horizon=horizon,
+                         flap_gap=flap_gap, dedup=args.dedup, core=args.core)
+        elif args.use_async:
+            apoll(args.poll_interval if args.email_interval is None
+                      else args.email_interval,
+                  args.poll_interval if args.log_interval is None
+                      else args.log_interval,
+                  bulk=args.bulk, split_partial=args.split_partial,
+                  batch_size=args.batch_size, horizon=horizon,
+                  flap_gap=flap_gap, dedup=args.dedup, core=args.core)
+        else:
+            poll(args.poll_interval, bulk=args.bulk,
+                 split_partial=args.split_partial, batch_size=args.batch_size,
+                 parse_workers=args.parse_workers, horizon=horizon,
+                 flap_gap=flap_gap, dedup=args.dedup, core=args.core)
+    finally:
+        SLAHandler.stop_dispatcher()
@@ -0,0 +1,232 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import bisect
+import json
+import logging
+import threading
+import time
+
+
+"""Timing histogram.
+
+Attributes:
+    buckets (tuple[float]): upper bounds in seconds
+    counts (list[int]): observations per bucket, the last one is +Inf
+    sum (float): sum of all observations
+    count (int): number of observations
+"""
+class Histogram:
+    default_buckets = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10,
+                       60)
+
+    def __init__(self, buckets=default_buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Timer:
+    def __init__(self, metrics, name, labels):
+        self._metrics = metrics
+        self._name = name
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._metrics.observe(self._name, time.perf_counter() - self._start,
+                              **self._labels)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_null_timer = _NullTimer()
+
+
+"""Counters, gauges and timing histograms.
+
+Metrics are identified by a name and optional labels, e.g.
+`metrics.inc('records', stage='parse')`. While disabled (the default)
+every method returns right away, so instrumentation can stay in the hot
+paths.
+"""
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    """Start collecting metrics.
+
+    Args:
+        engine (Engine): if given, count the database round-trips (SQL
+                         statements executed) and commits
+    """
+    def enable(self, engine=None):
+        if engine is not None:
+            event.listen(engine, 'before_cursor_execute',
+                         self._on_cursor_execute)
+            event.listen(Session, 'after_commit', self._on_commit)
+        self.enabled = True
+
+    def _on_cursor_execute(self, conn, cursor, statement, parameters,
+                           context, executemany):
+        self.inc('db_round_trips')
+
+    def _on_commit(self, session):
+        self.inc('db_commits')
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    """Context manager timing its body into histogram `name`."""
+    def timer(self, name, **labels):
+        if not self.enabled:
+            return _null_timer
+        return _Timer(self, name, labels)
+
+    """Current values.
+
+    Returns:
+        dict: {'counters': ..., 'gauges': ..., 'histograms': ...}, each
+            keyed by `name` or `name{label="value",...}`
+    """
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': {_format_key(k): v
+                             for (k, v) in self._counters.items()},
+                'gauges': {_format_key(k): v
+                           for (k, v) in self._gauges.items()},
+                'histograms': {_format_key(k): {
+                        'count': h.count, 'sum': h.sum,
+                        'buckets': dict(zip(
+                            [str(b) for b in h.buckets] + ['+Inf'],
+                            h.counts))}
+                    for (k, h) in self._histograms.items()},
+            }
+
+    """Current values in the Prometheus text format."""
+    def prometheus(self):
+        lines = []
+        with self._lock:
+            for ((name, labels), value) in sorted(self._counters.items()):
+                lines.append(f'{_format_key((name, labels))} {value}')
+            for ((name, labels), value) in sorted(self._gauges.items()):
+                lines.append(f'{_format_key((name, labels))} {value}')
+            for ((name, labels), h) in sorted(self._histograms.items()):
+                cumulative = 0
+                for (bound, count) in zip(
+                        [str(b) for b in h.buckets] + ['+Inf'], h.counts):
+                    cumulative += count
+                    key = (name + '_bucket', labels + (('le', bound),))
+                    lines.append(f'{_format_key(key)} {cumulative}')
+                lines.append(f'{_format_key((name + "_sum", labels))} {h.sum}')
+                lines.append(
+                    f'{_format_key((name + "_count", labels))} {h.count}')
+        return '\n'.join(lines) + '\n'
+
+    """Serve the metrics over HTTP from a daemon thread.
+
+    `/metrics` returns the Prometheus text format, `/metrics.json` the
+    snapshot as JSON.
+
+    Args:
+        port (int)
+        host (str)
+
+    Returns:
+        ThreadingHTTPServer
+    """
+    def serve(self, port, host='127.0.0.1'):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    (body, content_type) = (metrics.prometheus(),
+                                            'text/plain; version=0.0.4')
+                elif self.path == '/metrics.json':
+                    (body, content_type) = (json.dumps(metrics.snapshot()),
+                                            'application/json')
+                else:
+                    self.send_error(404)
+                    return
+                body = body.encode()
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    """Log the snapshot as one JSON line every `interval` seconds.
+
+    Args:
+        interval (float)
+        logger (logging.Logger): defaults to the `metrics` logger
+    """
+    def log_periodically(self, interval, logger=None):
+        logger = logger or logging.getLogger('metrics')
+
+        def run():
+            while True:
+                time.sleep(interval)
+                logger.info(json.dumps(self.snapshot(), sort_keys=True))
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+def _format_key(key):
+    (name, labels) = key
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{k}="{v}"' for (k, v) in labels) + '}'
+
+
+metrics = Metrics()
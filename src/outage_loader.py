@@ -2,14 +2,23 @@ from db import db_session
 from db.device_or_circuit import DeviceOrCircuit, Type as DoCType
 from db.last_processed import LastProcessed
 from db.outage import DetectedOutage, ScheduledOutage
+from db.records import insert_records
 
-from email_parser import EmailParser
+from device_or_circuit_cache import DeviceOrCircuitCache
+from email_parser import EmailParseError, EmailParser
+from flap_coalescer import FlapCoalescer
+from idempotency import IdempotencyFilter, email_key, outage_key
+from metrics import metrics
 
 import helpdesk
 import log_loader
 
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
+from sqlalchemy import func, or_
+
+import itertools
 import json
 
 
@@ -26,24 +35,103 @@ Design choices:
 class OutageLoader:
     epoch = datetime(1970, 1, 1)
 
-    def __init__(self):
+    """Constructor.
+
+    Args:
+        scheduled_index (ScheduledOutageIndex): optional index to keep up
+            to date as scheduled outages are added or cancelled.
+        device_cache (DeviceOrCircuitCache): device/circuit id cache, a
+            new one is created and warmed up if not given.
+        batch_size (int): detected outages stored per transaction, also
+            emails parsed at a time with `parse_workers`
+        parse_workers (int): if set, emails are parsed by a pool of this
+            many processes (see EmailParser.parse_many)
+        flap_gap (timedelta): if set, detected outages of a device/circuit
+            less than this apart are merged (see FlapCoalescer)
+        dedup (bool): drop emails and log outages that were already
+            stored, e.g. re-delivered after a retry (see IdempotencyFilter)
+        core (bool): store detected outages with a Core INSERT and return
+            them as DetectedRecords instead of DetectedOutages, see
+            db.records.insert_records
+        shard (sharding.Shard): only load the emails and log outages of
+            this shard, with its own LastProcessed times. They are read
+            with helpdesk.load_shard_new_emails and
+            log_loader.load_shard_outages_from_logs.
+        lease (func()): with `shard`, called in each transaction that
+            stores emails or log outages, right before it is committed.
+            If it returns False, the transaction is rolled back and
+            LeaseLostError raised.
+        clock (func()): returns the current (UTC) time, see
+            FlapCoalescer.flush
+    """
+    def __init__(self, scheduled_index=None, device_cache=None,
+                 batch_size=1000, parse_workers=None, flap_gap=None,
+                 dedup=False, core=False, shard=None, lease=None,
+                 clock=datetime.utcnow):
+        self._scheduled_index = scheduled_index
+        self._batch_size = batch_size
+        self._parse_workers = parse_workers
+        self._parse_executor = None
+        self._core = core
+        self._shard = shard
+        self._lease = lease
+        self._clock = clock
+
+        self._flaps = None
+        if flap_gap is not None:
+            self._flaps = FlapCoalescer(flap_gap,
+                owns=None if shard is None else shard.owns)
+            self._flaps.load()
+
+        self._email_keys = self._log_keys = None
+        if dedup:
+            self._email_keys = IdempotencyFilter('email')
+            self._email_keys.load()
+            self._log_keys = IdempotencyFilter('log')
+            self._log_keys.load()
+
+        if device_cache is None:
+            device_cache = DeviceOrCircuitCache()
+            device_cache.warm()
+        self._device_cache = device_cache
+
         # Initialize objects to track the last time we polled email/logs
-        self._last_processed_email = self.get_last_processed('email')
-        self._last_processed_log = self.get_last_processed('log')
+        self._last_processed_email = self._get_or_create_last_processed(
+            'email')
+        self._last_processed_log = self._get_or_create_last_processed('log')
+        self._last_processed_push = None # see store_log_records
 
-        if self._last_processed_email is None:
-            self._last_processed_email = LastProcessed(name='email', time=self.epoch)
-            db_session.add(self._last_processed_email)
-            db_session.commit()
-        if self._last_processed_log is None:
-            self._last_processed_log = LastProcessed(name='log', time=self.epoch)
-            db_session.add(self._last_processed_log)
+    def _get_or_create_last_processed(self, kind):
+        if self._shard is None:
+            name = kind
+        else:
+            name = f'{kind}:{self._shard.name}'
+        last_processed = self.get_last_processed(name)
+        if last_processed is None:
+            # A new shard starts from the earliest time of the previous
+            # layouts (no shards or another number of shards), so changing
+            # the number of shards re-delivers rather than skips
+            time = db_session.query(func.min(LastProcessed.time)).filter(
+                or_(LastProcessed.name == kind,
+                    LastProcessed.name.like(f'{kind}:%'))).filter(
+                LastProcessed.name.notlike(
+                    f'{kind}:%/{self._shard.count}')).scalar() \
+                if self._shard is not None else None
+            last_processed = LastProcessed(name=name, time=time or self.epoch)
+            db_session.add(last_processed)
             db_session.commit()
+        return last_processed
+
+    def _commit(self):
+        if self._lease is not None and not self._lease():
+            db_session.rollback()
+            raise LeaseLostError(f'Lost the lease of shard {self._shard.name}')
+        db_session.commit()
 
     """Get the LastProcessed object for the given name.
     
     Args:
-        name (str): `email` or `log`
+        name (str): `email` or `log`, or `email:<shard>` or `log:<shard>`
 
     Returns:
         LastProcessed: Has a `time` member
@@ -52,6 +140,18 @@ class OutageLoader:
         return db_session.query(
             LastProcessed).filter_by(name=name).one_or_none()
 
+    """Release what the loader holds, call when discarding it.
+
+    Shuts down the email parsing processes of `parse_workers`.
+    """
+    def close(self):
+        for keys in (self._email_keys, self._log_keys):
+            if keys is not None:
+                keys.close()
+        if self._parse_executor is not None:
+            self._parse_executor.shutdown()
+            self._parse_executor = None
+
     """Load new scheduled outages.
 
     Use helpdesk api to fetch new emails then parse emails to find outages.
@@ -61,39 +161,360 @@ class OutageLoader:
         bool: True if new outages loaded, False for no new outages
     """
     def load_new_scheduled_outages(self):
-        for (time, fromaddr, content) in \
-                helpdesk.load_new_emails(self._last_processed_email.time):
-            notification = EmailParser.parse(fromaddr, content)
-            if notification.cancel_id:
-                # Need to cancel an old scheduled outage
-                db_session.query(ScheduledOutage).filter_by(
-                    provider=notification.provider,
-                    outage_id=notification.cancel_id).delete()
-            if notification.update_id:
-                # Need to create a scheduled outage
-                self.create_scheduled_outage(notification)
-            self._last_processed_email.time = time
-            db_session.commit()
+        if self._shard is None:
+            emails = helpdesk.load_new_emails(self._last_processed_email.time)
         else:
+            emails = helpdesk.load_shard_new_emails(
+                self._last_processed_email.time, self._shard)
+        emails = self._owned_emails(emails)
+        if self._parse_workers:
+            loaded = self._load_new_scheduled_outages_parallel(emails)
+        else:
+            loaded = self._load_new_scheduled_outages(emails)
+        self._skip_unowned(self._last_processed_email)
+        return loaded
+
+    def _load_new_scheduled_outages(self, emails):
+        loaded = False
+        for (time, fromaddr, content) in emails:
+            if self.duplicate_email(fromaddr, content):
+                continue
+            with metrics.timer('stage_seconds', stage='parse'):
+                try:
+                    notification = EmailParser.parse(fromaddr, content)
+                except EmailParseError:
+                    metrics.inc('parse_failures')
+                    raise
+            metrics.inc('records', stage='parse')
+            self.store_notification(time, notification, (fromaddr, content))
+            loaded = True
+        return loaded
+
+    def _load_new_scheduled_outages_parallel(self, emails):
+        if self._parse_executor is None:
+            self._parse_executor = ProcessPoolExecutor(self._parse_workers)
+
+        loaded = False
+        while True:
+            batch = list(itertools.islice(
+                ((time, fromaddr, content)
+                 for (time, fromaddr, content) in emails
+                 if not self.duplicate_email(fromaddr, content)),
+                self._batch_size))
+            if not batch:
+                return loaded
+            with metrics.timer('stage_seconds', stage='parse'):
+                notifications = EmailParser.parse_many(
+                    ((fromaddr, content) for (time, fromaddr, content) in batch),
+                    executor=self._parse_executor)
+            metrics.inc('records', len(batch), stage='parse')
+            for ((time, fromaddr, content), notification) in zip(
+                    batch, notifications):
+                if isinstance(notification, Exception):
+                    metrics.inc('parse_failures')
+                    raise notification
+                self.store_notification(time, notification,
+                                        (fromaddr, content))
+                loaded = True
+
+    def _owned_emails(self, emails):
+        self._last_seen = None
+        for (time, fromaddr, content) in emails:
+            self._last_seen = time
+            if self._shard is None or \
+                    self._shard.owns(EmailParser.provider_of(fromaddr)):
+                yield (time, fromaddr, content)
+
+    def _owned_outages(self, records):
+        self._last_seen = None
+        for (time, outage) in records:
+            self._last_seen = time
+            if self._shard is None or self._shard.owns(outage.provider):
+                yield (time, outage)
+
+    # Once everything read is stored, move a shard's LastProcessed time past
+    # the records of other shards read after its last record
+    def _skip_unowned(self, last_processed):
+        if self._shard is None or self._last_seen is None or \
+                self._last_seen <= last_processed.time:
+            return
+        last_processed.time = self._last_seen
+        self._commit()
+
+    """Check whether an email was already stored.
+
+    Call before parsing the email. Always False unless `dedup` is set.
+
+    Args:
+        fromaddr (str)
+        content (str)
+
+    Returns:
+        bool
+    """
+    def duplicate_email(self, fromaddr, content):
+        if self._email_keys is None or \
+                not self._email_keys.seen(email_key(fromaddr, content)):
+            return False
+        metrics.inc('duplicates', kind='email')
+        return True
+
+    """Apply a parsed maintenance notification to the database.
+
+    Cancels and/or creates the scheduled outage and advances the email
+    LastProcessed time in a single transaction. With `dedup`, the email is
+    recorded in the same transaction, or the notification is dropped if
+    the email was already stored.
+
+    Args:
+        time (datetime): as yielded by helpdesk.load_new_emails
+        notification (email_parser.MaintenanceNotification)
+        email ((str, str)): fromaddr and content of the email parsed
+
+    Returns:
+        bool: False if the email was already stored
+
+    Raises:
+        OutageLoaderError: Cannot find device/circuit, nothing is stored
+    """
+    def store_notification(self, time, notification, email=None):
+        if self._email_keys is not None and email is not None and \
+                not self._email_keys.check_and_add(email_key(*email)):
+            metrics.inc('duplicates', kind='email')
             return False
+        with metrics.timer('stage_seconds', stage='store_scheduled'):
+            try:
+                self._store_notification(time, notification)
+            except OutageLoaderError:
+                db_session.rollback()
+                raise
+        metrics.inc('records', stage='store_scheduled')
         return True
 
+    def _store_notification(self, time, notification):
+        if notification.cancel_id:
+            # Need to cancel an old scheduled outage
+            db_session.query(ScheduledOutage).filter_by(
+                provider=notification.provider,
+                outage_id=notification.cancel_id).delete()
+            if self._scheduled_index is not None:
+                self._scheduled_index.remove(notification.provider,
+                    notification.cancel_id)
+        if notification.update_id:
+            # Need to create a scheduled outage
+            self.create_scheduled_outage(notification)
+        self._last_processed_email.time = max(
+            self._last_processed_email.time, time)
+        self._commit()
+
+    """Time of the last email loaded."""
+    @property
+    def last_processed_email_time(self):
+        return self._last_processed_email.time
+
+    """Time of the last log record loaded."""
+    @property
+    def last_processed_log_time(self):
+        return self._last_processed_log.time
+
+    """Set the `backlog_lag_seconds` gauges to now - LastProcessed.time."""
+    def record_backlog_lag(self):
+        if not metrics.enabled:
+            return
+        now = datetime.utcnow()
+        metrics.set('backlog_lag_seconds',
+            (now - self.last_processed_email_time).total_seconds(),
+            source='email')
+        metrics.set('backlog_lag_seconds',
+            (now - self.last_processed_log_time).total_seconds(),
+            source='log')
+
     """Load new detected outages.
 
     Use log data api to fetch new logs then parse logs to find outages.
-    Call self.create_detected_outage(...) with outage data loaded.
+    The outages are stored in batches of `batch_size`, see
+    store_detected_outages(...).
 
     Returns:
         list[DetectedOutage]: New detected outages loaded
     """
     def load_new_detected_outages(self):
         result = []
-        for (time, outage) in log_loader.load_outages_from_logs(
-                self._last_processed_log.time):
-            result.append(self.create_detected_outage(outage.provider, 
-                outage.service_id, outage.begin, outage.end, outage.data))
-            self._last_processed_log_time = time
-            db_session.commit()
+        for batch in self.iter_new_detected_outages():
+            result.extend(batch)
+        return result
+
+    """Load new detected outages, one batch at a time.
+
+    Same as load_new_detected_outages(), but each batch is yielded as
+    soon as it is stored, so only `batch_size` outages are held in memory
+    no matter how many new log records there are.
+
+    Yields:
+        list[DetectedOutage]: New detected outages, at most `batch_size`
+    """
+    def iter_new_detected_outages(self):
+        if self._shard is None:
+            records = log_loader.load_outages_from_logs(
+                self._last_processed_log.time)
+        else:
+            records = log_loader.load_shard_outages_from_logs(
+                self._last_processed_log.time, self._shard)
+        batch = []
+        for (time, outage) in self.coalesce_flaps(self.drop_duplicates(
+                self._owned_outages(records))):
+            batch.append((time, outage))
+            if len(batch) >= self._batch_size:
+                yield self.store_detected_outages(batch)
+                batch = []
+        if batch:
+            yield self.store_detected_outages(batch)
+        else:
+            # Outages held back and the log time (see coalesce_flaps)
+            self.save_log_position()
+        self._skip_unowned(self._last_processed_log)
+
+    """Commit the position of the log source, see log_loader.save_position.
+
+    Call once all of the records read from log_loader are stored.
+    """
+    def save_log_position(self):
+        log_loader.save_position()
+        self._commit()
+
+    """Drop log outages that were already stored, if `dedup` is set.
+
+    The outages let through are recorded, and stored with the next
+    store_detected_outages(...) or commit.
+
+    Args:
+        records (iterable[(datetime, log_loader.Outage)])
+
+    Yields:
+        (datetime, log_loader.Outage)
+    """
+    def drop_duplicates(self, records):
+        if self._log_keys is None:
+            yield from records
+            return
+
+        for (time, outage) in records:
+            if self._log_keys.check_and_add(outage_key(outage)):
+                yield (time, outage)
+            else:
+                metrics.inc('duplicates', kind='log')
+
+    """Merge the outages of flapping devices/circuits, if enabled.
+
+    Once `records` ends, the log is read up to now: the outages that
+    ended more than the gap ago are passed on (see FlapCoalescer.flush).
+    Outages still held back are written to the FlapState table, and the
+    LastProcessed time is advanced past them, by the next
+    store_detected_outages(...) or commit.
+
+    Args:
+        records (iterable[(datetime, log_loader.Outage)])
+        last_processed (LastProcessed): time to advance, default log
+
+    Yields:
+        (datetime, log_loader.Outage)
+    """
+    def coalesce_flaps(self, records, last_processed=None):
+        if self._flaps is None:
+            yield from records
+            return
+
+        if last_processed is None:
+            last_processed = self._last_processed_log
+        time = None
+        for (time, outage) in records:
+            yield from self._flaps.add(time, outage)
+        yield from self._flaps.flush(self._clock())
+        if time is not None:
+            last_processed.time = max(last_processed.time, time)
+        self._flaps.sync()
+
+    """Store log records, merging flapping outages if enabled.
+
+    Like iter_new_detected_outages for records that are already read, in
+    a single transaction. Duplicates are dropped if `dedup` is set.
+
+    Records pushed by the log source (see event_poll) advance their own
+    `push` LastProcessed time: they may arrive ahead of records the log
+    poll has not read yet, which must not be skipped.
+
+    Args:
+        records (list[(datetime, log_loader.Outage)])
+        pushed (bool): records were pushed rather than polled
+
+    Returns:
+        list[DetectedOutage]: may be fewer than `records`, or none, while
+            flapping outages are held back
+    """
+    def store_log_records(self, records, pushed=False):
+        last_processed = None
+        if pushed:
+            if self._last_processed_push is None:
+                self._last_processed_push = \
+                    self._get_or_create_last_processed('push')
+            last_processed = self._last_processed_push
+        records = list(self.coalesce_flaps(self.drop_duplicates(
+            self._owned_outages(records)), last_processed))
+        if records:
+            return self.store_detected_outages(records, last_processed)
+        if pushed:
+            self._commit()
+        else:
+            self.save_log_position()
+        return []
+
+    """Store a batch of detected outages in a single transaction.
+
+    The device/circuit ids of the whole batch are resolved at once and the
+    log LastProcessed time, and the position of the log source (see
+    log_loader.save_position), are advanced in the same transaction, so
+    after a crash loading resumes right after the last stored batch.
+
+    Args:
+        batch (list[(datetime, log_loader.Outage)]): as yielded by
+            log_loader.load_outages_from_logs
+        last_processed (LastProcessed): time to advance, default log
+
+    Returns:
+        list[DetectedOutage], or list[DetectedRecord] with `core`
+
+    Raises:
+        OutageLoaderError: Cannot find device/circuit, nothing is stored
+        LeaseLostError: see `lease`, nothing is stored
+    """
+    def store_detected_outages(self, batch, last_processed=None):
+        if last_processed is None:
+            last_processed = self._last_processed_log
+        with metrics.timer('stage_seconds', stage='store_detected'):
+            self.get_device_or_circuit_ids({(outage.provider, outage.service_id)
+                                            for (time, outage) in batch})
+            try:
+                if self._core:
+                    result = insert_records(db_session, DetectedOutage,
+                        [self._detected_outage_row(outage)
+                         for (time, outage) in batch])
+                else:
+                    result = [self.create_detected_outage(outage.provider,
+                            outage.service_id, outage.begin, outage.end,
+                            outage.data)
+                        for (time, outage) in batch]
+            except OutageLoaderError:
+                db_session.rollback()
+                if self._flaps is not None:
+                    self._flaps.load()
+                raise
+            last_processed.time = max(last_processed.time, batch[-1][0])
+            if last_processed is self._last_processed_log:
+                log_loader.save_position()
+            if self._flaps is not None:
+                self._flaps.sync()
+            self._commit()
+        metrics.inc('records', len(batch), stage='store_detected')
         return result
 
     """Lookup device/circuit id.
@@ -106,9 +527,29 @@ class OutageLoader:
         int: device/circuit id or None if not found
     """
     def get_device_or_circuit_id(self, provider, service_id):
-        row = db_session.query(DeviceOrCircuit.id).filter_by(
-            provider=provider, service_id=service_id).one_or_none()
-        return row.id if row else None
+        return self._device_cache.get(provider, service_id)
+
+    """Lookup many device/circuit ids at once.
+
+    Args:
+        keys (iterable[(str, str)]): (provider, service_id)
+
+    Returns:
+        dict[(str, str), int]: device/circuit id for each key, None if
+            not found
+    """
+    def get_device_or_circuit_ids(self, keys):
+        with metrics.timer('stage_seconds', stage='resolve'):
+            result = self._device_cache.get_many(keys)
+        metrics.inc('records', len(result), stage='resolve')
+        return result
+
+    """Reload the device/circuit id cache.
+
+    Call after changing the devices_or_circuits table.
+    """
+    def refresh_device_or_circuit_ids(self):
+        self._device_cache.refresh()
 
     """Create detected outage object and add it to the database.
 
@@ -131,10 +572,20 @@ class OutageLoader:
             raise OutageLoaderError(
                 f'Failed to find device/circuit for {provider}:{service_id}')
         outage = DetectedOutage(dev_or_circ_id=dev_or_circ_id,
-            begin_time=begin, end_time=end, data=json.dumps(data))
+            provider=provider, service_id=service_id, begin_time=begin, end_time=end, data=json.dumps(data))
         db_session.add(outage)
         return outage
         
+    def _detected_outage_row(self, outage):
+        dev_or_circ_id = self.get_device_or_circuit_id(outage.provider,
+                                                       outage.service_id)
+        if not dev_or_circ_id:
+            raise OutageLoaderError('Failed to find device/circuit for '
+                                    f'{outage.provider}:{outage.service_id}')
+        return {'dev_or_circ_id': dev_or_circ_id, 'provider': outage.provider,
+                'service_id': outage.service_id, 'begin_time': outage.begin,
+                'end_time': outage.end, 'data': json.dumps(outage.data)}
+
     """Create scheduled outage object and add it to the database.
 
     Args:
@@ -164,8 +615,15 @@ class OutageLoader:
                 'Phone' : notification.phone,
             }))
         db_session.add(outage)
+        if self._scheduled_index is not None:
+            self._scheduled_index.add(outage)
         return outage
         
 
 class OutageLoaderError(RuntimeError):
     pass
+
+
+# Another worker took over the shard, see OutageLoader(lease=...)
+class LeaseLostError(OutageLoaderError):
+    pass
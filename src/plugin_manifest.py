@@ -0,0 +1,119 @@
+import importlib
+import json
+import os
+import pkgutil
+import sys
+import threading
+
+
+"""Lazy loader for a package of plugins.
+
+The package's `manifest.json` maps each key a plugin registers (email
+address for email_parsers, provider for sla_handlers) to the module
+that registers it. Nothing is imported up front: load(key) imports the
+module of `key` the first time it is needed, so startup does not grow
+with the number of plugins.
+
+Modules that are not in the manifest are all imported the first time a
+key cannot be found in it, so a new plugin works before the manifest is
+rebuilt (see build(), or run this module).
+"""
+class PluginManifest:
+    """Constructor.
+
+    Args:
+        package (str): name of the package of plugin modules
+        path (str): directory of the package
+    """
+    def __init__(self, package, path):
+        self._package = package
+        self._path = path
+        self._lock = threading.Lock()
+        self._unlisted_loaded = False
+        try:
+            with open(os.path.join(path, 'manifest.json')) as f:
+                self._modules = json.load(f)
+        except FileNotFoundError:
+            self._modules = {}
+
+    def __contains__(self, key):
+        return key in self._modules
+
+    """Import the plugin registering `key`.
+
+    Args:
+        key (str)
+
+    Returns:
+        bool: False if no module was imported, i.e. the key is unknown or
+              its module was already imported
+    """
+    def load(self, key):
+        with self._lock:
+            module = self._modules.get(key)
+            if module is not None:
+                name = f'{self._package}.{module}'
+                if name in sys.modules:
+                    return False
+                importlib.import_module(name)
+                return True
+            if self._unlisted_loaded:
+                return False
+            self._unlisted_loaded = True
+            listed = set(self._modules.values())
+            for (finder, module, ispkg) in pkgutil.iter_modules([self._path]):
+                if module not in listed:
+                    importlib.import_module(f'{self._package}.{module}')
+            return True
+
+    """Import every plugin, e.g. to validate them all."""
+    def load_all(self):
+        for (finder, module, ispkg) in pkgutil.iter_modules([self._path]):
+            importlib.import_module(f'{self._package}.{module}')
+
+    """Rebuild manifest.json by importing each plugin in turn.
+
+    Args:
+        registry (dict): what the plugins register into, e.g.
+                         EmailParser._per_provider_parsers
+
+    Returns:
+        dict[str, str]: key to module
+    """
+    def build(self, registry):
+        modules = {}
+        registered = {}
+        saved = dict(registry)
+        try:
+            for (finder, module, ispkg) in sorted(
+                    pkgutil.iter_modules([self._path]), key=lambda m: m[1]):
+                registry.clear()
+                name = f'{self._package}.{module}'
+                if name in sys.modules:
+                    importlib.reload(sys.modules[name])
+                else:
+                    importlib.import_module(name)
+                for key in registry:
+                    modules[key] = module
+                registered.update(registry)
+        finally:
+            registry.clear()
+            registry.update(registered)
+            registry.update(saved)
+        with open(os.path.join(self._path, 'manifest.json'), 'w') as f:
+            json.dump(modules, f, indent=4, sort_keys=True)
+            f.write('\n')
+        with self._lock:
+            self._modules = modules
+        return modules
+
+
+if __name__ == '__main__':
+    from email_parser import EmailParser
+    from sla_handler import SLAHandler
+
+    import email_parsers
+    import sla_handlers
+
+    print(email_parsers.manifest.build(EmailParser._per_provider_parsers))
+    print(sla_handlers.manifest.build(SLAHandler._per_provider_handlers))
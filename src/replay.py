@@ -0,0 +1,419 @@
+from db import db_session, engine
+from db.last_processed import LastProcessed
+from db.outage import DetectedOutage, UnscheduledOutage
+from db.replay import ReplayChunk, ReplayOutage, ReplayRun
+from sla_handler import SLAError, SLAHandler
+from unscheduled_outage_generator import UnscheduledOutageGenerator
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, or_, select
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+
+class ReplayError(Exception):
+    pass
+
+
+_columns = ('dev_or_circ_id', 'provider', 'service_id', 'begin_time',
+            'end_time', 'data', 'detected_id')
+
+
+"""Re-classify the detected outages of one chunk into ReplayOutages.
+
+Runs in the worker processes of Replay.run (or in the calling process).
+The chunk's previous ReplayOutages, from an interrupted run, are replaced
+in the same transaction that marks it done, so a chunk is either done
+once or not at all.
+
+Args:
+    run_id (int)
+    begin (datetime): first begin time of the chunk's detected outages
+    end (datetime): end of the chunk, exclusive
+    shard (int): dev_or_circ_id % shards of the chunk's detected outages
+    shards (int)
+    split_partial, horizon: see UnscheduledOutageGenerator
+
+Returns:
+    (datetime, int, int, int, float): begin, shard, detected and
+        unscheduled outages, seconds
+"""
+def replay_chunk(run_id, begin, end, shard, shards, split_partial=False,
+                 horizon=None):
+    start = time.perf_counter()
+    condition = and_(DetectedOutage.begin_time >= begin,
+                     DetectedOutage.begin_time < end)
+    if shards > 1:
+        condition = and_(condition,
+                         DetectedOutage.dev_or_circ_id % shards == shard)
+    detected = db_session.query(func.count(DetectedOutage.id)).filter(
+        condition).scalar()
+    gen = UnscheduledOutageGenerator(split_partial=split_partial,
+                                     horizon=horizon)
+    rows = gen.unscheduled_rows(condition, begin)
+
+    db_session.query(ReplayOutage).filter(
+        ReplayOutage.run_id == run_id).filter(
+        ReplayOutage.chunk_begin == begin).filter(
+        ReplayOutage.shard == shard).delete(synchronize_session=False)
+    if rows:
+        db_session.execute(ReplayOutage.__table__.insert(),
+            [dict(row, run_id=run_id, chunk_begin=begin, shard=shard)
+             for row in rows])
+    seconds = time.perf_counter() - start
+    db_session.query(ReplayChunk).filter(
+        ReplayChunk.run_id == run_id).filter(
+        ReplayChunk.begin_time == begin).filter(
+        ReplayChunk.shard == shard).update({
+            'detected_outages': detected, 'unscheduled_outages': len(rows),
+            'seconds': seconds, 'done': datetime.utcnow()},
+        synchronize_session=False)
+    db_session.commit()
+    return (begin, shard, detected, len(rows), seconds)
+
+
+"""Re-classification of the detected outages of a time range.
+
+After a new provider plugin, a parser fix or a change to what counts as
+scheduled, the UnscheduledOutages of past detected outages can be
+recomputed from the stored DetectedOutages and ScheduledOutages:
+
+    1. run(): the range is split into chunks, by time (`chunk`) and by
+       device/circuit (dev_or_circ_id % `shards`), which are classified
+       in a process pool into the replay_outages staging table. Progress
+       is kept per chunk in replay_chunks, so an interrupted run resumes
+       with the chunks still to do.
+    2. swap(): the UnscheduledOutages of detected outages beginning in the
+       range are replaced by the staged ones in a single transaction.
+    3. redrive(): optionally, the replayed outages are passed through
+       SLAHandler in dry-run mode (see SLAHandler.set_dry_run), to see
+       which alerts the plugins would get.
+
+A run is identified by its range and options: a new Replay of the same
+range and options picks up the run that was not swapped yet.
+
+The range must be behind the poller (the `log` LastProcessed times):
+unscheduled outages the poller adds to the range would be replaced.
+Unscheduled outages belong to the range by the begin time of their
+detected outage (`detected_id`), so all parts of a split outage (see
+`split_partial`) are replaced together. Those stored without a
+`detected_id` belong to it by their own begin time.
+"""
+class Replay:
+    """Constructor.
+
+    Args:
+        begin (datetime): first begin time of the detected outages
+        end (datetime): end of the range, exclusive
+        split_partial, horizon: see UnscheduledOutageGenerator
+        chunk (timedelta): time slice of a chunk
+        shards (int): device/circuit shards of a chunk
+        restart (bool): discard an unfinished run of the same range
+
+    Raises:
+        ReplayError: empty range, or the range is not behind the poller
+    """
+    def __init__(self, begin, end, split_partial=False, horizon=None,
+                 chunk=timedelta(days=1), shards=1, restart=False):
+        if begin >= end:
+            raise ReplayError(f'Empty range: {begin} - {end}')
+        polled = db_session.query(func.min(LastProcessed.time)).filter(
+            or_(LastProcessed.name == 'log',
+                LastProcessed.name.like('log:%'))).scalar()
+        if polled is not None and polled < end:
+            raise ReplayError(f'The poller is at {polled}, only replay '
+                              'outages before that')
+        self._begin = begin
+        self._end = end
+        self._split_partial = split_partial
+        self._horizon = horizon
+        self._shards = shards
+        options = json.dumps({'split_partial': split_partial,
+            'horizon': None if horizon is None else horizon.total_seconds(),
+            'chunk': chunk.total_seconds(), 'shards': shards}, sort_keys=True)
+
+        self._run = db_session.query(ReplayRun).filter(
+            ReplayRun.begin_time == begin).filter(
+            ReplayRun.end_time == end).filter(
+            ReplayRun.options == options).filter(
+            ReplayRun.swapped.is_(None)).first()
+        if self._run is not None and restart:
+            self._delete(self._run)
+            self._run = None
+        if self._run is None:
+            self._run = ReplayRun(begin_time=begin, end_time=end,
+                options=options, created=datetime.utcnow())
+            db_session.add(self._run)
+            db_session.flush()
+            chunk_begin = begin
+            while chunk_begin < end:
+                chunk_end = min(end, chunk_begin + chunk)
+                db_session.add_all(ReplayChunk(run_id=self._run.id,
+                        begin_time=chunk_begin, end_time=chunk_end,
+                        shard=shard)
+                    for shard in range(shards))
+                chunk_begin = chunk_end
+            db_session.commit()
+        self.run_id = self._run.id
+
+    @staticmethod
+    def _delete(run):
+        for table in (ReplayOutage, ReplayChunk):
+            db_session.query(table).filter(table.run_id == run.id).delete(
+                synchronize_session=False)
+        db_session.delete(run)
+        db_session.commit()
+
+    """Chunks still to do.
+
+    Returns:
+        list[ReplayChunk]
+    """
+    def pending(self):
+        return db_session.query(ReplayChunk).filter(
+            ReplayChunk.run_id == self.run_id).filter(
+            ReplayChunk.done.is_(None)).order_by(
+            ReplayChunk.begin_time, ReplayChunk.shard).all()
+
+    """Classify the chunks still to do.
+
+    Args:
+        workers (int): processes, 0 == classify in this process. The
+                       database must be shared by the processes (not an
+                       in memory SQLite database).
+        progress (func(dict)): called after each chunk with the totals so
+                               far, see the return value
+
+    Returns:
+        dict: chunks (done/total), detected and unscheduled outages,
+            seconds and detected outages per second of this call
+
+    Raises:
+        ValueError: workers with an in memory SQLite database
+    """
+    def run(self, workers=0, progress=None):
+        if workers and engine.dialect.name == 'sqlite' and \
+                engine.url.database in (None, '', ':memory:'):
+            raise ValueError('Replay workers need a database shared by '
+                             'processes, see SLA_DATABASE_URL')
+        chunks = [(chunk.begin_time, chunk.end_time, chunk.shard)
+                  for chunk in self.pending()]
+        total = db_session.query(ReplayChunk).filter(
+            ReplayChunk.run_id == self.run_id).count()
+        stats = {'chunks': total - len(chunks), 'total_chunks': total,
+                 'detected_outages': 0, 'unscheduled_outages': 0,
+                 'seconds': 0.0, 'detected_per_second': None}
+        db_session.commit()
+        start = time.perf_counter()
+
+        def done(result):
+            (begin, shard, detected, unscheduled, seconds) = result
+            stats['chunks'] += 1
+            stats['detected_outages'] += detected
+            stats['unscheduled_outages'] += unscheduled
+            stats['seconds'] = time.perf_counter() - start
+            stats['detected_per_second'] = \
+                stats['detected_outages'] / stats['seconds']
+            if progress is not None:
+                progress(dict(stats, begin=begin, shard=shard))
+
+        arguments = [(self.run_id, begin, end, shard, self._shards,
+                      self._split_partial, self._horizon)
+                     for (begin, end, shard) in chunks]
+        if not workers:
+            for args in arguments:
+                done(replay_chunk(*args))
+            return stats
+
+        if engine.dialect.name == 'sqlite':
+            # Inherited by the workers, see db.engine.make_engine
+            os.environ.setdefault('SLA_DATABASE_SQLITE_BEGIN_IMMEDIATE', '1')
+        with ProcessPoolExecutor(workers,
+                mp_context=multiprocessing.get_context('spawn')) as executor:
+            for future in as_completed([executor.submit(replay_chunk, *args)
+                                        for args in arguments]):
+                done(future.result())
+        db_session.expire_all()
+        return stats
+
+    # The UnscheduledOutages of the detected outages of the range, the
+    # ones a swap replaces
+    def _in_range(self):
+        detected = select(DetectedOutage.id).where(
+            DetectedOutage.begin_time >= self._begin).where(
+            DetectedOutage.begin_time < self._end)
+        return or_(UnscheduledOutage.detected_id.in_(detected),
+                   and_(UnscheduledOutage.detected_id.is_(None),
+                        UnscheduledOutage.begin_time >= self._begin,
+                        UnscheduledOutage.begin_time < self._end))
+
+    """Counts of the current and replayed unscheduled outages.
+
+    Returns:
+        dict[str, int]
+    """
+    def diff(self):
+        current = db_session.query(func.count(UnscheduledOutage.id)).filter(
+            self._in_range()).scalar()
+        replayed = db_session.query(func.count(ReplayOutage.id)).filter(
+            ReplayOutage.run_id == self.run_id).scalar()
+        return {'current': current, 'replayed': replayed}
+
+    """Replace the unscheduled outages of the range with the replayed ones.
+
+    In a single transaction: readers see either the old or the new
+    outages. Restart pollers afterwards (or SLAHandler.load_downtime())
+    so their rolling downtime totals include the replayed outages.
+
+    Returns:
+        dict[str, int]: unscheduled outages deleted and inserted
+
+    Raises:
+        ReplayError: chunks still to do
+    """
+    def swap(self):
+        pending = len(self.pending())
+        if pending:
+            raise ReplayError(f'{pending} chunks still to do, run() first')
+        deleted = db_session.query(UnscheduledOutage).filter(
+            self._in_range()).delete(synchronize_session=False)
+        replayed = select(*(getattr(ReplayOutage, column)
+                            for column in _columns)).where(
+            ReplayOutage.run_id == self.run_id).order_by(
+            ReplayOutage.begin_time, ReplayOutage.id)
+        inserted = db_session.execute(
+            UnscheduledOutage.__table__.insert().from_select(_columns,
+            replayed)).rowcount
+        db_session.query(ReplayOutage).filter(
+            ReplayOutage.run_id == self.run_id).delete(
+            synchronize_session=False)
+        db_session.query(ReplayRun).filter(
+            ReplayRun.id == self.run_id).update(
+            {'swapped': datetime.utcnow()}, synchronize_session=False)
+        db_session.commit()
+        return {'deleted': deleted, 'inserted': inserted}
+
+    """Pass the replayed outages through SLAHandler in dry-run mode.
+
+    The outages are handled in order of end time, after rebuilding the
+    rolling downtime from the outages ending before the range. The
+    replayed outages are read from the staging table until swap(), from
+    the UnscheduledOutage table afterwards. Plugins are not called.
+
+    Args:
+        recorder (func(outage)): gets each outage a plugin would get, with
+                                 SLAHandler.downtime(outage) up to date
+
+    Returns:
+        dict[str, int]: outages passed to `recorder`, and outages without
+            an SLA handler plugin
+    """
+    def redrive(self, recorder):
+        if self._run.swapped is None:
+            outages = db_session.query(ReplayOutage).filter(
+                ReplayOutage.run_id == self.run_id).order_by(
+                ReplayOutage.end_time, ReplayOutage.id)
+        else:
+            outages = db_session.query(UnscheduledOutage).filter(
+                self._in_range()).order_by(
+                UnscheduledOutage.end_time, UnscheduledOutage.id)
+        result = {'dispatched': 0, 'no_handler': 0}
+        SLAHandler.load_downtime(until=self._begin)
+        SLAHandler.set_dry_run(recorder)
+        try:
+            for outage in outages.yield_per(1000):
+                try:
+                    SLAHandler.handle_unscheduled_outage(outage)
+                    result['dispatched'] += 1
+                except SLAError:
+                    result['no_handler'] += 1
+        finally:
+            SLAHandler.set_dry_run(None)
+        return result
+
+
+def _log_progress(stats):
+    remaining = stats['total_chunks'] - stats['chunks']
+    eta = stats['seconds'] / max(1, stats['chunks']) * remaining
+    logging.getLogger(__name__).info(
+        'chunk %s shard %d done (%d/%d): %d detected, %d unscheduled '
+        'outages, %.0f detected/s, ETA %.0fs', stats['begin'], stats['shard'],
+        stats['chunks'], stats['total_chunks'], stats['detected_outages'],
+        stats['unscheduled_outages'], stats['detected_per_second'] or 0, eta)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--from', dest='begin', required=True,
+                        type=datetime.fromisoformat,
+                        help='Replay detected outages beginning at or after '
+                             'this time (ISO 8601, UTC)')
+    parser.add_argument('--to', dest='end', required=True,
+                        type=datetime.fromisoformat,
+                        help='... and before this time')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Classify in this many processes')
+    parser.add_argument('--chunk-hours', type=float, default=24,
+                        help='Time slice of a chunk')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='Also split chunks by device/circuit')
+    parser.add_argument('--split-partial', action='store_true',
+                        help='Only count the unscheduled parts of partly '
+                             'scheduled outages')
+    parser.add_argument('--horizon-days', type=float,
+                        help='Only consider scheduled outages beginning at '
+                             'most this many days before a detected outage')
+    parser.add_argument('--restart', action='store_true',
+                        help='Discard an unfinished replay of the range')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Classify, but do not swap the outages in; a '
+                             'later run resumes from the staged outages')
+    parser.add_argument('--sla-report',
+                        help='Pass the replayed outages through the SLA '
+                             'handlers in dry-run mode, writing them as '
+                             'JSON lines to this file (- for stdout)')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+
+    replay = Replay(args.begin, args.end, split_partial=args.split_partial,
+        horizon=None if args.horizon_days is None
+            else timedelta(days=args.horizon_days),
+        chunk=timedelta(hours=args.chunk_hours), shards=args.shards,
+        restart=args.restart)
+    result = {'run': replay.run_id,
+              'replay': replay.run(args.workers, progress=_log_progress),
+              'diff': replay.diff()}
+    if not args.dry_run:
+        result['swap'] = replay.swap()
+
+    if args.sla_report:
+        report = sys.stdout if args.sla_report == '-' \
+            else open(args.sla_report, 'w')
+
+        def record(outage):
+            downtime = SLAHandler.downtime(outage)
+            report.write(json.dumps({'provider': outage.provider,
+                'service_id': outage.service_id,
+                'begin': outage.begin_time.isoformat(),
+                'end': outage.end_time.isoformat(),
+                'downtime_seconds': {'day': downtime.day.seconds,
+                                     'days30': downtime.days30.seconds,
+                                     'month': downtime.month.seconds}}) + '\n')
+
+        try:
+            result['sla'] = replay.redrive(record)
+        finally:
+            if report is not sys.stdout:
+                report.close()
+
+    print(result)
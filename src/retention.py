@@ -0,0 +1,164 @@
+from db import db_session
+from db.idempotency import IdempotencyKey
+from db.outage import *
+from db.partitions import drop_partitions, ensure_partitions, next_month
+
+from datetime import datetime, time, timedelta
+
+import argparse
+
+
+"""Split [begin, end] at midnights.
+
+Yields:
+    (date, float): day and seconds of the interval within that day
+"""
+def _days(begin, end):
+    while True:
+        midnight = datetime.combine(begin.date() + timedelta(days=1), time())
+        if end <= midnight:
+            yield (begin.date(), (end - begin).total_seconds())
+            return
+        yield (begin.date(), (midnight - begin).total_seconds())
+        begin = midnight
+
+
+"""Keeps the outage tables bounded.
+
+Detected outages that begin before the retention horizon are compacted
+into per device/circuit daily DetectedOutageRollups and the raw rows are
+dropped. Scheduled and unscheduled outages are only dropped if a
+retention is given for them: unscheduled outages are the SLA record.
+So are idempotency keys (see IdempotencyFilter): a re-delivery older than
+their retention is no longer recognized.
+
+On PostgreSQL the job also creates the monthly partitions for the coming
+months and drops the partitions that are past the horizon (see
+db.partitions).
+"""
+class RetentionJob:
+    """Constructor.
+
+    Args:
+        detected_days (int): keep raw detected outages this many days
+        scheduled_days (int): keep scheduled outages that ended this many
+            days ago, None == forever
+        unscheduled_days (int): keep unscheduled outages this many days,
+            None == forever
+        idempotency_days (int): keep idempotency keys this many days,
+            None == forever
+        months_ahead (int): partitions to create past the current month
+        clock (func()): returns the current (UTC) time
+    """
+    def __init__(self, detected_days=90, scheduled_days=None,
+                 unscheduled_days=None, idempotency_days=None, months_ahead=2,
+                 clock=datetime.utcnow):
+        self._detected_days = detected_days
+        self._scheduled_days = scheduled_days
+        self._unscheduled_days = unscheduled_days
+        self._idempotency_days = idempotency_days
+        self._months_ahead = months_ahead
+        self._clock = clock
+
+    """Run the job.
+
+    Returns:
+        dict[str, int]: number of rows compacted/dropped per table
+    """
+    def run(self):
+        now = self._clock()
+        cutoff = now - timedelta(days=self._detected_days)
+        result = {'detected_outages': self.compact_detected_outages(cutoff)}
+
+        if self._scheduled_days is not None:
+            result['scheduled_outages'] = db_session.query(
+                ScheduledOutage).filter(ScheduledOutage.end_time <
+                now - timedelta(days=self._scheduled_days)).delete(
+                synchronize_session=False)
+        if self._unscheduled_days is not None:
+            result['unscheduled_outages'] = db_session.query(
+                UnscheduledOutage).filter(UnscheduledOutage.begin_time <
+                now - timedelta(days=self._unscheduled_days)).delete(
+                synchronize_session=False)
+        if self._idempotency_days is not None:
+            result['idempotency_keys'] = db_session.query(
+                IdempotencyKey).filter(IdempotencyKey.time <
+                now - timedelta(days=self._idempotency_days)).delete(
+                synchronize_session=False)
+
+        connection = db_session.connection()
+        end = now
+        for i in range(self._months_ahead):
+            end = next_month(end)
+        ensure_partitions(connection, now, end)
+        drop_partitions(connection, cutoff, tables=['detected_outages'])
+        if self._unscheduled_days is not None:
+            drop_partitions(connection,
+                now - timedelta(days=self._unscheduled_days),
+                tables=['unscheduled_outages'])
+        db_session.commit()
+        return result
+
+    """Roll up and drop the detected outages beginning before `cutoff`.
+
+    Downtime is attributed to the days it falls on; an outage is counted
+    on the day it begins. Existing rollups are added to, so the job can
+    be run repeatedly. Outages whose device/circuit was deleted are
+    dropped without a rollup.
+
+    Args:
+        cutoff (datetime)
+
+    Returns:
+        int: number of detected outages compacted
+    """
+    def compact_detected_outages(self, cutoff):
+        rollups = {}  # (dev_or_circ_id, day) -> [outages, seconds]
+        rows = db_session.query(DetectedOutage.dev_or_circ_id,
+            DetectedOutage.begin_time, DetectedOutage.end_time).filter(
+            DetectedOutage.begin_time < cutoff).filter(
+            DetectedOutage.dev_or_circ_id.isnot(None)).yield_per(10000)
+        for (dev_or_circ_id, begin, end) in rows:
+            rollups.setdefault((dev_or_circ_id, begin.date()), [0, 0.0])[0] \
+                += 1
+            for (day, seconds) in _days(begin, max(begin, end)):
+                rollups.setdefault((dev_or_circ_id, day), [0, 0.0])[1] \
+                    += seconds
+
+        for ((dev_or_circ_id, day), (outages, seconds)) in rollups.items():
+            rollup = db_session.get(DetectedOutageRollup,
+                                    (dev_or_circ_id, day))
+            if rollup is None:
+                rollup = DetectedOutageRollup(dev_or_circ_id=dev_or_circ_id,
+                    day=day, outages=0, downtime_seconds=0)
+                db_session.add(rollup)
+            rollup.outages += outages
+            rollup.downtime_seconds += round(seconds)
+
+        count = db_session.query(DetectedOutage).filter(
+            DetectedOutage.begin_time < cutoff).delete(
+            synchronize_session=False)
+        db_session.commit()
+        return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--detected-days', type=int, default=90,
+                        help='Days of raw detected outages to keep')
+    parser.add_argument('--scheduled-days', type=int,
+                        help='Days of scheduled outages to keep (default: all)')
+    parser.add_argument('--unscheduled-days', type=int,
+                        help='Days of unscheduled outages to keep '
+                             '(default: all)')
+    parser.add_argument('--idempotency-days', type=int,
+                        help='Days of idempotency keys to keep (default: all)')
+    parser.add_argument('--months-ahead', type=int, default=2,
+                        help='Monthly partitions to create ahead (PostgreSQL)')
+
+    args = parser.parse_args()
+
+    print(RetentionJob(args.detected_days, args.scheduled_days,
+                       args.unscheduled_days, args.idempotency_days,
+                       args.months_ahead).run())
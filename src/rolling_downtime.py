@@ -0,0 +1,215 @@
+from db import db_session
+from db.outage import UnscheduledOutage
+
+from collections import deque, namedtuple
+from datetime import timedelta
+
+from sqlalchemy import func
+
+import threading
+
+
+"""Downtime totals of one window.
+
+Attributes:
+    seconds (float): unscheduled downtime
+    incidents (int): number of unscheduled outages
+"""
+WindowTotals = namedtuple('WindowTotals', 'seconds incidents')
+
+
+"""Read-only view of the rolling downtime of a device/circuit.
+
+Attributes:
+    day (WindowTotals): last 24 hours
+    days30 (WindowTotals): last 30 days
+    month (WindowTotals): calendar month of `now`
+    now (datetime): end of the windows
+"""
+Downtime = namedtuple('Downtime', 'day days30 month now')
+
+
+"""Unscheduled outages ending within a sliding window, with running totals.
+
+An outage counts, in full, while its end time is within the window.
+"""
+class _SlidingWindow:
+    def __init__(self, length):
+        self._length = length
+        self._outages = deque()  # (end, seconds), in order of end
+        self._seconds = 0.0
+
+    def add(self, end, seconds):
+        if self._outages and end < self._outages[-1][0]:
+            # Out of order, rare: keep the deque sorted by end
+            outages = sorted(list(self._outages) + [(end, seconds)])
+            self._outages = deque(outages)
+        else:
+            self._outages.append((end, seconds))
+        self._seconds += seconds
+
+    def __len__(self):
+        return len(self._outages)
+
+    def expire(self, now):
+        start = now - self._length
+        while self._outages and self._outages[0][0] <= start:
+            (end, seconds) = self._outages.popleft()
+            self._seconds -= seconds
+        if not self._outages:
+            self._seconds = 0.0  # no float drift once empty
+
+    def totals(self, now):
+        self.expire(now)
+        return WindowTotals(self._seconds, len(self._outages))
+
+
+class _Counters:
+    def __init__(self):
+        self.day = _SlidingWindow(timedelta(days=1))
+        self.days30 = _SlidingWindow(timedelta(days=30))
+        self.month = None  # (year, month)
+        self.month_seconds = 0.0
+        self.month_incidents = 0
+
+    def add(self, end, seconds):
+        self.day.add(end, seconds)
+        self.days30.add(end, seconds)
+        month = (end.year, end.month)
+        if month != self.month:
+            if self.month is not None and month < self.month:
+                return  # an earlier month, no longer tracked
+            self.month = month
+            self.month_seconds = 0.0
+            self.month_incidents = 0
+        self.month_seconds += seconds
+        self.month_incidents += 1
+
+    # Drop the outages that slid out of the windows, True if none are left
+    def expire(self, now):
+        self.day.expire(now)
+        self.days30.expire(now)
+        return not self.days30 and self.month != (now.year, now.month)
+
+    def view(self, now):
+        if self.month == (now.year, now.month):
+            month = WindowTotals(self.month_seconds, self.month_incidents)
+        else:
+            month = WindowTotals(0.0, 0)
+        return Downtime(self.day.totals(now), self.days30.totals(now), month,
+                        now)
+
+
+"""Rolling unscheduled downtime per (provider, dev_or_circ_id).
+
+Totals over the last 24 hours, the last 30 days and the calendar month are
+updated as unscheduled outages are recorded and expire as the windows
+slide, so reading them does not scan the UnscheduledOutage table.
+
+Time is the time of the outages, not the wall clock: the windows end at
+the latest end time recorded so far, so replaying old logs gives the same
+totals as processing them live.
+
+Expired outages are dropped as new ones are recorded, and the totals of a
+device/circuit once all of its windows are empty (checked for all of
+them every `sweep_interval` of outage time), so memory use only depends
+on the outages of the last 30 days and the month, even if nothing reads
+the totals.
+
+Thread safe, so plugins can read the totals from dispatcher threads.
+"""
+class RollingDowntime:
+    sweep_interval = timedelta(days=1)
+
+    def __init__(self):
+        self._counters = {}  # (provider, dev_or_circ_id) -> _Counters
+        self._now = None
+        self._swept = None  # self._now at the last _sweep()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._counters)
+
+    """Drop all totals and rebuild them from the UnscheduledOutage table.
+
+    Call this once before recording new outages, e.g. when starting to
+    poll; outages loaded here must not be recorded again.
+
+    Args:
+        until (datetime): only load outages ending before this time, e.g.
+                          to replay the outages from then on
+    """
+    def load(self, until=None):
+        with self._lock:
+            self._counters = {}
+            self._now = None
+            self._swept = None
+        latest = db_session.query(func.max(UnscheduledOutage.end_time))
+        if until is not None:
+            latest = latest.filter(UnscheduledOutage.end_time < until)
+        latest = latest.scalar()
+        if latest is None:
+            return
+        since = min(latest - timedelta(days=30),
+                    latest.replace(day=1, hour=0, minute=0, second=0,
+                                   microsecond=0))
+        rows = db_session.query(UnscheduledOutage.provider,
+            UnscheduledOutage.dev_or_circ_id, UnscheduledOutage.begin_time,
+            UnscheduledOutage.end_time).filter(
+            UnscheduledOutage.dev_or_circ_id.isnot(None)).filter(
+            UnscheduledOutage.end_time > since).filter(
+            UnscheduledOutage.end_time <= latest).order_by(
+            UnscheduledOutage.end_time)
+        for (provider, dev_or_circ_id, begin, end) in rows:
+            self.record(provider, dev_or_circ_id, begin, end)
+
+    """Add an unscheduled outage to the totals.
+
+    Args:
+        provider (str)
+        dev_or_circ_id (int)
+        begin (datetime)
+        end (datetime)
+    """
+    def record(self, provider, dev_or_circ_id, begin, end):
+        with self._lock:
+            counters = self._counters.get((provider, dev_or_circ_id))
+            if counters is None:
+                counters = self._counters[(provider, dev_or_circ_id)] = \
+                    _Counters()
+            counters.add(end, max(0.0, (end - begin).total_seconds()))
+            if self._now is None or end > self._now:
+                self._now = end
+            counters.expire(self._now)
+            if self._swept is None:
+                self._swept = self._now
+            elif self._now - self._swept >= self.sweep_interval:
+                self._sweep()
+
+    def _sweep(self):
+        for (key, counters) in list(self._counters.items()):
+            if counters.expire(self._now):
+                del self._counters[key]
+        self._swept = self._now
+
+    """Rolling downtime of a device/circuit.
+
+    Args:
+        provider (str)
+        dev_or_circ_id (int)
+        now (datetime): end of the windows, defaults to the latest end
+                        time recorded. Expired outages are dropped, so
+                        `now` must not go backwards between calls, nor
+                        be before the latest end time recorded.
+
+    Returns:
+        Downtime: all zero if nothing was recorded
+    """
+    def get(self, provider, dev_or_circ_id, now=None):
+        with self._lock:
+            now = now or self._now
+            counters = self._counters.get((provider, dev_or_circ_id))
+            if counters is None or now is None:
+                return Downtime(WindowTotals(0.0, 0), WindowTotals(0.0, 0),
+                                WindowTotals(0.0, 0), now)
+            return counters.view(now)
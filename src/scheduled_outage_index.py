@@ -0,0 +1,221 @@
+from db import db_session
+from db.outage import ScheduledOutage
+
+from device_circuit_topology import DeviceCircuitTopology
+from intervals import merge_intervals, subtract_intervals
+
+from bisect import bisect_right
+
+
+"""Scheduled outage windows for a single (provider, dev_or_circ_id).
+
+The windows are kept sorted by begin time along with a running maximum of
+the end times. A window contains [begin, end] if it begins at or before
+`begin` and ends at or after `end`, so the containment test is a single
+bisect followed by one comparison. The union of the windows is kept as
+well, for splitting a detected outage into its unscheduled parts.
+"""
+class _Windows:
+    def __init__(self):
+        self._windows = []
+        self._begins = None
+        self._max_ends = None
+        self._merged = None
+        self._merged_ends = None
+
+    def __len__(self):
+        return len(self._windows)
+
+    def add(self, begin, end):
+        self._windows.append((begin, end))
+        self._begins = None
+        self._merged = None
+
+    def extend(self, other):
+        self._windows.extend(other._windows)
+        self._begins = None
+        self._merged = None
+
+    def remove(self, begin, end):
+        self._windows.remove((begin, end))
+        self._begins = None
+        self._merged = None
+
+    def _build(self):
+        self._windows.sort()
+        self._begins = [begin for (begin, end) in self._windows]
+        self._max_ends = []
+        max_end = None
+        for (begin, end) in self._windows:
+            if max_end is None or end > max_end:
+                max_end = end
+            self._max_ends.append(max_end)
+
+    def contains(self, begin, end):
+        if self._begins is None:
+            self._build()
+        i = bisect_right(self._begins, begin)
+        return i > 0 and self._max_ends[i - 1] >= end
+
+    def uncovered(self, begin, end):
+        if self._merged is None:
+            self._merged = merge_intervals(self._windows)
+            self._merged_ends = [e for (b, e) in self._merged]
+        return subtract_intervals(begin, end, self._merged, self._merged_ends)
+
+
+"""In memory index of the ScheduledOutage table.
+
+Answers "is this detected outage inside a scheduled outage" without a
+database round-trip. The index is loaded once per poll with `load()` and
+kept up to date by OutageLoader as scheduled outages are added or
+cancelled.
+
+A scheduled outage of a device also covers the circuits of that device,
+as described by the DeviceCircuits table.
+"""
+class ScheduledOutageIndex:
+    """Constructor.
+
+    Args:
+        topology (DeviceCircuitTopology): device/circuit mapping, a new
+            one is created if not given.
+    """
+    def __init__(self, topology=None):
+        self._windows = {}  # (provider, dev_or_circ_id) -> _Windows
+        self._outages = {}  # (provider, outage_id) -> (key, begin, end)
+        self._topology = topology if topology is not None \
+            else DeviceCircuitTopology()
+        self._covering = {}  # (provider, dev_or_circ_id) -> _Windows
+        self._covering_version = self._topology.version
+
+    def __len__(self):
+        return len(self._outages)
+
+    """(Re)load the index from the ScheduledOutage table.
+
+    Args:
+        since (datetime): if given, only load the scheduled outages
+                          beginning at or after `since`
+    """
+    def load(self, since=None):
+        self._windows = {}
+        self._outages = {}
+        self._covering = {}
+        rows = db_session.query(ScheduledOutage.provider,
+            ScheduledOutage.outage_id, ScheduledOutage.dev_or_circ_id,
+            ScheduledOutage.begin_time, ScheduledOutage.end_time)
+        if since is not None:
+            rows = rows.filter(ScheduledOutage.begin_time >= since)
+        for (provider, outage_id, dev_or_circ_id, begin, end) in rows:
+            self._add(provider, outage_id, dev_or_circ_id, begin, end)
+
+    """Add a scheduled outage to the index.
+
+    Args:
+        outage (ScheduledOutage)
+    """
+    def add(self, outage):
+        self._add(outage.provider, outage.outage_id, outage.dev_or_circ_id,
+            outage.begin_time, outage.end_time)
+
+    """Remove a scheduled outage from the index.
+
+    Args:
+        provider (str)
+        outage_id (str): provider's identifier for the scheduled outage
+
+    Returns:
+        bool: True if the outage was in the index
+    """
+    def remove(self, provider, outage_id):
+        entry = self._outages.pop((provider, outage_id), None)
+        if entry is None:
+            return False
+        (key, begin, end) = entry
+        self._covering = {}
+        windows = self._windows[key]
+        windows.remove(begin, end)
+        if not windows:
+            del self._windows[key]
+        return True
+
+    """Check if [begin, end] is inside a single scheduled outage.
+
+    Args:
+        provider (str)
+        dev_or_circ_id (int)
+        begin (datetime)
+        end (datetime)
+
+    Returns:
+        bool: True if a scheduled outage contains the interval
+    """
+    def contains(self, provider, dev_or_circ_id, begin, end):
+        windows = self.covering(provider, dev_or_circ_id)
+        return windows is not None and windows.contains(begin, end)
+
+    """Split [begin, end] into the parts not covered by scheduled outages.
+
+    Args:
+        provider (str)
+        dev_or_circ_id (int)
+        begin (datetime)
+        end (datetime)
+
+    Returns:
+        list[(datetime, datetime)]: unscheduled parts, in order
+    """
+    def uncovered(self, provider, dev_or_circ_id, begin, end):
+        windows = self.covering(provider, dev_or_circ_id)
+        if windows is None:
+            return [(begin, end)]
+        return windows.uncovered(begin, end)
+
+    """Scheduled outage windows covering a device/circuit.
+
+    Includes the scheduled outages of the device/circuit itself as well as
+    those of the devices it depends on. The result is cached until the
+    index or the topology changes.
+
+    Args:
+        provider (str)
+        dev_or_circ_id (int)
+
+    Returns:
+        _Windows: None if there are no scheduled outages
+    """
+    def covering(self, provider, dev_or_circ_id):
+        if self._covering_version != self._topology.version:
+            self._covering = {}
+            self._covering_version = self._topology.version
+
+        key = (provider, dev_or_circ_id)
+        try:
+            return self._covering[key]
+        except KeyError:
+            pass
+
+        found = [self._windows[k] for k in [key] + [(provider, devid)
+                 for devid in self._topology.devices(dev_or_circ_id)]
+                 if k in self._windows]
+        if not found:
+            windows = None
+        elif len(found) == 1:
+            windows = found[0]
+        else:
+            windows = _Windows()
+            for other in found:
+                windows.extend(other)
+        self._covering[key] = windows
+        return windows
+
+    def _add(self, provider, outage_id, dev_or_circ_id, begin, end):
+        self.remove(provider, outage_id)
+        self._covering = {}
+        key = (provider, dev_or_circ_id)
+        windows = self._windows.get(key)
+        if windows is None:
+            windows = self._windows[key] = _Windows()
+        windows.add(begin, end)
+        self._outages[(provider, outage_id)] = (key, begin, end)
@@ -0,0 +1,349 @@
+from db import db_session, engine
+from db.lease import WorkerLease
+from device_or_circuit_cache import DeviceOrCircuitCache
+from outage_loader import LeaseLostError, OutageLoader
+from scheduled_outage_index import ScheduledOutageIndex
+from sla_handler import SLAHandler
+from unscheduled_outage_generator import UnscheduledOutageGenerator
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+
+import logging
+import multiprocessing
+import os
+import socket
+import time
+import zlib
+
+
+"""Shard of the work, by provider.
+
+Log outages are sharded by their provider, and emails by the provider of
+their from address (before they are parsed, see EmailParser.provider_of),
+with a stable hash. So the emails and detected outages of a provider are
+handled by the same worker, in order.
+
+Attributes:
+    index (int)
+    count (int): number of shards
+"""
+class Shard(namedtuple('Shard', 'index count')):
+    __slots__ = ()
+
+    """Name of the shard, used for its lease and LastProcessed times."""
+    @property
+    def name(self):
+        return f'{self.index}/{self.count}'
+
+    """Check whether a provider (or email address) is in the shard.
+
+    Args:
+        key (str)
+
+    Returns:
+        bool
+    """
+    def owns(self, key):
+        return zlib.crc32(key.encode()) % self.count == self.index
+
+
+"""Shards held by a worker, through WorkerLease rows.
+
+A worker claims its home shards when they are free, and any other shard
+whose lease has expired, i.e. whose worker stopped renewing it (it died,
+or hung for longer than `ttl`). A shard taken over stays with its new
+worker until that worker stops or loses it. Leases are claimed and renewed with a
+conditional UPDATE, so two workers can never both hold a shard.
+"""
+class LeaseManager:
+    """Constructor.
+
+    Args:
+        owner (str): unique name of the worker
+        shards (list[Shard]): all shards
+        home (list[Shard]): shards to claim whenever they are free
+        ttl (float): seconds a lease lasts without being renewed
+        clock (func()): returns the current (UTC) time
+    """
+    def __init__(self, owner, shards, home, ttl=60, clock=datetime.utcnow):
+        self._owner = owner
+        self._shards = shards
+        self._home = set(home)
+        self._ttl = timedelta(seconds=ttl)
+        self._clock = clock
+        self.held = []
+
+    """Create the WorkerLease rows of the shards that have none.
+
+    Args:
+        shards (list[Shard])
+    """
+    @staticmethod
+    def create_leases(shards):
+        existing = {shard for (shard,) in db_session.query(WorkerLease.shard)}
+        for shard in shards:
+            if shard.name in existing:
+                continue
+            db_session.add(WorkerLease(shard=shard.name,
+                                       expires=datetime(1970, 1, 1)))
+            try:
+                db_session.commit()
+            except IntegrityError:
+                db_session.rollback()  # created by another worker
+
+    def _claim(self, shard, condition, commit=True):
+        now = self._clock()
+        count = db_session.query(WorkerLease).filter(
+            WorkerLease.shard == shard.name).filter(condition).update({
+                'owner': self._owner, 'expires': now + self._ttl,
+                'heartbeat': now}, synchronize_session=False)
+        if commit:
+            db_session.commit()
+        return count == 1
+
+    """Renew the leases held and claim the free shards.
+
+    Returns:
+        list[Shard]: shards held
+    """
+    def acquire(self):
+        now = self._clock()
+        mine = WorkerLease.owner == self._owner
+        expired = and_(WorkerLease.owner.isnot(None),
+                       WorkerLease.expires < now)
+        held = []
+        for shard in self._shards:
+            if shard in self._home:
+                condition = or_(mine, WorkerLease.owner.is_(None),
+                                WorkerLease.expires < now)
+            else:
+                condition = or_(mine, expired)
+            if self._claim(shard, condition):
+                if shard not in self.held and shard not in self._home:
+                    logging.getLogger(__name__).warning(
+                        '%s took over shard %s', self._owner, shard.name)
+                held.append(shard)
+        self.held = held
+        return held
+
+    """Renew the lease of a shard.
+
+    With `commit` False the lease is renewed in the current transaction,
+    which then only commits while the shard is held: a worker taking the
+    shard over either waits for it, or makes the renewal fail.
+
+    Args:
+        shard (Shard)
+        commit (bool)
+
+    Returns:
+        bool: False if the lease was lost to another worker
+    """
+    def renew(self, shard, commit=True):
+        if self._claim(shard, WorkerLease.owner == self._owner, commit):
+            return True
+        logging.getLogger(__name__).warning('%s lost shard %s',
+                                            self._owner, shard.name)
+        self.held = [held for held in self.held if held != shard]
+        return False
+
+    """Sleep, renewing the leases held every third of `ttl`.
+
+    Args:
+        seconds (float)
+    """
+    def sleep(self, seconds):
+        deadline = time.monotonic() + seconds
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return
+            time.sleep(min(left, self._ttl.total_seconds() / 3))
+            for shard in list(self.held):
+                self.renew(shard)
+
+    """Give up the shards held, e.g. when stopping.
+
+    Their home workers claim them back right away; other workers do not
+    take them over (a worker stopping cleanly is restarted).
+    """
+    def release(self):
+        for shard in self.held:
+            db_session.query(WorkerLease).filter(
+                WorkerLease.shard == shard.name).filter(
+                WorkerLease.owner == self._owner).update(
+                {'owner': None, 'expires': datetime(1970, 1, 1)},
+                synchronize_session=False)
+        db_session.commit()
+        self.held = []
+
+
+'''Polls the shards it holds, see main.poll.
+
+Each shard has its own OutageLoader (and LastProcessed times) and
+UnscheduledOutageGenerator; the scheduled outage index and device/circuit
+cache are shared. Leases are renewed in the transaction of every batch of
+detected outages (and every email), so a batch is only stored while its
+shard is held, and while sleeping between polls. A shard whose lease is
+lost is dropped right away; the worker that took it over re-reads the
+batch in progress.
+'''
+class ShardWorker:
+    """Constructor.
+
+    Args:
+        leases (LeaseManager)
+        bulk, split_partial, batch_size, horizon, flap_gap, dedup, core:
+            see main.poll
+    """
+    def __init__(self, leases, bulk=False, split_partial=False,
+                 batch_size=1000, horizon=None, flap_gap=None, dedup=False,
+                 core=False):
+        self._leases = leases
+        self._bulk = bulk
+        self._horizon = horizon
+        self._loader_options = dict(batch_size=batch_size, flap_gap=flap_gap,
+                                    dedup=dedup, core=core)
+        self._gen_options = dict(split_partial=split_partial,
+                                 horizon=horizon, core=core)
+        self._scheduled_index = ScheduledOutageIndex()
+        self._device_cache = DeviceOrCircuitCache()
+        self._device_cache.warm()
+        self._sla_handler = SLAHandler()
+        self._pipelines = {}  # Shard -> (OutageLoader, generator)
+
+    def _pipeline(self, shard):
+        pipeline = self._pipelines.get(shard)
+        if pipeline is None:
+            pipeline = self._pipelines[shard] = (
+                OutageLoader(scheduled_index=self._scheduled_index,
+                    device_cache=self._device_cache, shard=shard,
+                    lease=lambda: self._leases.renew(shard, commit=False),
+                    **self._loader_options),
+                UnscheduledOutageGenerator(
+                    scheduled_index=self._scheduled_index,
+                    **self._gen_options))
+        return pipeline
+
+    """Poll every shard held once.
+
+    Returns:
+        list[Shard]: shards polled
+    """
+    def poll(self):
+        from main import poll_once
+
+        held = self._leases.acquire()
+        for shard in list(self._pipelines):
+            if shard not in held:
+                self._drop(shard)
+        for shard in held:
+            (loader, gen) = self._pipeline(shard)
+            try:
+                poll_once(loader, gen, self._sla_handler,
+                          self._scheduled_index, bulk=self._bulk,
+                          horizon=self._horizon)
+            except LeaseLostError:
+                self._drop(shard)
+        return held
+
+    def _drop(self, shard):
+        (loader, gen) = self._pipelines.pop(shard)
+        loader.close()
+
+    """Poll until stopped.
+
+    Args:
+        poll_interval (float): seconds between polls. 0 == Poll once
+    """
+    def run(self, poll_interval):
+        SLAHandler.load_downtime()
+        try:
+            while True:
+                self.poll()
+                db_session.commit()  # hold no lock while sleeping
+                if poll_interval <= 0:
+                    break
+                self._leases.sleep(poll_interval)
+        finally:
+            for shard in list(self._pipelines):
+                self._drop(shard)
+            self._leases.release()
+
+
+def _work(worker, workers, shards, poll_interval, lease_ttl, initializer,
+          kwargs):
+    if initializer is not None:
+        initializer()
+    shards = [Shard(i, shards) for i in range(shards)]
+    leases = LeaseManager(f'{socket.gethostname()}:{os.getpid()}', shards,
+        [shard for shard in shards if shard.index % workers == worker],
+        ttl=lease_ttl)
+    ShardWorker(leases, **kwargs).run(poll_interval)
+
+
+"""Run main.poll in `workers` processes, sharded by provider.
+
+The database must be shared by the processes: a file backed SQLite
+database (whose transactions then begin immediately, see
+db.engine.make_engine) or a PostgreSQL server. Workers that exit with
+an error are restarted; in the meantime the other workers take over
+their shards once the leases expire.
+
+Args:
+    workers (int): worker processes
+    poll_interval (float): seconds between polls. 0 == Poll once
+    shards (int): shards of the work, defaults to `workers`. More shards
+                  than workers spread the shards of a dead worker over
+                  the others.
+    lease_ttl (float): seconds before the shards of a worker that stopped
+                       renewing its leases are taken over
+    initializer (func()): called in each worker before polling, e.g. to
+                          install the helpdesk and log apis. Must be
+                          picklable (a module level function).
+    **kwargs: see main.poll
+
+Returns:
+    list[int]: exit codes of the workers (when polling once)
+
+Raises:
+    ValueError: the database is an in memory SQLite database
+"""
+def sharded_poll(workers, poll_interval, shards=None, lease_ttl=60,
+                 initializer=None, **kwargs):
+    if engine.dialect.name == 'sqlite' and \
+            engine.url.database in (None, '', ':memory:'):
+        raise ValueError('Sharded workers need a database shared by '
+                         'processes, see SLA_DATABASE_URL')
+    shards = shards or workers
+    if engine.dialect.name == 'sqlite':
+        # Inherited by the workers, see db.engine.make_engine
+        os.environ.setdefault('SLA_DATABASE_SQLITE_BEGIN_IMMEDIATE', '1')
+    LeaseManager.create_leases([Shard(i, shards) for i in range(shards)])
+
+    context = multiprocessing.get_context('spawn')
+
+    def start(worker):
+        process = context.Process(target=_work, args=(worker, workers,
+            shards, poll_interval, lease_ttl, initializer, kwargs))
+        process.start()
+        return process
+
+    processes = [start(worker) for worker in range(workers)]
+    if poll_interval <= 0:
+        for process in processes:
+            process.join()
+        return [process.exitcode for process in processes]
+
+    while True:
+        time.sleep(min(poll_interval, lease_ttl))
+        for (worker, process) in enumerate(processes):
+            if process.exitcode is not None:
+                logging.getLogger(__name__).error(
+                    'Worker %d exited with %d, restarting', worker,
+                    process.exitcode)
+                processes[worker] = start(worker)
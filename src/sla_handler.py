@@ -1,9 +1,32 @@
+from alert_dispatcher import AlertDispatcher, snapshot
+from db import db_session
+from db.dead_letter import DeadLetterAlert
+from db.outage import UnscheduledOutage
+from db.records import UnscheduledRecord
+from db.temp_ids import load_instances, load_temp_ids
+from rolling_downtime import RollingDowntime
+
+from sqlalchemy.orm import joinedload
+
+
 """Class to handle possible SLA violations.
 
-SLA violations are handled by provider specific plugins.
+SLA violations are handled by provider specific plugins, imported the
+first time an outage of their provider is handled (see
+sla_handlers/manifest.json). Every outage
+dispatched is added to the rolling downtime totals first, so a plugin can
+check them with SLAHandler.downtime(outage) without querying the
+UnscheduledOutage table.
+
+By default plugins are called right away, from the polling thread. After
+start_dispatcher(...) they are called from an AlertDispatcher's worker
+threads instead, with a CoalescedOutage per device/circuit and window.
 """
 class SLAHandler:
     _per_provider_handlers = {}
+    _rolling_downtime = RollingDowntime()
+    _dispatcher = None
+    _dry_run = None
 
     """Register a plugin.
 
@@ -16,7 +39,10 @@ class SLAHandler:
         SLAHandler._per_provider_handlers[provider] = handler
 
     """Dispatches outage to plugin handler.
-    
+
+    With a dispatcher started, the outage is queued for the plugin and
+    None is returned without waiting for it.
+
     Args:
         outage (UnscheduledOutage)
 
@@ -25,13 +51,162 @@ class SLAHandler:
     """
     @staticmethod
     def handle_unscheduled_outage(outage):
-        handler = SLAHandler._per_provider_handlers.get(outage.provider)
+        handler = SLAHandler._handler(outage.provider)
 
         if not handler:
             raise SLAError(f'No SLA handler for {outage.provider}')
 
+        SLAHandler._rolling_downtime.record(outage.provider,
+            outage.dev_or_circ_id, outage.begin_time, outage.end_time)
+        if SLAHandler._dry_run is not None:
+            return SLAHandler._dry_run(outage)
+        if SLAHandler._dispatcher is not None:
+            SLAHandler._dispatcher.submit(snapshot(outage))
+            return None
         return handler(outage)
 
+    """Dispatches outages to plugin handlers.
+
+    The outages, with their device/circuit, are loaded with a constant
+    number of queries first, so neither the dispatch nor plugins reading
+    `outage.device_or_circuit` query the database per outage.
+
+    UnscheduledRecords are only turned into UnscheduledOutages if the
+    plugins are called right away; a dispatcher queues snapshots of them.
+
+    Args:
+        outages (list[UnscheduledOutage or UnscheduledRecord])
+
+    Raises:
+        SLAError: no plugin registered for a provider
+    """
+    @staticmethod
+    def handle_unscheduled_outages(outages):
+        if outages and isinstance(outages[0], UnscheduledRecord):
+            if SLAHandler._dispatcher is None:
+                outages = SLAHandler._load_records(outages)
+        else:
+            load_instances(db_session, outages,
+                           joinedload(UnscheduledOutage.device_or_circuit))
+        for outage in outages:
+            SLAHandler.handle_unscheduled_outage(outage)
+
+    @staticmethod
+    def _load_records(records):
+        ids = load_temp_ids(db_session, (record.id for record in records))
+        outages = {outage.id: outage for outage in db_session.query(
+            UnscheduledOutage).join(ids,
+            ids.c.id == UnscheduledOutage.id).options(
+            joinedload(UnscheduledOutage.device_or_circuit))}
+        return [outages[record.id] for record in records]
+
+    """Calls the plugin handler of a queued outage, see AlertDispatcher.
+
+    Args:
+        outage (CoalescedOutage)
+    """
+    @staticmethod
+    def deliver(outage):
+        return SLAHandler._handler(outage.provider)(outage)
+
+    @staticmethod
+    def _handler(provider):
+        handler = SLAHandler._per_provider_handlers.get(provider)
+        if handler is None and sla_handlers.manifest.load(provider):
+            handler = SLAHandler._per_provider_handlers.get(provider)
+        return handler
+
+    """Call the plugins from background threads from now on.
+
+    Args:
+        **kwargs: see AlertDispatcher
+    """
+    @staticmethod
+    def start_dispatcher(**kwargs):
+        SLAHandler.stop_dispatcher()
+        SLAHandler._dispatcher = AlertDispatcher(SLAHandler.deliver, **kwargs)
+
+    """Deliver the queued outages and go back to calling plugins directly.
+
+    Args:
+        timeout (float): seconds to wait for each dispatcher thread
+    """
+    @staticmethod
+    def stop_dispatcher(timeout=None):
+        dispatcher = SLAHandler._dispatcher
+        if dispatcher is None:
+            return
+        SLAHandler._dispatcher = None
+        dispatcher.close(timeout)
+        SLAHandler._store_dead_letters(dispatcher)
+
+    """Store the outages the dispatcher gave up on in DeadLetterAlert.
+
+    Called from the polling thread, which owns db_session.
+
+    Returns:
+        int: number of dead letters stored
+    """
+    @staticmethod
+    def store_dead_letters():
+        if SLAHandler._dispatcher is None:
+            return 0
+        return SLAHandler._store_dead_letters(SLAHandler._dispatcher)
+
+    @staticmethod
+    def _store_dead_letters(dispatcher):
+        dead_letters = dispatcher.drain_dead_letters()
+        if not dead_letters:
+            return 0
+        db_session.add_all(DeadLetterAlert(provider=outage.provider,
+                dev_or_circ_id=outage.dev_or_circ_id,
+                service_id=outage.service_id, begin_time=outage.begin_time,
+                end_time=outage.end_time, data=outage.data,
+                outages=outage.outages, error=error, attempts=attempts,
+                time=time)
+            for (outage, error, attempts, time) in dead_letters)
+        db_session.commit()
+        return len(dead_letters)
+
+    """Rolling downtime of the outage's device/circuit.
+
+    Includes the outage itself when called from its handler.
+
+    Args:
+        outage (UnscheduledOutage)
+
+    Returns:
+        rolling_downtime.Downtime: read-only totals over the last 24
+            hours, the last 30 days and the calendar month
+    """
+    @staticmethod
+    def downtime(outage):
+        return SLAHandler._rolling_downtime.get(outage.provider,
+            outage.dev_or_circ_id)
+
+    """Rebuild the rolling downtime totals from the UnscheduledOutage table.
+
+    Call before dispatching new outages, e.g. when starting to poll.
+
+    Args:
+        until (datetime): see RollingDowntime.load
+    """
+    @staticmethod
+    def load_downtime(until=None):
+        SLAHandler._rolling_downtime.load(until)
+
+    """Pass outages to `recorder` instead of the plugins (a dry run).
+
+    The rolling downtime totals are still updated, so `recorder` can read
+    SLAHandler.downtime(outage) as a plugin would.
+
+    Args:
+        recorder (func(UnscheduledOutage)): None == call the plugins again
+    """
+    @staticmethod
+    def set_dry_run(recorder):
+        SLAHandler._dry_run = recorder
+
 
 """Decorator to register a handler with SLAHandler..
 
@@ -51,5 +226,5 @@ class SLAError(RuntimeError):
     pass
 
 
-# load plugins
+# plugin manifest, the plugins are imported on first use
 import sla_handlers
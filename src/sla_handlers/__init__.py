@@ -1,15 +1,10 @@
-import importlib
-import pkgutil
+from plugin_manifest import PluginManifest
 
-
-__all__ = []
+import os
 
 
-discovered_plugins = {
-    name: importlib.import_module(name)
-    for finder, name, ispkg
-    in pkgutil.iter_modules(__path__, __name__ + ".")
-}
+__all__ = []
 
 
-del discovered_plugins
+# Plugins are imported on first use, see PluginManifest
+manifest = PluginManifest(__name__, os.path.dirname(__file__))
@@ -0,0 +1,79 @@
+from alert_dispatcher import AlertDispatcher, CoalescedOutage, RecordingSink
+from datetime import datetime
+
+import threading
+import unittest
+
+
+def outage(service_id, hour, minute=0):
+    begin = datetime(2019, 4, 9, hour, minute)
+    return CoalescedOutage('testprovider', int(service_id[3:]), service_id,
+        begin, begin.replace(minute=minute + 10), '{}', 1)
+
+
+class AlertDispatcherTestCase(unittest.TestCase):
+    def test_coalesce(self):
+        sink = RecordingSink()
+        dispatcher = AlertDispatcher(sink, workers=2, window=60)
+        try:
+            for minute in (0, 20, 40):
+                dispatcher.submit(outage('IC-1', 1, minute))
+            dispatcher.submit(outage('IC-2', 1))
+            self.assertTrue(dispatcher.flush(5))
+            self.assertEqual([('IC-1', 3, datetime(2019, 4, 9, 1),
+                               datetime(2019, 4, 9, 1, 50)),
+                              ('IC-2', 1, datetime(2019, 4, 9, 1),
+                               datetime(2019, 4, 9, 1, 10))],
+                sorted((a.service_id, a.outages, a.begin_time, a.end_time)
+                       for a in sink.alerts))
+
+            # A new window after the alert was sent
+            dispatcher.submit(outage('IC-1', 2))
+            self.assertTrue(dispatcher.flush(5))
+            self.assertEqual(3, len(sink.alerts))
+        finally:
+            dispatcher.close(5)
+
+    def test_submit_does_not_wait(self):
+        release = threading.Event()
+        delivered = []
+
+        def slow_sink(alert):
+            release.wait(5)
+            delivered.append(alert)
+
+        dispatcher = AlertDispatcher(slow_sink, workers=1, window=0,
+                                     max_queued=1)
+        try:
+            for i in range(50):
+                dispatcher.submit(outage(f'IC-{i % 5}', 1, i % 50))
+            release.set()
+            self.assertTrue(dispatcher.flush(5))
+            self.assertEqual(50, sum(a.outages for a in delivered))
+        finally:
+            dispatcher.close(5)
+
+    def test_retry_and_dead_letter(self):
+        sink = RecordingSink(failures=2)
+        dispatcher = AlertDispatcher(sink, window=0, max_attempts=3,
+                                     backoff=0.001)
+        try:
+            dispatcher.submit(outage('IC-1', 1))
+            self.assertTrue(dispatcher.flush(5))
+            self.assertEqual(1, len(sink.alerts))
+            self.assertEqual(3, sink.attempts)
+
+            sink.failures = 3
+            dispatcher.submit(outage('IC-2', 1))
+            self.assertTrue(dispatcher.flush(5))
+            dead_letters = dispatcher.drain_dead_letters()
+            self.assertEqual(['IC-2'],
+                             [d.outage.service_id for d in dead_letters])
+            self.assertEqual(3, dead_letters[0].attempts)
+            self.assertEqual([], dispatcher.drain_dead_letters())
+        finally:
+            dispatcher.close(5)
+
+
+if __name__ == '__main__':
+    unittest.main()
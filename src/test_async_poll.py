@@ -0,0 +1,106 @@
+from async_poll import AsyncPoller
+from datetime import datetime
+from db import db_session
+from db.device_or_circuit import DeviceOrCircuit, Type as DoCType
+from db.last_processed import LastProcessed
+from db.outage import DetectedOutage, ScheduledOutage, UnscheduledOutage
+from log_loader import Outage
+from sla_handler import SLAHandler
+
+import asyncio
+import helpdesk
+import log_loader
+import threading
+import unittest
+
+
+class AsyncPollerTestCase(unittest.TestCase):
+    def setUp(self):
+        db_session.query(LastProcessed).delete()
+        db_session.add(DeviceOrCircuit(provider='fiberprovider',
+            service_id='IC-99999', type=DoCType.circuit))
+        db_session.commit()
+        self.alerts = []
+        SLAHandler.register_handler('fiberprovider', self.alerts.append)
+        with open('../data/provider_email.txt') as f:
+            self.email = (datetime(2019, 4, 8), 'noc@fiberprovider.com',
+                          f.read())
+        # Set to let the helpdesk api answer
+        self.helpdesk_answers = threading.Event()
+        self.email_polls = 0
+        self.log_polls = 0
+        self.originals = (log_loader.load_outages_from_logs,
+                          helpdesk.load_new_emails)
+        helpdesk.load_new_emails = self.load_new_emails
+
+    def tearDown(self):
+        self.helpdesk_answers.set()
+        (log_loader.load_outages_from_logs, helpdesk.load_new_emails) = \
+            self.originals
+        del SLAHandler._per_provider_handlers['fiberprovider']
+        for table in (UnscheduledOutage, DetectedOutage, ScheduledOutage,
+                      LastProcessed, DeviceOrCircuit):
+            db_session.query(table).delete()
+        db_session.commit()
+        db_session.expunge_all()
+
+    # A slow helpdesk api, read in a worker thread
+    def load_new_emails(self, last_processed_time):
+        self.email_polls += 1
+        self.helpdesk_answers.wait(5)
+        if last_processed_time < self.email[0]:
+            yield self.email
+
+    def run_until(self, poller, condition):
+        async def main():
+            task = asyncio.ensure_future(poller.run())
+            try:
+                while not condition():
+                    self.assertFalse(task.done())
+                    await asyncio.sleep(0.01)
+            finally:
+                self.helpdesk_answers.set()
+                if poller._email_interval > 0 or poller._log_interval > 0:
+                    task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        asyncio.run(asyncio.wait_for(main(), 5))
+
+    def test_independent_schedules(self):
+        def load_outages_from_logs(last_processed_time):
+            self.log_polls += 1
+            return []
+        log_loader.load_outages_from_logs = load_outages_from_logs
+        poller = AsyncPoller(3600, 0.01)
+        try:
+            # The logs are polled on their own schedule while the first
+            # email poll waits for the helpdesk
+            self.run_until(poller, lambda: self.log_polls >= 3)
+        finally:
+            poller.close()
+        self.assertEqual(1, self.email_polls)
+        self.assertEqual(0, db_session.query(ScheduledOutage).count())
+
+    def test_scheduled_before_classified(self):
+        log_loader.load_outages_from_logs = lambda time: [
+            (datetime(2019, 4, 9, 6, 45), Outage('fiberprovider', 'IC-99999',
+                datetime(2019, 4, 9, 6, 5), datetime(2019, 4, 9, 6, 45), {}))]
+        poller = AsyncPoller(0, 0)
+
+        # The detected outage is stored, but not classified until the email
+        # scheduling it is
+        def stored():
+            if db_session.query(DetectedOutage).count() == 0:
+                return False
+            self.assertEqual(0, db_session.query(UnscheduledOutage).count())
+            return True
+        try:
+            self.run_until(poller, stored)
+        finally:
+            poller.close()
+        self.assertEqual(1, db_session.query(ScheduledOutage).count())
+        self.assertEqual(0, db_session.query(UnscheduledOutage).count())
+        self.assertEqual([], self.alerts)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+from db.engine import load_config, make_engine
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+
+class DbEngineTestCase(unittest.TestCase):
+    def test_load_config(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json',
+                                         delete=False) as f:
+            json.dump({'url': 'sqlite:///from-file.db', 'pool_size': 3}, f)
+        try:
+            config = load_config({'SLA_DATABASE_CONFIG': f.name,
+                                  'SLA_DATABASE_POOL_SIZE': '7',
+                                  'SLA_DATABASE_POOL_PRE_PING': 'no'})
+        finally:
+            os.remove(f.name)
+        self.assertEqual('sqlite:///from-file.db', config['url'])
+        self.assertEqual(7, config['pool_size'])
+        self.assertFalse(config['pool_pre_ping'])
+        self.assertFalse(config['echo'])
+        self.assertEqual('sqlite:///:memory:', load_config({})['url'])
+
+    def test_in_memory_single_thread(self):
+        engine = make_engine('sqlite:///:memory:')
+        with engine.connect() as connection:
+            self.assertEqual(1, connection.execute(text('SELECT 1')).scalar())
+        errors = []
+
+        def connect():
+            try:
+                engine.connect()
+            except RuntimeError as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=connect)
+        thread.start()
+        thread.join()
+        self.assertEqual(1, len(errors))
+
+        # Nor through a connection checked out by the owner
+        with engine.connect() as connection:
+            def execute():
+                try:
+                    connection.execute(text('SELECT 1'))
+                except RuntimeError as e:
+                    errors.append(e)
+
+            thread = threading.Thread(target=execute)
+            thread.start()
+            thread.join()
+        self.assertEqual(2, len(errors))
+        engine.dispose()
+
+    def test_sqlite_file_pragmas(self):
+        with tempfile.TemporaryDirectory() as directory:
+            engine = make_engine(f'sqlite:///{directory}/sla.db',
+                                 sqlite_mmap_size=1024 * 1024)
+            with engine.connect() as connection:
+                self.assertEqual('wal', connection.execute(
+                    text('PRAGMA journal_mode')).scalar())
+                self.assertEqual(1, connection.execute(
+                    text('PRAGMA synchronous')).scalar())
+                self.assertEqual(1024 * 1024, connection.execute(
+                    text('PRAGMA mmap_size')).scalar())
+            engine.dispose()
+
+    def test_sqlite_begin_immediate(self):
+        with tempfile.TemporaryDirectory() as directory:
+            engine = make_engine(f'sqlite:///{directory}/sla.db',
+                                 sqlite_busy_timeout=0,
+                                 sqlite_begin_immediate=True)
+            with engine.connect() as first, engine.connect() as second:
+                first.execute(text('SELECT 1'))
+                # The read took the write lock, a second writer must wait
+                with self.assertRaises(OperationalError):
+                    second.execute(text('SELECT 1'))
+            engine.dispose()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+from db import db_session
+from db.device_or_circuit import DeviceOrCircuit, Type as DoCType
+from device_or_circuit_cache import DeviceOrCircuitCache
+
+import unittest
+
+
+class DeviceOrCircuitCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.cache = DeviceOrCircuitCache(negative_ttl=60,
+                                          clock=lambda: self.now)
+        self.circuit = DeviceOrCircuit(provider='testprovider',
+            service_id='IC-1', type=DoCType.circuit)
+        db_session.add(self.circuit)
+        db_session.commit()
+
+    def tearDown(self):
+        db_session.query(DeviceOrCircuit).delete()
+        db_session.commit()
+        db_session.expunge_all()
+
+    def add_circuit(self, service_id):
+        circuit = DeviceOrCircuit(provider='testprovider',
+            service_id=service_id, type=DoCType.circuit)
+        db_session.add(circuit)
+        db_session.commit()
+        return circuit.id
+
+    def test_warm(self):
+        self.cache.warm()
+        self.assertEqual(1, len(self.cache))
+        self.assertEqual(self.circuit.id,
+                         self.cache.get('testprovider', 'IC-1'))
+
+    def test_get_many(self):
+        result = self.cache.get_many([('testprovider', 'IC-1'),
+                                      ('testprovider', 'IC-2')])
+        self.assertEqual({('testprovider', 'IC-1'): self.circuit.id,
+                          ('testprovider', 'IC-2'): None}, result)
+
+    def test_negative_ttl(self):
+        self.assertIsNone(self.cache.get('testprovider', 'IC-2'))
+        id = self.add_circuit('IC-2')
+        self.assertIsNone(self.cache.get('testprovider', 'IC-2'))
+        self.now = 61
+        self.assertEqual(id, self.cache.get('testprovider', 'IC-2'))
+
+    def test_refresh(self):
+        self.assertIsNone(self.cache.get('testprovider', 'IC-2'))
+        id = self.add_circuit('IC-2')
+        self.cache.refresh()
+        self.assertEqual(id, self.cache.get('testprovider', 'IC-2'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,10 @@
 from datetime import datetime
-from email_parser import EmailParser
+from db import db_session
+from db.last_processed import LastProcessed
+from email_parser import EmailParseError, EmailParser
+from outage_loader import OutageLoader
 
+import helpdesk
 import unittest
 
 
@@ -19,6 +23,48 @@ class EmailParserTestCase(unittest.TestCase):
         self.assertEqual('1 x 3 hours interruption', result.impact)
         self.assertEqual('noc@fiberprovider.com', result.email)
         self.assertEqual('8675309', result.phone)
+        self.assertFalse(hasattr(result, '__dict__'))
+
+    def test_lines_mode(self):
+        with open('../data/provider_email.txt') as f:
+            content = f.read()
+        self.assertEqual(
+            EmailParser.parse('noc@fiberprovider.com', content, mode='regex'),
+            EmailParser.parse('noc@fiberprovider.com', content, mode='lines'))
+        with self.assertRaises(EmailParseError):
+            EmailParser.parse('noc@fiberprovider.com',
+                content[:content.index('Phone:')], mode='lines')
+
+    def test_parse_many(self):
+        with open('../data/provider_email.txt') as f:
+            content = f.read()
+        results = EmailParser.parse_many([
+            ('noc@fiberprovider.com', content),
+            ('noc@fiberprovider.com', 'garbage'),
+            ('noc@unknown.com', content),
+            ('noc@fiberprovider.com', content),
+        ], max_workers=2, chunksize=1)
+        self.assertEqual(4, len(results))
+        self.assertEqual(EmailParser.parse('noc@fiberprovider.com', content),
+                         results[0])
+        self.assertIsInstance(results[1], EmailParseError)
+        self.assertIsInstance(results[2], EmailParseError)
+        self.assertEqual(results[0], results[3])
+
+    def test_loader_parse_workers(self):
+        original = helpdesk.load_new_emails
+        helpdesk.load_new_emails = lambda time: iter([])
+        try:
+            loader = OutageLoader(parse_workers=1)
+            self.assertFalse(loader.load_new_scheduled_outages())
+        finally:
+            helpdesk.load_new_emails = original
+            db_session.query(LastProcessed).delete()
+            db_session.commit()
+        executor = loader._parse_executor
+        loader.close()
+        with self.assertRaises(RuntimeError):
+            executor.submit(len, '')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,164 @@
+from async_poll import AsyncPoller
+from datetime import datetime
+from db import db_session
+from db.device_or_circuit import DeviceOrCircuit, Type as DoCType
+from db.idempotency import IdempotencyKey
+from db.last_processed import LastProcessed
+from db.outage import DetectedOutage, ScheduledOutage, UnscheduledOutage
+from event_poll import EventPoller, parse_log_record
+from sla_handler import SLAHandler
+
+import asyncio
+import contextlib
+import helpdesk
+import json
+import log_loader
+import os
+import tempfile
+import unittest
+
+
+def record(begin, end, service_id='IC-99999'):
+    return json.dumps({'provider': 'testprovider', 'service_id': service_id,
+                       'begin': begin, 'end': end})
+
+
+class EventPollTestCase(unittest.TestCase):
+    def setUp(self):
+        db_session.query(LastProcessed).delete()
+        db_session.add(DeviceOrCircuit(provider='testprovider',
+            service_id='IC-99999', type=DoCType.circuit))
+        db_session.commit()
+        self.alerts = []
+        SLAHandler.register_handler('testprovider', self.alerts.append)
+        self.directory = tempfile.TemporaryDirectory()
+        self.spool = os.path.join(self.directory.name, 'spool')
+        self.maildir = os.path.join(self.directory.name, 'mail')
+        for path in (self.spool, os.path.join(self.maildir, 'new'),
+                     os.path.join(self.maildir, 'cur')):
+            os.makedirs(path)
+        self.poller = EventPoller(0, spool_dir=self.spool,
+                                  maildir=self.maildir)
+        self.originals = (log_loader.load_outages_from_logs,
+                          helpdesk.load_new_emails)
+
+    def tearDown(self):
+        (log_loader.load_outages_from_logs, helpdesk.load_new_emails) = \
+            self.originals
+        self.directory.cleanup()
+        for table in (UnscheduledOutage, DetectedOutage, ScheduledOutage,
+                      IdempotencyKey, LastProcessed, DeviceOrCircuit):
+            db_session.query(table).delete()
+        db_session.commit()
+        db_session.expunge_all()
+
+    # Run the first sweep of the apis (see EventPoller.run), then `handle`
+    def sweep_and(self, handle):
+        async def main():
+            await AsyncPoller.run(self.poller)
+            return await handle()
+        return asyncio.run(main())
+
+    def test_parse_log_record(self):
+        (time, outage) = parse_log_record(
+            record('2019-04-09T06:05:00', '2019-04-09T06:45:00'))
+        self.assertEqual(datetime(2019, 4, 9, 6, 45), time)
+        self.assertEqual('IC-99999', outage.service_id)
+        self.assertRaises(ValueError, parse_log_record, '{"provider": "x"}')
+        self.assertRaises(ValueError, parse_log_record, 'not json')
+
+    def test_spool(self):
+        with open(os.path.join(self.spool, 'a.jsonl.tmp'), 'w') as f:
+            f.write(record('2019-04-09T06:05:00', '2019-04-09T06:45:00'))
+        self.assertEqual(0, self.sweep_and(self.poller.scan_spool))
+
+        os.rename(os.path.join(self.spool, 'a.jsonl.tmp'),
+                  os.path.join(self.spool, 'a.jsonl'))
+        self.assertEqual(1, self.sweep_and(self.poller.scan_spool))
+        self.assertEqual([], os.listdir(self.spool))
+        self.assertEqual([datetime(2019, 4, 9, 6, 5)],
+                         [a.begin_time for a in self.alerts])
+
+    def test_pushed_and_polled(self):
+        polled = parse_log_record(
+            record('2019-04-09T06:05:00', '2019-04-09T06:45:00'))
+        pushed = parse_log_record(
+            record('2019-04-09T07:05:00', '2019-04-09T07:45:00'))
+
+        async def push_then_poll():
+            await self.poller.handle_log_records([pushed])
+            # Pushed ahead of the log poll, which reads it again
+            log_loader.load_outages_from_logs = lambda time: \
+                [polled, pushed] if time < polled[0] else []
+            return await self.poller.load_new_detected_outages()
+
+        self.assertEqual(1, self.sweep_and(push_then_poll))
+        self.assertEqual(2, len(self.alerts))
+        self.assertEqual(2, db_session.query(DetectedOutage).count())
+        self.assertEqual({'log': polled[0], 'push': pushed[0]},
+                         {lp.name: lp.time for lp in
+                          db_session.query(LastProcessed).filter(
+                              LastProcessed.name.in_(('log', 'push')))})
+
+    def test_wait_for_emails(self):
+        with open('../data/provider_email.txt') as f:
+            email = (datetime(2019, 4, 8), 'noc@fiberprovider.com', f.read())
+        helpdesk.load_new_emails = lambda time: iter([email])
+        db_session.add(DeviceOrCircuit(provider='fiberprovider',
+            service_id='IC-99999', type=DoCType.circuit))
+        db_session.commit()
+        SLAHandler.register_handler('fiberprovider', self.alerts.append)
+        self.poller = EventPoller(3600)
+
+        async def push():
+            task = asyncio.ensure_future(self.poller.run())
+            await asyncio.sleep(0)
+            try:
+                # Only classified once the email poll it wakes up is done
+                return await self.poller.handle_log_records([parse_log_record(
+                    json.dumps({'provider': 'fiberprovider',
+                                'service_id': 'IC-99999',
+                                'begin': '2019-04-09T06:05:00',
+                                'end': '2019-04-09T06:45:00'}))])
+            finally:
+                task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await task
+
+        self.assertEqual(1, asyncio.run(push()))
+        self.assertEqual([], self.alerts)
+        self.assertEqual(1, db_session.query(ScheduledOutage).count())
+
+    def test_spool_failed(self):
+        self.poller = EventPoller(0, spool_dir=self.spool, batch_size=1)
+        with open(os.path.join(self.spool, 'a.jsonl'), 'w') as f:
+            f.write(record('2019-04-09T06:05:00', '2019-04-09T06:45:00'))
+            f.write('\n')
+            f.write(record('2019-04-09T07:05:00', '2019-04-09T07:45:00',
+                           'IC-404'))
+        self.assertEqual(1, self.sweep_and(self.poller.scan_spool))
+        self.assertEqual(['a.jsonl.failed'], os.listdir(self.spool))
+        # Nothing of the file is stored, so it can be handled again
+        self.assertEqual(0, db_session.query(DetectedOutage).count())
+        self.assertEqual([], self.alerts)
+
+    def test_maildir(self):
+        with open('../data/provider_email.txt') as f:
+            (subject, body) = f.read().split('\n\nBody:\n', 1)
+        with open(os.path.join(self.maildir, 'new', '1.host'), 'w') as f:
+            f.write('From: NOC <noc@fiberprovider.com>\n'
+                    'Date: Mon, 08 Apr 2019 12:00:00 +0000\n'
+                    f'{subject}\n\n{body}')
+        db_session.add(DeviceOrCircuit(provider='fiberprovider',
+            service_id='IC-99999', type=DoCType.circuit))
+        db_session.commit()
+
+        self.assertEqual(1, asyncio.run(self.poller.scan_maildir()))
+        self.assertEqual(['1.host:2,S'],
+                         os.listdir(os.path.join(self.maildir, 'cur')))
+        self.assertEqual(['PWIC12345'], [o.outage_id for o in
+                                         db_session.query(ScheduledOutage)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+from datetime import datetime, timedelta
+from db import db_session
+from db.device_or_circuit import DeviceOrCircuit, Type as DoCType
+from db.last_processed import LastProcessed
+from db.outage import DetectedOutage, FlapState
+from flap_coalescer import FlapCoalescer
+from log_loader import Outage
+from outage_loader import OutageLoader
+
+import json
+import log_loader
+import unittest
+
+
+def t(minute, second=0):
+    return datetime(2019, 4, 9, 6, minute, second)
+
+
+def outage(service_id, begin, end):
+    return (end, Outage('testprovider', service_id, begin, end, {}))
+
+
+class FlapCoalescerTestCase(unittest.TestCase):
+    def setUp(self):
+        db_session.query(LastProcessed).delete()
+        db_session.commit()
+
+    def tearDown(self):
+        for table in (DetectedOutage, FlapState, LastProcessed,
+                      DeviceOrCircuit):
+            db_session.query(table).delete()
+        db_session.commit()
+        db_session.expunge_all()
+
+    def test_add(self):
+        flaps = FlapCoalescer(timedelta(minutes=1))
+        self.assertEqual([], flaps.add(*outage('IC-1', t(0), t(0, 5))))
+        self.assertEqual([], flaps.add(*outage('IC-1', t(0, 50), t(0, 55))))
+        self.assertEqual([], flaps.add(*outage('IC-2', t(1), t(1, 5))))
+        self.assertEqual(2, len(flaps))
+
+        # IC-1 is passed on once the log is more than a minute past it
+        ((time, merged),) = flaps.add(*outage('IC-2', t(1, 56), t(2)))
+        self.assertEqual(t(2), time)
+        self.assertEqual((t(0), t(0, 55)), (merged.begin, merged.end))
+        self.assertEqual([[t(0).isoformat(), t(0, 5).isoformat()],
+                          [t(0, 50).isoformat(), t(0, 55).isoformat()]],
+                         merged.data['intervals'])
+
+        ((time, merged),) = flaps.add(*outage('IC-2', t(5), t(5, 5)))
+        self.assertEqual(Outage('testprovider', 'IC-2', t(1), t(2), {
+            'intervals': [[t(1).isoformat(), t(1, 5).isoformat()],
+                          [t(1, 56).isoformat(), t(2).isoformat()]]}),
+            merged)
+
+        # A single outage is passed on as is
+        ((time, single),) = flaps.add(*outage('IC-3', t(7), t(7, 5)))
+        self.assertEqual(Outage('testprovider', 'IC-2', t(5), t(5, 5), {}),
+                         single)
+
+    def test_flush(self):
+        flaps = FlapCoalescer(timedelta(minutes=1))
+        flaps.add(*outage('IC-1', t(0), t(0, 5)))
+        flaps.add(*outage('IC-1', t(0, 30), t(0, 35)))
+        self.assertEqual([], flaps.flush(t(1, 35)))
+        ((time, merged),) = flaps.flush(t(1, 36))
+        self.assertEqual(t(0, 35), time)
+        self.assertEqual((t(0), t(0, 35)), (merged.begin, merged.end))
+        self.assertEqual(0, len(flaps))
+
+    def test_flush_when_idle(self):
+        db_session.add(DeviceOrCircuit(provider='testprovider',
+            service_id='IC-1', type=DoCType.circuit))
+        db_session.commit()
+        polls = [[outage('IC-1', t(0), t(0, 5))], []]
+        now = [t(0, 10)]
+
+        original = log_loader.load_outages_from_logs
+        log_loader.load_outages_from_logs = lambda time: polls.pop(0)
+        try:
+            loader = OutageLoader(flap_gap=timedelta(minutes=1),
+                                  clock=lambda: now[0])
+            self.assertEqual([], loader.load_new_detected_outages())
+            # No later log record, released once its gap is over
+            now[0] = t(2)
+            (detected,) = loader.load_new_detected_outages()
+        finally:
+            log_loader.load_outages_from_logs = original
+        self.assertEqual((t(0), t(0, 5)),
+                         (detected.begin_time, detected.end_time))
+        self.assertEqual(t(0, 5), loader.last_processed_log_time)
+        self.assertEqual(0, db_session.query(FlapState).count())
+
+    def test_across_polls(self):
+        db_session.add(DeviceOrCircuit(provider='testprovider',
+            service_id='IC-1', type=DoCType.circuit))
+        db_session.commit()
+        polls = [[outage('IC-1', t(0), t(0, 5)),
+                  outage('IC-1', t(0, 30), t(0, 35))],
+                 [outage('IC-1', t(1), t(1, 5))],
+                 [outage('IC-1', t(10), t(10, 5))]]
+
+        def load_outages_from_logs(last_processed_time):
+            return polls.pop(0)
+
+        original = log_loader.load_outages_from_logs
+        log_loader.load_outages_from_logs = load_outages_from_logs
+        try:
+            results = []
+            for i in range(3):
+                # A new loader for each poll, as after a restart
+                loader = OutageLoader(flap_gap=timedelta(minutes=1),
+                                      clock=lambda: t(1, 30))
+                results.append(loader.load_new_detected_outages())
+        finally:
+            log_loader.load_outages_from_logs = original
+
+        self.assertEqual([0, 0, 1], [len(result) for result in results])
+        detected = results[2][0]
+        self.assertEqual((t(0), t(1, 5)),
+                         (detected.begin_time, detected.end_time))
+        self.assertEqual(3, len(json.loads(detected.data)['intervals']))
+        self.assertEqual(t(10, 5), loader.last_processed_log_time)
+        self.assertEqual([('IC-1', t(10), t(10, 5))],
+            [(s.service_id, s.begin_time, s.end_time)
+             for s in db_session.query(FlapState)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+from datetime import datetime
+from db import db_session
+from db.device_or_circuit import DeviceOrCircuit, Type as DoCType
+from db.idempotency import IdempotencyKey
+from db.last_processed import LastProcessed
+from db.outage import DetectedOutage, ScheduledOutage
+from idempotency import BloomFilter
+from log_loader import Outage
+from outage_loader import OutageLoader, OutageLoaderError
+from sqlalchemy import event
+
+import helpdesk
+import log_loader
+import unittest
+
+
+def outage(service_id, minute):
+    begin = datetime(2019, 4, 9, 6, minute)
+    end = datetime(2019, 4, 9, 6, minute + 5)
+    return (end, Outage('testprovider', service_id, begin, end, {}))
+
+
+class IdempotencyTestCase(unittest.TestCase):
+    def setUp(self):
+        db_session.query(LastProcessed).delete()
+        db_session.add(DeviceOrCircuit(provider='testprovider',
+            service_id='IC-1', type=DoCType.circuit))
+        db_session.commit()
+        self.originals = (log_loader.load_outages_from_logs,
+                          helpdesk.load_new_emails)
+
+    def tearDown(self):
+        (log_loader.load_outages_from_logs, helpdesk.load_new_emails) = \
+            self.originals
+        for table in (DetectedOutage, ScheduledOutage, IdempotencyKey,
+                      LastProcessed, DeviceOrCircuit):
+            db_session.query(table).delete()
+        db_session.commit()
+        db_session.expunge_all()
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(str(i))
+        self.assertTrue(all(str(i) in bloom for i in range(1000)))
+        false_positives = sum(str(i) in bloom for i in range(1000, 11000))
+        self.assertLess(false_positives, 300)
+
+    def test_close(self):
+        loader = OutageLoader(dedup=True)
+        keys = loader._log_keys
+        self.assertTrue(event.contains(db_session, 'after_rollback',
+                                       keys._on_rollback))
+        loader.close()
+        loader.close()
+        self.assertFalse(event.contains(db_session, 'after_rollback',
+                                        keys._on_rollback))
+
+    def test_log_outages(self):
+        polls = [[outage('IC-1', 0), outage('IC-1', 0), outage('IC-1', 10)],
+                 [outage('IC-1', 10), outage('IC-1', 20)]]
+        log_loader.load_outages_from_logs = lambda time: polls.pop(0)
+
+        self.assertEqual(2, len(OutageLoader(dedup=True)
+                                .load_new_detected_outages()))
+        # A new loader, as after a restart: the keys come from the table
+        self.assertEqual(1, len(OutageLoader(dedup=True)
+                                .load_new_detected_outages()))
+        self.assertEqual(3, db_session.query(DetectedOutage).count())
+
+    def test_rollback(self):
+        loader = OutageLoader(dedup=True)
+        self.assertRaises(OutageLoaderError, loader.store_log_records,
+                          [outage('IC-1', 0), outage('IC-2', 0)])
+        # Nothing was stored, so the re-delivery is not a duplicate
+        self.assertEqual(1, len(loader.store_log_records(
+            [outage('IC-1', 0)])))
+
+    def test_emails(self):
+        with open('../data/provider_email.txt') as f:
+            content = f.read()
+        db_session.add(DeviceOrCircuit(provider='fiberprovider',
+            service_id='IC-99999', type=DoCType.circuit))
+        db_session.commit()
+        email = (datetime(2019, 4, 8), 'noc@fiberprovider.com', content)
+        polls = [[email, email], [email]]
+        helpdesk.load_new_emails = lambda time: iter(polls.pop(0))
+
+        loader = OutageLoader(dedup=True)
+        self.assertTrue(loader.load_new_scheduled_outages())
+        self.assertFalse(loader.load_new_scheduled_outages())
+        self.assertEqual(1, db_session.query(ScheduledOutage).count())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+from datetime import datetime
+from intervals import merge_intervals, subtract_intervals
+
+import unittest
+
+
+def t(hour, minute=0):
+    return datetime(2019, 4, 9, hour, minute)
+
+
+class IntervalsTestCase(unittest.TestCase):
+    def test_merge(self):
+        self.assertEqual([(t(1), t(3)), (t(4), t(5))], merge_intervals([
+            (t(4), t(5)), (t(2), t(3)), (t(1), t(2)), (t(1, 30), t(1, 45))]))
+
+    def test_subtract(self):
+        merged = merge_intervals([(t(1), t(2)), (t(2), t(3)), (t(4), t(5))])
+        self.assertEqual([(t(3), t(4)), (t(5), t(6))],
+            subtract_intervals(t(1, 30), t(6), merged))
+        self.assertEqual([(t(2), t(2, 10))],
+            subtract_intervals(t(1), t(2, 10), merge_intervals([(t(1), t(2))])))
+        self.assertEqual([], subtract_intervals(t(1), t(2), merged))
+        self.assertEqual([(t(0), t(1))], subtract_intervals(t(0), t(1), merged))
+        self.assertEqual([(t(6), t(7))], subtract_intervals(t(6), t(7), []))
+
+    def test_subtract_zero_length(self):
+        merged = merge_intervals([(t(1), t(2))])
+        self.assertEqual([], subtract_intervals(t(2), t(2), merged))
+        self.assertEqual([], subtract_intervals(t(1), t(1), merged))
+        self.assertEqual([(t(3), t(3))], subtract_intervals(t(3), t(3), merged))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+from async_poll import apoll
+from datetime import datetime
+from db import db_session
+from db.device_or_circuit import DeviceOrCircuit, Type as DoCType
+from db.last_processed import LastProcessed, LogCheckpoint
+from db.outage import DetectedOutage
+from log_file_source import LogFileSource
+from outage_loader import OutageLoader, OutageLoaderError
+
+import log_loader
+import os
+import tempfile
+import unittest
+
+
+def t(hour, minute=0):
+    return datetime(2019, 4, 9, hour, minute)
+
+
+def line(time, service_id, state):
+    return f'{time.isoformat()} fiberprovider {service_id} {state}\n'
+
+
+class LogFileSourceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'syslog')
+
+    def tearDown(self):
+        self.directory.cleanup()
+        for table in (DetectedOutage, LastProcessed, LogCheckpoint,
+                      DeviceOrCircuit):
+            db_session.query(table).delete()
+        db_session.commit()
+        db_session.expunge_all()
+
+    def write(self, *lines, mode='a'):
+        with open(self.path, mode) as f:
+            f.write(''.join(lines))
+
+    def read(self, **kwargs):
+        # A new source each time, as after a restart
+        source = LogFileSource(self.path, name='test', **kwargs)
+        result = [(o.service_id, o.begin, o.end) for (time, o) in source(t(0))]
+        source.save()
+        db_session.commit()
+        return result
+
+    def install(self):
+        originals = (log_loader.load_outages_from_logs,
+                     log_loader.aload_outages_from_logs,
+                     log_loader.save_position)
+
+        def restore():
+            (log_loader.load_outages_from_logs,
+             log_loader.aload_outages_from_logs,
+             log_loader.save_position) = originals
+        self.addCleanup(restore)
+        LogFileSource(self.path, name='test').install()
+
+    def test_resume(self):
+        self.write(line(t(1), 'IC-1', 'DOWN'), 'unrelated line\n',
+                   line(t(1, 5), 'IC-2', 'DOWN'), line(t(1, 30), 'IC-1', 'UP'),
+                   line(t(2), 'IC-3', 'UP'))
+        self.assertEqual([('IC-1', t(1), t(1, 30))], self.read(chunk_size=40))
+
+        # IC-2 is still down, a partial line is left for later
+        self.write(line(t(2), 'IC-2', 'UP'), '2019-04-09T03:00:00 fiberpro')
+        self.assertEqual([('IC-2', t(1, 5), t(2))], self.read())
+        self.write('vider IC-2 DOWN\n', line(t(4), 'IC-2', 'UP'))
+        self.assertEqual([('IC-2', t(3), t(4))], self.read())
+        self.assertEqual([], self.read())
+        self.assertEqual(os.path.getsize(self.path),
+                         db_session.get(LogCheckpoint, 'test').offset)
+
+    def test_rotation_and_truncation(self):
+        self.write(line(t(1), 'IC-1', 'DOWN'))
+        self.assertEqual([], self.read())
+
+        # Rotated, with more lines written to the old file first
+        self.write(line(t(2), 'IC-1', 'UP'), line(t(3), 'IC-2', 'DOWN'))
+        os.rename(self.path, self.path + '.1')
+        self.write(line(t(4), 'IC-2', 'UP'), line(t(5), 'IC-3', 'DOWN'),
+                   line(t(6), 'IC-3', 'UP'))
+        self.assertEqual([('IC-1', t(1), t(2)), ('IC-2', t(3), t(4)),
+                          ('IC-3', t(5), t(6))], self.read())
+
+        # Truncated
+        self.write(line(t(7), 'IC-4', 'DOWN'), line(t(8), 'IC-4', 'UP'),
+                   mode='w')
+        self.assertEqual([('IC-4', t(7), t(8))], self.read())
+
+    def test_last_batch_not_stored(self):
+        db_session.add(DeviceOrCircuit(provider='fiberprovider',
+            service_id='IC-1', type=DoCType.circuit))
+        db_session.commit()
+        self.write(line(t(1), 'IC-1', 'DOWN'), line(t(2), 'IC-1', 'UP'),
+                   line(t(3), 'IC-2', 'DOWN'), line(t(4), 'IC-2', 'UP'))
+
+        self.install()
+        # IC-2 is unknown: the (last) batch fails, the checkpoint must not
+        # move past it
+        with self.assertRaises(OutageLoaderError):
+            list(OutageLoader(batch_size=10).iter_new_detected_outages())
+        self.assertIsNone(db_session.get(LogCheckpoint, 'test'))
+        self.assertEqual(0, db_session.query(DetectedOutage).count())
+
+        db_session.add(DeviceOrCircuit(provider='fiberprovider',
+            service_id='IC-2', type=DoCType.circuit))
+        db_session.commit()
+        outages = OutageLoader(batch_size=10).load_new_detected_outages()
+        self.assertEqual([('IC-1', t(1), t(2)), ('IC-2', t(3), t(4))],
+                         [(o.service_id, o.begin_time, o.end_time)
+                          for o in outages])
+        self.assertEqual(os.path.getsize(self.path),
+                         db_session.get(LogCheckpoint, 'test').offset)
+
+    def test_async_failed_batch(self):
+        db_session.add(DeviceOrCircuit(provider='fiberprovider',
+            service_id='IC-1', type=DoCType.circuit))
+        db_session.commit()
+        # The 15th of 30 outages is of an unknown circuit
+        for minute in range(30):
+            self.write(line(t(1, minute), 'IC-2' if minute == 14 else 'IC-1',
+                            'DOWN'),
+                       line(t(2, minute), 'IC-2' if minute == 14 else 'IC-1',
+                            'UP'))
+            if minute == 9:
+                # Right after the UP of the 10th outage
+                offset = os.path.getsize(self.path) - 1
+
+        self.install()
+        with self.assertRaises(OutageLoaderError):
+            apoll(0, 0, batch_size=10)
+        # Only the first batch, and the position right after it
+        self.assertEqual(10, db_session.query(DetectedOutage).count())
+        self.assertEqual(offset,
+                         db_session.get(LogCheckpoint, 'test').offset)
+
+        db_session.add(DeviceOrCircuit(provider='fiberprovider',
+            service_id='IC-2', type=DoCType.circuit))
+        db_session.commit()
+        apoll(0, 0, batch_size=10)
+        self.assertEqual([t(1, minute) for minute in range(30)],
+                         [o.begin_time for o in db_session.query(
+                             DetectedOutage).order_by(DetectedOutage.id)])
+        self.assertEqual(os.path.getsize(self.path),
+                         db_session.get(LogCheckpoint, 'test').offset)
+
+
+if __name__ == '__main__':
+    unittest.main()
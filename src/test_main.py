@@ -0,0 +1,67 @@
+from datetime import datetime
+from db import db_session
+from db.device_or_circuit import DeviceOrCircuit, Type as DoCType
+from db.last_processed import LastProcessed
+from db.outage import DetectedOutage, UnscheduledOutage
+from log_loader import Outage
+from main import poll_once
+from outage_loader import OutageLoader
+from scheduled_outage_index import ScheduledOutageIndex
+from sla_handler import SLAHandler
+from unscheduled_outage_generator import UnscheduledOutageGenerator
+
+import log_loader
+import unittest
+
+
+def t(hour, minute=0):
+    return datetime(2019, 4, 9, hour, minute)
+
+
+class PollTestCase(unittest.TestCase):
+    def setUp(self):
+        db_session.query(LastProcessed).delete()
+        db_session.add(DeviceOrCircuit(provider='testprovider',
+            service_id='IC-1', type=DoCType.circuit))
+        db_session.commit()
+        self.read = 0
+        self.original = log_loader.load_outages_from_logs
+        log_loader.load_outages_from_logs = self.load_outages_from_logs
+
+    def tearDown(self):
+        log_loader.load_outages_from_logs = self.original
+        del SLAHandler._per_provider_handlers['testprovider']
+        for table in (UnscheduledOutage, DetectedOutage, LastProcessed,
+                      DeviceOrCircuit):
+            db_session.query(table).delete()
+        db_session.commit()
+        db_session.expunge_all()
+
+    # A lazy log source, counting the records read from it
+    def load_outages_from_logs(self, last_processed_time):
+        for hour in range(1, 8):
+            self.read += 1
+            yield (t(hour, 30), Outage('testprovider', 'IC-1', t(hour),
+                                       t(hour, 30), {}))
+
+    def test_streamed_in_batches(self):
+        read_when_handled = []
+        SLAHandler.register_handler('testprovider',
+            lambda outage: read_when_handled.append(self.read))
+        scheduled_index = ScheduledOutageIndex()
+        for bulk in (False, True):
+            self.read = 0
+            del read_when_handled[:]
+            db_session.query(LastProcessed).delete()
+            db_session.commit()
+            poll_once(OutageLoader(scheduled_index=scheduled_index,
+                                   batch_size=3),
+                      UnscheduledOutageGenerator(
+                          scheduled_index=scheduled_index),
+                      SLAHandler(), scheduled_index, bulk=bulk)
+            # Each batch is reported before the next one is read
+            self.assertEqual([3, 3, 3, 6, 6, 6, 7], read_when_handled)
+
+
+if __name__ == '__main__':
+    unittest.main()
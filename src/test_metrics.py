@@ -0,0 +1,54 @@
+from metrics import Metrics
+
+import json
+import unittest
+import urllib.request
+
+
+class MetricsTestCase(unittest.TestCase):
+    def test_disabled(self):
+        m = Metrics()
+        m.inc('records', stage='parse')
+        with m.timer('stage_seconds', stage='parse'):
+            pass
+        self.assertEqual({'counters': {}, 'gauges': {}, 'histograms': {}},
+                         m.snapshot())
+
+    def test_snapshot(self):
+        m = Metrics()
+        m.enable()
+        m.inc('records', 2, stage='parse')
+        m.inc('records', stage='parse')
+        m.set('backlog_lag_seconds', 5, source='log')
+        m.observe('stage_seconds', 0.002, stage='parse')
+        snapshot = m.snapshot()
+        self.assertEqual({'records{stage="parse"}': 3}, snapshot['counters'])
+        self.assertEqual({'backlog_lag_seconds{source="log"}': 5},
+                         snapshot['gauges'])
+        histogram = snapshot['histograms']['stage_seconds{stage="parse"}']
+        self.assertEqual(1, histogram['count'])
+        self.assertEqual(1, histogram['buckets']['0.005'])
+        self.assertIn('stage_seconds_bucket{stage="parse",le="0.005"} 1',
+                      m.prometheus())
+        self.assertIn('stage_seconds_bucket{stage="parse",le="+Inf"} 1',
+                      m.prometheus())
+
+    def test_serve(self):
+        m = Metrics()
+        m.enable()
+        m.inc('parse_failures')
+        server = m.serve(0)
+        try:
+            url = f'http://127.0.0.1:{server.server_address[1]}'
+            with urllib.request.urlopen(url + '/metrics') as response:
+                self.assertIn(b'parse_failures 1', response.read())
+            with urllib.request.urlopen(url + '/metrics.json') as response:
+                self.assertEqual(1, json.load(response)['counters'][
+                    'parse_failures'])
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+from datetime import datetime
+from db import db_session
+from db.device_or_circuit import DeviceOrCircuit, Type as DoCType
+from db.last_processed import LastProcessed
+from db.outage import DetectedOutage
+from log_loader import Outage
+from outage_loader import OutageLoader, OutageLoaderError
+
+import log_loader
+import unittest
+
+
+def t(hour, minute=0):
+    return datetime(2019, 4, 9, hour, minute)
+
+
+class OutageLoaderTestCase(unittest.TestCase):
+    def setUp(self):
+        db_session.query(LastProcessed).delete()
+        db_session.add(DeviceOrCircuit(provider='testprovider',
+            service_id='IC-1', type=DoCType.circuit))
+        db_session.commit()
+        # Six outages, IC-2 (not known yet) in the second batch of two
+        self.records = [
+            (t(hour, 30), Outage('testprovider',
+                'IC-2' if hour == 3 else 'IC-1', t(hour), t(hour, 30), {}))
+            for hour in range(1, 7)]
+        self.original = log_loader.load_outages_from_logs
+        log_loader.load_outages_from_logs = lambda time: \
+            [(end, outage) for (end, outage) in self.records if end > time]
+
+    def tearDown(self):
+        log_loader.load_outages_from_logs = self.original
+        for table in (DetectedOutage, LastProcessed, DeviceOrCircuit):
+            db_session.query(table).delete()
+        db_session.commit()
+        db_session.expunge_all()
+
+    def stored(self):
+        return [(o.service_id, o.begin_time) for o in
+                db_session.query(DetectedOutage).order_by(DetectedOutage.id)]
+
+    def test_resume_after_failed_batch(self):
+        loader = OutageLoader(batch_size=2)
+        with self.assertRaises(OutageLoaderError):
+            for batch in loader.iter_new_detected_outages():
+                pass
+        # The first batch and its log time are committed, nothing after it
+        self.assertEqual([('IC-1', t(1)), ('IC-1', t(2))], self.stored())
+        self.assertEqual(t(2, 30), loader.last_processed_log_time)
+
+        # Restarted once the circuit is known: each outage is stored once
+        db_session.add(DeviceOrCircuit(provider='testprovider',
+            service_id='IC-2', type=DoCType.circuit))
+        db_session.commit()
+        loader = OutageLoader(batch_size=2)
+        self.assertEqual([2, 2], [len(batch) for batch in
+                                  loader.iter_new_detected_outages()])
+        self.assertEqual([(o.service_id, o.begin) for (time, o) in
+                          self.records], self.stored())
+        self.assertEqual(t(6, 30), loader.last_processed_log_time)
+        self.assertEqual([], OutageLoader().load_new_detected_outages())
+
+
+if __name__ == '__main__':
+    unittest.main()
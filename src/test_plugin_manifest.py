@@ -0,0 +1,58 @@
+from plugin_manifest import PluginManifest
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+
+registry = {}
+
+
+class PluginManifestTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'test_plugins')
+        os.makedirs(self.path)
+        open(os.path.join(self.path, '__init__.py'), 'w').close()
+        for name in ('listed', 'unlisted'):
+            with open(os.path.join(self.path, f'{name}.py'), 'w') as f:
+                f.write('import test_plugin_manifest\n'
+                        f'test_plugin_manifest.registry["{name}@x"] = 1\n')
+        with open(os.path.join(self.path, 'manifest.json'), 'w') as f:
+            json.dump({'listed@x': 'listed'}, f)
+        sys.path.insert(0, self.directory.name)
+        registry.clear()
+
+    def tearDown(self):
+        sys.path.remove(self.directory.name)
+        for name in list(sys.modules):
+            if name.startswith('test_plugins'):
+                del sys.modules[name]
+        self.directory.cleanup()
+
+    def test_load(self):
+        manifest = PluginManifest('test_plugins', self.path)
+        self.assertEqual({}, registry)
+        self.assertTrue(manifest.load('listed@x'))
+        self.assertEqual({'listed@x'}, set(registry))
+        self.assertFalse(manifest.load('listed@x'))
+
+        # Unknown keys import the modules missing from the manifest, once
+        self.assertTrue(manifest.load('unlisted@x'))
+        self.assertEqual({'listed@x', 'unlisted@x'}, set(registry))
+        self.assertFalse(manifest.load('unknown@x'))
+
+    def test_build(self):
+        manifest = PluginManifest('test_plugins', self.path)
+        manifest.load('listed@x')
+        expected = {'listed@x': 'listed', 'unlisted@x': 'unlisted'}
+        self.assertEqual(expected, manifest.build(registry))
+        self.assertEqual(set(expected), set(registry))
+        self.assertIn('unlisted@x',
+                      PluginManifest('test_plugins', self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+from datetime import datetime, timedelta
+from db import db_session
+from db.device_or_circuit import DeviceOrCircuit, Type as DoCType
+from db.last_processed import LastProcessed
+from db.outage import DetectedOutage, ScheduledOutage, UnscheduledOutage
+from db.replay import ReplayChunk, ReplayOutage, ReplayRun
+from replay import Replay, ReplayError, replay_chunk
+from sla_handler import SLAHandler
+from unscheduled_outage_generator import UnscheduledOutageGenerator
+
+import unittest
+
+
+def t(day, hour=0):
+    return datetime(2019, 4, day, hour)
+
+
+class ReplayTestCase(unittest.TestCase):
+    def setUp(self):
+        circuit = DeviceOrCircuit(provider='testprovider',
+            service_id='IC-1', type=DoCType.circuit)
+        db_session.add(circuit)
+        db_session.flush()
+        self.circuit_id = circuit.id
+        # Classified before the scheduled outage was known
+        db_session.add_all([
+            ScheduledOutage(provider='testprovider', outage_id='PW1',
+                dev_or_circ_id=circuit.id, begin_time=t(2, 1),
+                end_time=t(2, 5)),
+            UnscheduledOutage(dev_or_circ_id=circuit.id,
+                provider='testprovider', service_id='IC-1',
+                begin_time=t(2, 2), end_time=t(2, 3), data='{}'),
+            UnscheduledOutage(dev_or_circ_id=circuit.id,
+                provider='testprovider', service_id='IC-1',
+                begin_time=t(5, 2), end_time=t(5, 3), data='{}'),
+        ])
+        db_session.add_all(
+            DetectedOutage(dev_or_circ_id=circuit.id, provider='testprovider',
+                           service_id='IC-1', begin_time=begin,
+                           end_time=begin + timedelta(hours=1), data='{}')
+            for begin in (t(1, 2), t(2, 2), t(3, 2), t(5, 2)))
+        db_session.commit()
+
+    def tearDown(self):
+        for table in (ReplayOutage, ReplayChunk, ReplayRun, UnscheduledOutage,
+                      DetectedOutage, ScheduledOutage, LastProcessed,
+                      DeviceOrCircuit):
+            db_session.query(table).delete()
+        db_session.commit()
+        db_session.expunge_all()
+
+    def unscheduled(self):
+        return [outage.begin_time for outage in db_session.query(
+            UnscheduledOutage).order_by(UnscheduledOutage.begin_time)]
+
+    def test_replay(self):
+        replay = Replay(t(1), t(4), shards=2)
+        stats = replay.run()
+        self.assertEqual((6, 6), (stats['chunks'], stats['total_chunks']))
+        self.assertEqual((3, 2), (stats['detected_outages'],
+                                  stats['unscheduled_outages']))
+        self.assertEqual({'current': 1, 'replayed': 2}, replay.diff())
+        # Not swapped yet
+        self.assertEqual([t(2, 2), t(5, 2)], self.unscheduled())
+
+        self.assertEqual({'deleted': 1, 'inserted': 2}, replay.swap())
+        # Outside of the range is left alone
+        self.assertEqual([t(1, 2), t(3, 2), t(5, 2)], self.unscheduled())
+
+    def test_split_outage_straddling_begin(self):
+        detected = DetectedOutage(dev_or_circ_id=self.circuit_id,
+            provider='testprovider', service_id='IC-1', begin_time=t(1, 22),
+            end_time=t(2, 6), data='{}')
+        db_session.add(detected)
+        db_session.commit()
+        # Split around PW1 by the poller, the second part begins in range
+        pieces = UnscheduledOutageGenerator(split_partial=True).add_if_needed(
+            [detected])
+        self.assertEqual([(t(1, 22), t(2, 1)), (t(2, 5), t(2, 6))],
+                         [(o.begin_time, o.end_time) for o in pieces])
+
+        replay = Replay(t(2), t(4), split_partial=True)
+        replay.run()
+        self.assertEqual({'current': 1, 'replayed': 1}, replay.diff())
+        self.assertEqual({'deleted': 1, 'inserted': 1}, replay.swap())
+        self.assertEqual([t(1, 22), t(2, 5), t(3, 2), t(5, 2)],
+                         self.unscheduled())
+
+    def test_resume(self):
+        replay = Replay(t(1), t(4))
+        chunk = replay.pending()[1]
+        replay_chunk(replay.run_id, chunk.begin_time, chunk.end_time,
+                     chunk.shard, 1)
+
+        # Picked up by a new Replay of the same range and options
+        resumed = Replay(t(1), t(4))
+        self.assertEqual(replay.run_id, resumed.run_id)
+        stats = resumed.run()
+        self.assertEqual((3, 3, 2), (stats['chunks'], stats['total_chunks'],
+                                     stats['detected_outages']))
+        with self.assertRaises(ReplayError):
+            Replay(t(1), t(4), restart=True).swap()
+
+        self.assertNotEqual(replay.run_id,
+                            Replay(t(1), t(4), split_partial=True).run_id)
+
+    def test_redrive(self):
+        replay = Replay(t(1), t(4))
+        replay.run()
+        outages = []
+        SLAHandler.register_handler('testprovider', self.fail)
+        try:
+            self.assertEqual({'dispatched': 2, 'no_handler': 0},
+                replay.redrive(lambda outage: outages.append(
+                    (outage.begin_time, SLAHandler.downtime(outage)))))
+        finally:
+            del SLAHandler._per_provider_handlers['testprovider']
+        self.assertEqual([t(1, 2), t(3, 2)],
+                         [begin for (begin, downtime) in outages])
+        self.assertEqual((7200.0, 2), outages[1][1].days30)
+
+    def test_behind_poller(self):
+        db_session.add(LastProcessed(name='log', time=t(3)))
+        db_session.commit()
+        with self.assertRaises(ReplayError):
+            Replay(t(1), t(4))
+        Replay(t(1), t(3))
+
+
+if __name__ == '__main__':
+    unittest.main()
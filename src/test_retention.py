@@ -0,0 +1,82 @@
+from datetime import date, datetime
+from db import db_session
+from db.device_or_circuit import DeviceOrCircuit, Type as DoCType
+from db.outage import DetectedOutage, DetectedOutageRollup
+from db.partitions import partition_ddl, partitioned_table
+from retention import RetentionJob
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateTable
+
+import unittest
+
+
+class RetentionTestCase(unittest.TestCase):
+    def setUp(self):
+        circuit = DeviceOrCircuit(provider='testprovider',
+            service_id='IC-1', type=DoCType.circuit)
+        db_session.add(circuit)
+        db_session.flush()
+        self.circuit_id = circuit.id
+        db_session.add_all([
+            DetectedOutage(dev_or_circ_id=circuit.id, provider='testprovider',
+                service_id='IC-1', begin_time=begin, end_time=end, data='{}')
+            for (begin, end) in [
+                (datetime(2019, 4, 9, 23, 30), datetime(2019, 4, 10, 0, 30)),
+                (datetime(2019, 4, 10, 6), datetime(2019, 4, 10, 6, 10)),
+                (datetime(2019, 6, 1, 6), datetime(2019, 6, 1, 7))]])
+        db_session.commit()
+        self.job = RetentionJob(detected_days=30,
+                                clock=lambda: datetime(2019, 6, 2))
+
+    def tearDown(self):
+        for table in (DetectedOutageRollup, DetectedOutage, DeviceOrCircuit):
+            db_session.query(table).delete()
+        db_session.commit()
+        db_session.expunge_all()
+
+    def rollups(self):
+        return [(r.day, r.outages, r.downtime_seconds) for r in
+                db_session.query(DetectedOutageRollup).order_by(
+                    DetectedOutageRollup.day)]
+
+    def test_compact(self):
+        self.assertEqual({'detected_outages': 2}, self.job.run())
+        self.assertEqual([(date(2019, 4, 9), 1, 1800),
+                          (date(2019, 4, 10), 1, 2400)], self.rollups())
+        self.assertEqual([datetime(2019, 6, 1, 6)], [o.begin_time
+            for o in db_session.query(DetectedOutage)])
+
+        # Rolled up again later
+        RetentionJob(detected_days=0,
+                     clock=lambda: datetime(2019, 6, 2)).run()
+        self.assertEqual([(date(2019, 4, 9), 1, 1800),
+                          (date(2019, 4, 10), 1, 2400),
+                          (date(2019, 6, 1), 1, 3600)], self.rollups())
+        self.assertEqual(0, db_session.query(DetectedOutage).count())
+
+    def test_postgresql_partitioned_table(self):
+        ddl = str(CreateTable(partitioned_table('detected_outages')).compile(
+            dialect=postgresql.dialect()))
+        self.assertIn('PRIMARY KEY (id, begin_time)', ddl)
+        self.assertIn('PARTITION BY RANGE (begin_time)', ddl)
+        self.assertIn('SERIAL', ddl)
+
+    def test_partition_ddl(self):
+        self.assertEqual(
+            ['CREATE TABLE detected_outages_y2019m04 PARTITION OF '
+             "detected_outages FOR VALUES FROM ('2019-04-01 00:00:00') "
+             "TO ('2019-05-01 00:00:00')"],
+            partition_ddl('detected_outages', datetime(2019, 4, 1)))
+        # Rows of the month in the default partition are moved first
+        (create, move, attach) = partition_ddl('detected_outages',
+            datetime(2019, 12, 1), default=True)
+        self.assertIn('(LIKE detected_outages', create)
+        self.assertIn('DELETE FROM detected_outages_default', move)
+        self.assertIn("begin_time < '2020-01-01 00:00:00'", move)
+        self.assertTrue(attach.startswith('ALTER TABLE detected_outages '
+                                          'ATTACH PARTITION '
+                                          'detected_outages_y2019m12'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta
+from rolling_downtime import Downtime, RollingDowntime, WindowTotals
+
+import unittest
+
+
+class RollingDowntimeTestCase(unittest.TestCase):
+    def test_windows(self):
+        downtime = RollingDowntime()
+        downtime.record('p', 1, datetime(2019, 4, 1, 10),
+                        datetime(2019, 4, 1, 11))
+        downtime.record('p', 1, datetime(2019, 4, 20, 10, 50),
+                        datetime(2019, 4, 20, 11))
+        downtime.record('p', 2, datetime(2019, 4, 30, 23, 0),
+                        datetime(2019, 4, 30, 23, 30))
+        self.assertEqual(Downtime(WindowTotals(0.0, 0),
+                                  WindowTotals(4200.0, 2),
+                                  WindowTotals(4200.0, 2),
+                                  datetime(2019, 4, 30, 23, 30)),
+                         downtime.get('p', 1))
+        self.assertEqual(WindowTotals(1800.0, 1), downtime.get('p', 2).day)
+
+        # A new month, the first outage of p/1 slides out of the 30 days
+        downtime.record('p', 1, datetime(2019, 5, 1, 11, 59),
+                        datetime(2019, 5, 1, 12))
+        view = downtime.get('p', 1)
+        self.assertEqual(WindowTotals(60.0, 1), view.day)
+        self.assertEqual(WindowTotals(660.0, 2), view.days30)
+        self.assertEqual(WindowTotals(60.0, 1), view.month)
+        self.assertEqual(WindowTotals(0.0, 0), downtime.get('p', 2).month)
+        self.assertEqual(WindowTotals(0.0, 0), downtime.get('p', 3).days30)
+
+    def test_bounded_without_reads(self):
+        downtime = RollingDowntime()
+        # An hourly outage of device/circuit 0, and of a new one, for a year
+        start = datetime(2019, 1, 1)
+        for hour in range(365 * 24):
+            begin = start + timedelta(hours=hour)
+            downtime.record('p', 0, begin, begin + timedelta(minutes=1))
+            downtime.record('p', hour + 1, begin, begin + timedelta(minutes=1))
+        counters = downtime._counters[('p', 0)]
+        self.assertEqual((24, 30 * 24), (len(counters.day),
+                                         len(counters.days30)))
+        # The last 30 days and the month, plus at most one sweep interval
+        self.assertLessEqual(len(downtime), 1 + 31 * 24 + 24)
+        self.assertEqual(WindowTotals(24 * 60.0, 24), downtime.get('p', 0).day)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+from datetime import datetime
+from db import db_session
+from db.device_or_circuit import DeviceCircuits
+from db.outage import ScheduledOutage
+from device_circuit_topology import DeviceCircuitTopology
+from scheduled_outage_index import ScheduledOutageIndex
+from sqlalchemy import text
+
+import unittest
+
+
+class ScheduledOutageIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        db_session.add_all([
+            ScheduledOutage(provider='fiberprovider', outage_id='PW1',
+                dev_or_circ_id=1, begin_time=datetime(2019, 4, 9, 6),
+                end_time=datetime(2019, 4, 9, 10)),
+            ScheduledOutage(provider='fiberprovider', outage_id='PW2',
+                dev_or_circ_id=1, begin_time=datetime(2019, 4, 9, 1),
+                end_time=datetime(2019, 4, 9, 2)),
+        ])
+        db_session.commit()
+        self.index = ScheduledOutageIndex()
+        self.index.load()
+
+    def tearDown(self):
+        db_session.query(ScheduledOutage).delete()
+        db_session.query(DeviceCircuits).delete()
+        db_session.commit()
+
+    def test_contains(self):
+        self.assertEqual(2, len(self.index))
+        self.assertTrue(self.index.contains('fiberprovider', 1,
+            datetime(2019, 4, 9, 6, 5), datetime(2019, 4, 9, 6, 45)))
+        self.assertTrue(self.index.contains('fiberprovider', 1,
+            datetime(2019, 4, 9, 1), datetime(2019, 4, 9, 2)))
+        self.assertFalse(self.index.contains('fiberprovider', 1,
+            datetime(2019, 4, 9, 1), datetime(2019, 4, 9, 2, 10)))
+        self.assertFalse(self.index.contains('fiberprovider', 1,
+            datetime(2019, 4, 9, 11, 5), datetime(2019, 4, 9, 11, 25)))
+        self.assertFalse(self.index.contains('fiberprovider', 2,
+            datetime(2019, 4, 9, 6, 5), datetime(2019, 4, 9, 6, 45)))
+        self.assertFalse(self.index.contains('otherprovider', 1,
+            datetime(2019, 4, 9, 6, 5), datetime(2019, 4, 9, 6, 45)))
+
+    def test_add_remove(self):
+        self.assertTrue(self.index.remove('fiberprovider', 'PW1'))
+        self.assertFalse(self.index.remove('fiberprovider', 'PW1'))
+        self.assertFalse(self.index.contains('fiberprovider', 1,
+            datetime(2019, 4, 9, 6, 5), datetime(2019, 4, 9, 6, 45)))
+        self.index.add(ScheduledOutage(provider='fiberprovider',
+            outage_id='PW3', dev_or_circ_id=1,
+            begin_time=datetime(2019, 4, 9, 6),
+            end_time=datetime(2019, 4, 9, 7)))
+        self.assertTrue(self.index.contains('fiberprovider', 1,
+            datetime(2019, 4, 9, 6, 5), datetime(2019, 4, 9, 6, 45)))
+
+    def test_topology(self):
+        now = [0]
+        topology = DeviceCircuitTopology(max_age=60, clock=lambda: now[0])
+        db_session.add(DeviceCircuits(devid=10, circid=20))
+        db_session.commit()
+        self.assertEqual({20}, topology.circuits(10))
+        version = topology.version
+
+        # Bulk writes through a session are seen right away
+        db_session.query(DeviceCircuits).delete()
+        db_session.commit()
+        self.assertEqual(frozenset(), topology.devices(20))
+        self.assertGreater(topology.version, version)
+
+        # Writes around the session (e.g. other processes) after max_age
+        db_session.execute(text(
+            'INSERT INTO device_circuits (devid, circid) VALUES (10, 21)'))
+        db_session.commit()
+        self.assertEqual(frozenset(), topology.circuits(10))
+        now[0] = 60
+        self.assertEqual({21}, topology.circuits(10))
+
+
+if __name__ == '__main__':
+    unittest.main()
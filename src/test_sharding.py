@@ -0,0 +1,206 @@
+from datetime import datetime, timedelta
+from db import db_session
+from db.device_or_circuit import DeviceOrCircuit, Type as DoCType
+from db.last_processed import LastProcessed
+from db.lease import WorkerLease
+from db.outage import DetectedOutage, ScheduledOutage, UnscheduledOutage
+from log_loader import Outage
+from main import poll_once
+from outage_loader import LeaseLostError, OutageLoader
+from scheduled_outage_index import ScheduledOutageIndex
+from sharding import LeaseManager, Shard, sharded_poll
+from sla_handler import SLAHandler
+from unscheduled_outage_generator import UnscheduledOutageGenerator
+
+import helpdesk
+import log_loader
+import unittest
+
+
+class Clock:
+    def __init__(self):
+        self.now = datetime(2019, 4, 9, 6, 0)
+
+    def __call__(self):
+        return self.now
+
+
+def t(minute):
+    return datetime(2019, 4, 9, 6, minute)
+
+
+class ShardingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.shards = [Shard(0, 2), Shard(1, 2)]
+        LeaseManager.create_leases(self.shards)
+
+    def tearDown(self):
+        for table in (DetectedOutage, LastProcessed, WorkerLease,
+                      DeviceOrCircuit):
+            db_session.query(table).delete()
+        db_session.commit()
+        db_session.expunge_all()
+
+    def test_owns(self):
+        shards = [Shard(i, 4) for i in range(4)]
+        for provider in ('fiberprovider', 'testprovider', 'provider7'):
+            self.assertEqual(1, sum(shard.owns(provider) for shard in shards))
+        self.assertEqual('1/4', shards[1].name)
+
+    def test_leases(self):
+        clock = Clock()
+        a = LeaseManager('a', self.shards, self.shards[:1], ttl=60,
+                         clock=clock)
+        b = LeaseManager('b', self.shards, self.shards[1:], ttl=60,
+                         clock=clock)
+        self.assertEqual(self.shards[:1], a.acquire())
+        self.assertEqual(self.shards[1:], b.acquire())
+
+        # b stops renewing, a takes over its shard once the lease expires
+        clock.now += timedelta(seconds=30)
+        self.assertEqual(self.shards[:1], a.acquire())
+        clock.now += timedelta(seconds=31)
+        self.assertEqual(self.shards, a.acquire())
+        self.assertFalse(b.renew(self.shards[1]))
+
+        # b gets its home shard back once a lets it go
+        self.assertEqual([], b.acquire())
+        a.release()
+        self.assertEqual(self.shards[1:], b.acquire())
+        self.assertEqual(self.shards[:1], a.acquire())
+
+    def test_lease_checked_before_commit(self):
+        db_session.add(DeviceOrCircuit(provider='provider7',
+            service_id='IC-1', type=DoCType.circuit))
+        db_session.commit()
+        clock = Clock()
+        a = LeaseManager('a', self.shards, self.shards[:1], ttl=60,
+                         clock=clock)
+        b = LeaseManager('b', self.shards, self.shards[1:], ttl=60,
+                         clock=clock)
+        a.acquire()
+        loader = OutageLoader(shard=self.shards[0],
+            lease=lambda: a.renew(self.shards[0], commit=False))
+        self.assertEqual(1, len(loader.store_log_records(
+            [(t(1), Outage('provider7', 'IC-1', t(0), t(1), {}))])))
+
+        # a stalls past its lease, b takes the shard over
+        clock.now += timedelta(seconds=61)
+        self.assertEqual(self.shards, b.acquire())
+        with self.assertRaises(LeaseLostError):
+            loader.store_log_records(
+                [(t(2), Outage('provider7', 'IC-1', t(1), t(2), {}))])
+        self.assertEqual(1, db_session.query(DetectedOutage).count())
+        self.assertEqual([], a.held)
+
+    def test_renew_while_sleeping(self):
+        a = LeaseManager('a', self.shards, self.shards, ttl=0.03)
+        a.acquire()
+        expires = db_session.query(WorkerLease.expires).filter(
+            WorkerLease.shard == '0/2').scalar()
+        a.sleep(0.05)
+        self.assertLess(expires, db_session.query(WorkerLease.expires).filter(
+            WorkerLease.shard == '0/2').scalar())
+
+    def test_sharded_loaders(self):
+        for service_id in ('IC-1', 'IC-2'):
+            for provider in ('fiberprovider', 'testprovider', 'provider7'):
+                db_session.add(DeviceOrCircuit(provider=provider,
+                    service_id=service_id, type=DoCType.circuit))
+        db_session.commit()
+        records = [(t(i + 1), Outage(provider, service_id, t(i), t(i + 1), {}))
+                   for (i, (provider, service_id)) in enumerate(
+                       (provider, service_id)
+                       for service_id in ('IC-1', 'IC-2')
+                       for provider in ('fiberprovider', 'testprovider',
+                                        'provider7'))]
+
+        def load_outages_from_logs(last_processed_time):
+            return [record for record in records
+                    if record[0] > last_processed_time]
+
+        original = log_loader.load_outages_from_logs
+        log_loader.load_outages_from_logs = load_outages_from_logs
+        try:
+            stored = []
+            for shard in self.shards:
+                loader = OutageLoader(shard=shard)
+                for outages in loader.iter_new_detected_outages():
+                    stored += [(outage.provider, outage.service_id)
+                               for outage in outages]
+                    self.assertTrue(all(shard.owns(outage.provider)
+                                        for outage in outages))
+                # Past the records of the other shard too
+                self.assertEqual(t(6), loader.last_processed_log_time)
+        finally:
+            log_loader.load_outages_from_logs = original
+
+        self.assertEqual(sorted((outage.provider, outage.service_id)
+                                for (time, outage) in records), sorted(stored))
+
+    def test_shard_source(self):
+        db_session.add(DeviceOrCircuit(provider='provider7',
+            service_id='IC-1', type=DoCType.circuit))
+        db_session.commit()
+        calls = []
+
+        # Filtered by the log store: only the outages of the shard
+        def load_shard_outages_from_logs(last_processed_time, shard):
+            calls.append((last_processed_time, shard))
+            if shard.owns('provider7') and last_processed_time < t(1):
+                yield (t(1), Outage('provider7', 'IC-1', t(0), t(1), {}))
+
+        original = log_loader.load_shard_outages_from_logs
+        log_loader.load_shard_outages_from_logs = load_shard_outages_from_logs
+        try:
+            for shard in self.shards:
+                OutageLoader(shard=shard).load_new_detected_outages()
+        finally:
+            log_loader.load_shard_outages_from_logs = original
+        self.assertEqual([(OutageLoader.epoch, shard) for shard in self.shards],
+                         calls)
+        self.assertEqual(1, db_session.query(DetectedOutage).count())
+
+    def test_email_and_outage_in_same_poll(self):
+        db_session.add(DeviceOrCircuit(provider='fiberprovider',
+            service_id='IC-99999', type=DoCType.circuit))
+        db_session.commit()
+        with open('../data/provider_email.txt') as f:
+            email = (datetime(2019, 4, 8), 'noc@fiberprovider.com', f.read())
+        alerts = []
+        SLAHandler.register_handler('fiberprovider', alerts.append)
+        originals = (helpdesk.load_new_emails, log_loader.load_outages_from_logs)
+        helpdesk.load_new_emails = lambda time: \
+            [email] if time < email[0] else []
+        log_loader.load_outages_from_logs = lambda time: \
+            [(t(45), Outage('fiberprovider', 'IC-99999', t(5), t(45), {}))] \
+            if time < t(45) else []
+        try:
+            # The email is in the shard of the outage it schedules, which
+            # polls first
+            for n in (2, 3, 4, 8):
+                shards = sorted((Shard(i, n) for i in range(n)),
+                    key=lambda shard: not shard.owns('fiberprovider'))
+                for shard in shards:
+                    index = ScheduledOutageIndex()
+                    poll_once(OutageLoader(scheduled_index=index, shard=shard),
+                              UnscheduledOutageGenerator(scheduled_index=index),
+                              SLAHandler(), index)
+                self.assertEqual(0, db_session.query(UnscheduledOutage).count())
+                self.assertEqual(1, db_session.query(ScheduledOutage).count())
+                for table in (DetectedOutage, ScheduledOutage, LastProcessed):
+                    db_session.query(table).delete()
+                db_session.commit()
+        finally:
+            (helpdesk.load_new_emails, log_loader.load_outages_from_logs) = \
+                originals
+            del SLAHandler._per_provider_handlers['fiberprovider']
+        self.assertEqual([], alerts)
+
+    def test_in_memory_database(self):
+        with self.assertRaises(ValueError):
+            sharded_poll(2, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta
+from db import db_session, engine
+from db.device_or_circuit import DeviceOrCircuit, Type as DoCType
+from db.outage import DetectedOutage, UnscheduledOutage
+from sla_handler import SLAHandler
+from unscheduled_outage_generator import UnscheduledOutageGenerator
+
+from sqlalchemy import event
+
+import unittest
+
+
+class SLAHandlerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.circuits = [DeviceOrCircuit(provider='testprovider',
+                service_id=f'IC-{i}', type=DoCType.circuit)
+            for i in range(5)]
+        db_session.add_all(self.circuits)
+        db_session.commit()
+        self.alerts = []
+        SLAHandler.register_handler('testprovider', self.handle)
+        SLAHandler.load_downtime()
+
+    def tearDown(self):
+        for table in (UnscheduledOutage, DetectedOutage, DeviceOrCircuit):
+            db_session.query(table).delete()
+        db_session.commit()
+        db_session.expunge_all()
+
+    def handle(self, outage):
+        self.alerts.append((outage.provider, outage.service_id,
+                            outage.device_or_circuit.service_id))
+
+    def unscheduled_outages(self, count, core=False):
+        begin = datetime(2019, 4, 9)
+        detected = [DetectedOutage(dev_or_circ_id=self.circuits[i % 5].id,
+                provider=self.circuits[i % 5].provider,
+                service_id=self.circuits[i % 5].service_id, begin_time=begin + timedelta(hours=i),
+                end_time=begin + timedelta(hours=i, minutes=5), data='{}')
+            for i in range(count)]
+        db_session.add_all(detected)
+        db_session.commit()
+        return UnscheduledOutageGenerator(core=core).add_if_needed_bulk(
+            detected)
+
+    def count_queries(self, func):
+        statements = []
+
+        def before_cursor_execute(*args):
+            statements.append(args[2])
+
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            func()
+        finally:
+            event.remove(engine, 'before_cursor_execute',
+                         before_cursor_execute)
+        return len(statements)
+
+    def test_provider_copied(self):
+        (outage,) = self.unscheduled_outages(1)
+        self.assertEqual(('testprovider', 'IC-0'),
+                         (outage.provider, outage.service_id))
+
+    def test_constant_queries(self):
+        counts = []
+        for count in (5, 50):
+            outages = self.unscheduled_outages(count)
+            counts.append(self.count_queries(
+                lambda: SLAHandler.handle_unscheduled_outages(outages)))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(('testprovider', 'IC-4', 'IC-4'), self.alerts[-1])
+        self.assertEqual(55, len(self.alerts))
+
+    def test_records(self):
+        SLAHandler.handle_unscheduled_outages(
+            self.unscheduled_outages(5, core=True))
+        self.assertEqual(('testprovider', 'IC-4', 'IC-4'), self.alerts[-1])
+
+        # A dispatcher gets snapshots, no UnscheduledOutages are loaded
+        SLAHandler.register_handler('testprovider', lambda outage:
+            self.alerts.append((outage.provider, outage.service_id)))
+        SLAHandler.start_dispatcher(workers=1, window=0, max_attempts=1)
+        try:
+            outages = self.unscheduled_outages(5, core=True)
+            self.assertEqual(0, self.count_queries(
+                lambda: SLAHandler.handle_unscheduled_outages(outages)))
+        finally:
+            SLAHandler.stop_dispatcher()
+        self.assertEqual(10, len(self.alerts))
+        self.assertIn(('testprovider', 'IC-4'), self.alerts)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+from datetime import datetime, timedelta
+from db import db_session
+from db.device_or_circuit import DeviceCircuits, DeviceOrCircuit, Type as DoCType
+from db.outage import DetectedOutage, ScheduledOutage, UnscheduledOutage
+from db.records import DetectedRecord, UnscheduledRecord
+from scheduled_outage_index import ScheduledOutageIndex
+from unscheduled_outage_generator import UnscheduledOutageGenerator
+
+import unittest
+
+
+def t(hour, minute=0):
+    return datetime(2019, 4, 9, hour, minute)
+
+
+class UnscheduledOutageGeneratorTestCase(unittest.TestCase):
+    def setUp(self):
+        circuit = DeviceOrCircuit(provider='testprovider',
+            service_id='IC-1', type=DoCType.circuit)
+        self.device = DeviceOrCircuit(provider='testprovider',
+            service_id='SW-1', type=DoCType.device)
+        db_session.add_all([circuit, self.device])
+        db_session.flush()
+        self.circuit_id = circuit.id
+        db_session.add_all([
+            ScheduledOutage(provider='testprovider', outage_id='PW1',
+                dev_or_circ_id=circuit.id, begin_time=t(1),
+                end_time=t(2)),
+            ScheduledOutage(provider='testprovider', outage_id='PW2',
+                dev_or_circ_id=circuit.id, begin_time=t(3),
+                end_time=t(4)),
+        ])
+        self.detected = [
+            DetectedOutage(dev_or_circ_id=circuit.id, provider='testprovider',
+                service_id='IC-1', begin_time=begin, end_time=end, data='{}')
+            for (begin, end) in [(t(1, 5), t(1, 45)), (t(1), t(2, 10)),
+                                 (t(0, 30), t(4, 30)), (t(5), t(6))]]
+        db_session.add_all(self.detected)
+        db_session.commit()
+        self.index = ScheduledOutageIndex()
+        self.index.load()
+
+    def tearDown(self):
+        for table in (UnscheduledOutage, DetectedOutage, ScheduledOutage,
+                      DeviceCircuits, DeviceOrCircuit):
+            db_session.query(table).delete()
+        db_session.commit()
+        db_session.expunge_all()
+
+    def intervals(self, outages):
+        return [(o.begin_time, o.end_time) for o in outages]
+
+    def test_whole_outages(self):
+        expected = [(t(1), t(2, 10)), (t(0, 30), t(4, 30)), (t(5), t(6))]
+        for gen in (UnscheduledOutageGenerator(),
+                    UnscheduledOutageGenerator(scheduled_index=self.index)):
+            self.assertEqual(expected,
+                self.intervals(gen.add_if_needed(self.detected)))
+        self.assertEqual(expected, self.intervals(
+            UnscheduledOutageGenerator().add_if_needed_bulk(self.detected)))
+
+    def test_core(self):
+        records = [DetectedRecord(o.id, o.dev_or_circ_id, 'testprovider',
+                'IC-1', o.begin_time, o.end_time, o.data)
+            for o in self.detected]
+        result = UnscheduledOutageGenerator(core=True).add_if_needed(records)
+        self.assertEqual([(t(1), t(2, 10)), (t(0, 30), t(4, 30)), (t(5), t(6))],
+                         self.intervals(result))
+        self.assertIsInstance(result[0], UnscheduledRecord)
+        self.assertEqual(('testprovider', 'IC-1'), (result[0].provider,
+                                                    result[0].service_id))
+        self.assertEqual(result[0].begin_time,
+            db_session.get(UnscheduledOutage, result[0].id).begin_time)
+
+    def test_horizon(self):
+        # PW1 begins more than 2 minutes before the first detected outage
+        gen = UnscheduledOutageGenerator(horizon=timedelta(minutes=2))
+        self.assertFalse(gen.outage_is_scheduled(self.detected[0]))
+        self.assertEqual((t(1, 5), t(1, 45)), self.intervals(
+            gen.add_if_needed_bulk(self.detected[:1]))[0])
+        gen = UnscheduledOutageGenerator(horizon=timedelta(minutes=5))
+        self.assertTrue(gen.outage_is_scheduled(self.detected[0]))
+
+    def test_split_partial(self):
+        expected = [(t(2), t(2, 10)), (t(0, 30), t(1)), (t(2), t(3)),
+                    (t(4), t(4, 30)), (t(5), t(6))]
+        for gen in (UnscheduledOutageGenerator(split_partial=True),
+                    UnscheduledOutageGenerator(scheduled_index=self.index,
+                                               split_partial=True)):
+            self.assertEqual(expected,
+                self.intervals(gen.add_if_needed(self.detected)))
+            self.assertEqual(expected,
+                self.intervals(gen.add_if_needed_bulk(self.detected)))
+
+
+    def test_device_outage_covers_circuits(self):
+        db_session.add_all([
+            DeviceCircuits(devid=self.device.id, circid=self.circuit_id),
+            ScheduledOutage(provider='testprovider', outage_id='PW3',
+                dev_or_circ_id=self.device.id, begin_time=t(2),
+                end_time=t(3)),
+        ])
+        db_session.commit()
+        self.index.load()
+
+        expected = [(t(0, 30), t(1)), (t(4), t(4, 30)), (t(5), t(6))]
+        for gen in (UnscheduledOutageGenerator(split_partial=True),
+                    UnscheduledOutageGenerator(scheduled_index=self.index,
+                                               split_partial=True)):
+            self.assertEqual(expected,
+                self.intervals(gen.add_if_needed(self.detected)))
+            self.assertEqual(expected,
+                self.intervals(gen.add_if_needed_bulk(self.detected)))
+
+        detected = DetectedOutage(dev_or_circ_id=self.circuit_id,
+            provider='testprovider', service_id='IC-1', begin_time=t(2, 5),
+            end_time=t(2, 50), data='{}')
+        db_session.add(detected)
+        db_session.commit()
+        expected = [(t(1), t(2, 10)), (t(0, 30), t(4, 30)), (t(5), t(6))]
+        for gen in (UnscheduledOutageGenerator(),
+                    UnscheduledOutageGenerator(scheduled_index=self.index)):
+            self.assertEqual(expected, self.intervals(
+                gen.add_if_needed(self.detected + [detected])))
+        self.assertEqual(expected, self.intervals(
+            UnscheduledOutageGenerator().add_if_needed_bulk(
+                self.detected + [detected])))
+
+    def test_device_outage_only_covers_its_circuits(self):
+        # The DeviceCircuits subquery must be correlated to each detected
+        # outage, not match any device with a scheduled outage
+        other = DeviceOrCircuit(provider='testprovider', service_id='IC-2',
+                                type=DoCType.circuit)
+        db_session.add(other)
+        db_session.flush()
+        detected = DetectedOutage(dev_or_circ_id=other.id,
+            provider='testprovider', service_id='IC-2', begin_time=t(2, 5),
+            end_time=t(2, 50), data='{}')
+        db_session.add_all([
+            DeviceCircuits(devid=self.device.id, circid=self.circuit_id),
+            ScheduledOutage(provider='testprovider', outage_id='PW3',
+                dev_or_circ_id=self.device.id, begin_time=t(2),
+                end_time=t(3)),
+            detected,
+        ])
+        db_session.commit()
+        self.index.load()
+
+        for gen in (UnscheduledOutageGenerator(),
+                    UnscheduledOutageGenerator(split_partial=True),
+                    UnscheduledOutageGenerator(scheduled_index=self.index)):
+            self.assertEqual([(t(2, 5), t(2, 50))], self.intervals(
+                gen.add_if_needed([detected])))
+            self.assertEqual([(t(2, 5), t(2, 50))], self.intervals(
+                gen.add_if_needed_bulk(self.detected[:1] + [detected])))
+
+
+if __name__ == '__main__':
+    unittest.main()
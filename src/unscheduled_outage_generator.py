@@ -1,6 +1,29 @@
 from db import db_session
 from db.device_or_circuit import Type as DoCType
 from db.outage import *
+from db.records import DetectedRecord, insert_records
+from db.temp_ids import load_instances, load_temp_ids
+
+from intervals import merge_intervals, subtract_intervals
+from metrics import metrics
+
+from sqlalchemy import and_, exists, inspect, or_, select, true
+
+
+"""SQL condition for scheduled outages of a device/circuit.
+
+Matches scheduled outages of the device/circuit itself and of the devices
+it depends on (DeviceCircuits).
+
+Args:
+    dev_or_circ_id (int)
+"""
+def _scheduled_for(dev_or_circ_id):
+    devices = select(DeviceCircuits.devid).where(
+        DeviceCircuits.circid == dev_or_circ_id)
+    return or_(ScheduledOutage.dev_or_circ_id == dev_or_circ_id,
+               ScheduledOutage.dev_or_circ_id.in_(devices))
+
 
 """Populates the UnscheduledOutage table.
 
@@ -8,24 +31,189 @@ Uses the detected outages as well as scheduled outages to generate
 the UnscheduledOutage table.
 """
 class UnscheduledOutageGenerator:
+    """Constructor.
+
+    Args:
+        scheduled_index (ScheduledOutageIndex): optional in memory index
+            used instead of querying the ScheduledOutage table for each
+            detected outage.
+        split_partial (bool): if True, a detected outage that is only
+            partly scheduled produces UnscheduledOutages for the parts
+            outside the scheduled outages instead of being unscheduled
+            as a whole.
+        horizon (timedelta): if given, scheduled outages beginning more
+            than `horizon` before a detected outage are not considered,
+            so the queries only touch recent (partitions of the)
+            scheduled outages. Must exceed the longest scheduled outage.
+        core (bool): insert the unscheduled outages with a single Core
+            INSERT and return them as UnscheduledRecords instead of
+            UnscheduledOutages, see db.records.insert_records. Implies
+            the set based pass of add_if_needed_bulk.
+    """
+    def __init__(self, scheduled_index=None, split_partial=False,
+                 horizon=None, core=False):
+        self._scheduled_index = scheduled_index
+        self._split_partial = split_partial
+        self._horizon = horizon
+        self._core = core
+
+    def _recent(self, begin):
+        if self._horizon is None or begin is None:
+            return true()
+        return ScheduledOutage.begin_time >= begin - self._horizon
+
     """Add unscheduled outages as needed.
 
     Args:
-        list[DetectedOutage]
+        list[DetectedOutage or DetectedRecord]
 
     Returns:
-        list[UnscheduledOutage]: newly created UnscheduledOutages
+        list[UnscheduledOutage]: newly created UnscheduledOutages, or
+            list[UnscheduledRecord] with `core`
     """
     def add_if_needed(self, detected_outages):
+        if self._core:
+            return self.add_if_needed_bulk(detected_outages)
+
         result = []
-        for outage in detected_outages:
-            if not self.outage_is_scheduled(outage):
-                result.append(self.create_unscheduled_outage(outage))
+        with metrics.timer('stage_seconds', stage='classify'):
+            for outage in detected_outages:
+                if self._split_partial:
+                    for (begin, end) in self.unscheduled_intervals(outage):
+                        result.append(
+                            self.create_unscheduled_outage(outage, begin, end))
+                elif not self.outage_is_scheduled(outage):
+                    result.append(self.create_unscheduled_outage(outage))
+        metrics.inc('records', len(detected_outages), stage='classify')
+        metrics.inc('unscheduled_outages', len(result))
+        return result
+
+    """Add unscheduled outages as needed, as a single set based pass.
+
+    Same result as add_if_needed, but the detected outages are classified
+    with one anti-join against the ScheduledOutage table and all of the
+    new UnscheduledOutages are inserted with a single commit.
+
+    Args:
+        list[DetectedOutage or DetectedRecord]
+
+    Returns:
+        list[UnscheduledOutage]: newly created UnscheduledOutages, or
+            list[UnscheduledRecord] with `core`
+    """
+    def add_if_needed_bulk(self, detected_outages):
+        with metrics.timer('stage_seconds', stage='classify'):
+            result = self._add_if_needed_bulk(detected_outages)
+        metrics.inc('records', len(detected_outages), stage='classify')
+        metrics.inc('unscheduled_outages', len(result))
         return result
 
+    def _add_if_needed_bulk(self, detected_outages):
+        db_session.flush()
+        if detected_outages and isinstance(detected_outages[0],
+                                           DetectedRecord):
+            ids = load_temp_ids(db_session,
+                (outage.id for outage in detected_outages))
+        else:
+            load_instances(db_session, detected_outages)
+            ids = load_temp_ids(db_session,
+                (inspect(outage).identity[0] for outage in detected_outages))
+
+        # Driven by the ids, so the cost does not grow with the table
+        result = self.unscheduled_rows(DetectedOutage.id.in_(select(ids.c.id)),
+            min((outage.begin_time for outage in detected_outages),
+                default=None))
+        if self._core:
+            result = insert_records(db_session, UnscheduledOutage, result)
+        else:
+            result = [UnscheduledOutage(**row) for row in result]
+            db_session.add_all(result)
+        db_session.commit()
+        return result
+
+    """Classify stored detected outages without storing anything.
+
+    The set based pass of add_if_needed_bulk, for any selection of
+    detected outages, e.g. a time range to re-classify (see replay.py).
+
+    Args:
+        condition: SQL expression selecting DetectedOutages
+        begin (datetime): earliest begin time of the selected outages,
+                          bounds the scheduled outages considered with
+                          `horizon`
+
+    Returns:
+        list[dict]: UnscheduledOutage columns, in order of DetectedOutage.id
+    """
+    def unscheduled_rows(self, condition, begin=None):
+        # Scheduled outages of the device/circuit itself, and of the devices
+        # it depends on, as separate EXISTS so each can use an index
+        covers = and_(
+            ScheduledOutage.provider == DetectedOutage.provider,
+            ScheduledOutage.begin_time <= DetectedOutage.begin_time,
+            ScheduledOutage.end_time >= DetectedOutage.end_time,
+            self._recent(begin))
+        scheduled = or_(
+            exists().where(covers).where(
+                ScheduledOutage.dev_or_circ_id == DetectedOutage.dev_or_circ_id),
+            exists().where(covers).where(ScheduledOutage.dev_or_circ_id.in_(
+                select(DeviceCircuits.devid).where(
+                DeviceCircuits.circid == DetectedOutage.dev_or_circ_id
+                ).correlate_except(DeviceCircuits))))
+
+        rows = db_session.query(DetectedOutage.id, DetectedOutage.provider,
+            DetectedOutage.service_id, DetectedOutage.dev_or_circ_id,
+            DetectedOutage.begin_time, DetectedOutage.end_time,
+            DetectedOutage.data).filter(condition).filter(
+            DetectedOutage.dev_or_circ_id.isnot(None)).filter(
+            ~scheduled).order_by(DetectedOutage.id)
+
+        result = []
+        for (detected_id, provider, service_id, dev_or_circ_id, begin, end,
+                data) in rows:
+            if self._split_partial:
+                intervals = self._uncovered(provider, dev_or_circ_id,
+                    begin, end)
+            else:
+                intervals = [(begin, end)]
+            result.extend(dict(dev_or_circ_id=dev_or_circ_id,
+                    provider=provider, service_id=service_id,
+                    begin_time=begin, end_time=end, data=data,
+                    detected_id=detected_id)
+                for (begin, end) in intervals)
+        return result
+
+    """Find the parts of a detected outage that are not scheduled.
+
+    Args:
+        outage (DetectedOutage)
+
+    Returns:
+        list[(datetime, datetime)]: unscheduled parts, in order
+    """
+    def unscheduled_intervals(self, outage):
+        return self._uncovered(outage.provider, outage.dev_or_circ_id,
+            outage.begin_time, outage.end_time)
+
+    def _uncovered(self, provider, dev_or_circ_id, begin, end):
+        if self._scheduled_index is not None:
+            return self._scheduled_index.uncovered(provider, dev_or_circ_id,
+                begin, end)
+
+        windows = db_session.query(ScheduledOutage.begin_time,
+            ScheduledOutage.end_time).filter(
+            ScheduledOutage.provider == provider).filter(
+            _scheduled_for(dev_or_circ_id)).filter(
+            ScheduledOutage.begin_time <= end).filter(
+            ScheduledOutage.end_time >= begin).filter(
+            self._recent(begin))
+        return subtract_intervals(begin, end, merge_intervals(windows))
+
     """Check if a detected outage is scheduled.
 
-    The implementation is incomplete: see comments in code below.
+    An outage is scheduled if a single scheduled outage of its
+    device/circuit, or of a device the circuit depends on, covers all of
+    it.
 
     Args:
         outage (DetectedOutage)
@@ -34,38 +222,43 @@ class UnscheduledOutageGenerator:
         bool: True if outage is scheduled
     """
     def outage_is_scheduled(self, outage):
-        # TODO: this needs to somehow consider the case of a scheduled outage
-        # from 1:00 - 2:00 with an outage from 1:00 - 2:10. Presumably, the
-        # extra 10 minutes would count against the SLA?!?! For now, if any
-        # of the outage is outside the scheduled time, the whole outage is
-        # considered unscheduled.
-        sched_outage = db_session.query(ScheduledOutage).filter(
-            ScheduledOutage.provider == outage.provider).filter(
-            ScheduledOutage.dev_or_circ_id == outage.dev_or_circ_id).filter(
-            ScheduledOutage.begin_time <= outage.begin_time).filter(
-            ScheduledOutage.end_time >= outage.end_time).first()
+        # An outage only partly inside scheduled outages is unscheduled as a
+        # whole, see split_partial for counting only the unscheduled parts.
+        # A scheduled outage of a device also covers its circuits, using the
+        # DeviceCircuits table (one device to many circuits). Work on one
+        # circuit does not take its device down, so it never covers one.
+        if self._scheduled_index is not None:
+            sched_outage = self._scheduled_index.contains(outage.provider,
+                outage.dev_or_circ_id, outage.begin_time, outage.end_time)
+        else:
+            sched_outage = db_session.query(ScheduledOutage).filter(
+                ScheduledOutage.provider == outage.provider).filter(
+                _scheduled_for(outage.dev_or_circ_id)).filter(
+                ScheduledOutage.begin_time <= outage.begin_time).filter(
+                ScheduledOutage.end_time >= outage.end_time).filter(
+                self._recent(outage.begin_time)).first()
 
         if sched_outage:
             return True
 
-        # TODO: It's possible we detected an outage with a circuit that is
-        # caused by a scheduled outage of a device or vice versa. We can use
-        # the DeviceCircuits table to map these (one device to many circuits)
-
         return False
 
     """Creates a new UnscheduledOutage and adds it to the db.
 
     Args:
         outage (DetectedOutage)
+        begin (datetime): defaults to the detected outage's begin time
+        end (datetime): defaults to the detected outage's end time
 
     Returns:
         UnscheduledOutage
     """
-    def create_unscheduled_outage(self, outage):
+    def create_unscheduled_outage(self, outage, begin=None, end=None):
         outage = UnscheduledOutage(dev_or_circ_id=outage.dev_or_circ_id,
-            begin_time=outage.begin_time, end_time=outage.end_time,
-            data=outage.data)
+            provider=outage.provider, service_id=outage.service_id,
+            begin_time=begin or outage.begin_time,
+            end_time=end or outage.end_time,
+            data=outage.data, detected_id=outage.id)
         db_session.add(outage)
         db_session.commit()
         return outage